@@ -0,0 +1,187 @@
+import re
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from app import db
+from config import current_config
+from models import AICacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Run eviction after this many writes from the current process
+EVICTION_INTERVAL = 100
+
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+
+def make_cache_key(kind, prompt_version, normalized_input):
+    """Hash the request kind, model, prompt version and normalized input into a cache key."""
+    raw = json.dumps([kind, current_config.AI_MODEL, prompt_version, normalized_input], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def normalize_subject_for_cache(subject):
+    """
+    Normalize a subject so recurring messages share a cache key.
+
+    Reply/forward prefixes, case, digits (dates, issue numbers, order IDs)
+    and whitespace differences are ignored.
+    """
+    from email_processor import normalize_subject
+
+    normalized = normalize_subject(subject).lower()
+    normalized = re.sub(r'\d+', '#', normalized)
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+def categorize_cache_input(sender, subject):
+    """Normalized input for categorization: sender address plus normalized subject."""
+    from email_processor import extract_email
+
+    address = extract_email(sender) if sender else None
+    return {"sender": address or (sender or "").lower(), "subject": normalize_subject_for_cache(subject)}
+
+def analyze_cache_input(body):
+    """Normalized input for analysis: a digest of the whitespace-collapsed body."""
+    normalized = re.sub(r'\s+', ' ', body or '').strip()
+    return {"body": hashlib.sha256(normalized.encode("utf-8")).hexdigest()}
+
+def get_cached_many(keys):
+    """
+    Look up several cache keys in one query.
+
+    Returns:
+        Dict mapping each hit key to its decoded value
+    """
+    keys = list(set(keys))
+    if not keys or not current_config.AI_CACHE_ENABLED:
+        return {}
+
+    now = datetime.utcnow()
+    results = {}
+    try:
+        entries = AICacheEntry.query.filter(
+            AICacheEntry.key.in_(keys),
+            (AICacheEntry.expires_at.is_(None)) | (AICacheEntry.expires_at > now)
+        ).all()
+
+        for entry in entries:
+            results[entry.key] = json.loads(entry.value)
+
+        if results:
+            db.session.execute(
+                update(AICacheEntry)
+                .where(AICacheEntry.key.in_(list(results.keys())))
+                .values(hit_count=func.coalesce(AICacheEntry.hit_count, 0) + 1, last_hit_at=now)
+            )
+            db.session.commit()
+
+    except Exception as e:
+        logger.error(f"Error reading AI cache: {str(e)}")
+        db.session.rollback()
+
+    with _stats_lock:
+        _stats["hits"] += len(results)
+        _stats["misses"] += len(keys) - len(results)
+
+    return results
+
+def get_cached(key):
+    """Return the cached value for a key, or None on a miss."""
+    return get_cached_many([key]).get(key)
+
+def set_cached_many(kind, values):
+    """
+    Store several responses in the cache.
+
+    Args:
+        kind: Request kind ('categorize' or 'analyze')
+        values: Dict mapping cache keys to JSON-serializable values
+    """
+    if not values or not current_config.AI_CACHE_ENABLED:
+        return
+
+    now = datetime.utcnow()
+    expires_at = now + timedelta(days=current_config.AI_CACHE_TTL_DAYS)
+    try:
+        for key, value in values.items():
+            db.session.merge(AICacheEntry(
+                key=key,
+                kind=kind,
+                value=json.dumps(value),
+                hit_count=0,
+                created_at=now,
+                last_hit_at=now,
+                expires_at=expires_at
+            ))
+        db.session.commit()
+
+    except Exception as e:
+        logger.error(f"Error writing AI cache: {str(e)}")
+        db.session.rollback()
+        return
+
+    with _stats_lock:
+        writes_before = _stats["writes"]
+        _stats["writes"] += len(values)
+        run_eviction = writes_before // EVICTION_INTERVAL != _stats["writes"] // EVICTION_INTERVAL
+
+    if run_eviction:
+        evict_cache()
+
+def set_cached(kind, key, value):
+    set_cached_many(kind, {key: value})
+
+def evict_cache():
+    """
+    Delete expired entries, then the least recently used ones beyond the size cap.
+
+    Returns:
+        Number of entries deleted
+    """
+    try:
+        deleted = AICacheEntry.query.filter(
+            AICacheEntry.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+
+        excess = AICacheEntry.query.count() - current_config.AI_CACHE_MAX_ENTRIES
+        if excess > 0:
+            oldest = db.session.query(AICacheEntry.key).order_by(
+                AICacheEntry.last_hit_at.asc()
+            ).limit(excess).subquery()
+            deleted += AICacheEntry.query.filter(
+                AICacheEntry.key.in_(db.select(oldest.c.key))
+            ).delete(synchronize_session=False)
+
+        db.session.commit()
+
+        with _stats_lock:
+            _stats["evicted"] += deleted
+
+        if deleted:
+            logger.info(f"Evicted {deleted} AI cache entries")
+        return deleted
+
+    except Exception as e:
+        logger.error(f"Error evicting AI cache: {str(e)}")
+        db.session.rollback()
+        return 0
+
+def get_cache_stats():
+    """Return hit-rate statistics for this process plus persisted entry counts."""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+
+    stats["entries"] = {
+        kind: count for kind, count in
+        db.session.query(AICacheEntry.kind, func.count(AICacheEntry.key)).group_by(AICacheEntry.kind).all()
+    }
+    stats["lifetime_hits"] = db.session.query(func.coalesce(func.sum(AICacheEntry.hit_count), 0)).scalar()
+
+    return stats
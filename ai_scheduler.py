@@ -0,0 +1,209 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import APIStatusError, APIConnectionError, APITimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio used to budget requests before they are sent
+CHARS_PER_TOKEN = 4
+
+# Completion tokens assumed when a request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+# Number of recent calls kept for latency percentiles
+LATENCY_WINDOW = 1000
+
+class RateLimiter:
+    """
+    Token bucket refilled continuously up to a per-minute capacity.
+
+    acquire() blocks until enough budget is available; consume() records usage
+    without blocking, letting the bucket go negative when a request turns out
+    to cost more than estimated.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute) if per_minute else None
+        self.available = self.capacity
+        self.refill_rate = self.capacity / 60.0 if self.capacity else None
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def acquire(self, amount=1):
+        """Block until amount can be taken from the bucket."""
+        if not self.capacity:
+            return
+
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.refill_rate
+            time.sleep(wait)
+
+    def consume(self, amount):
+        """Take amount from the bucket without waiting."""
+        if not self.capacity or not amount:
+            return
+
+        with self.lock:
+            self._refill()
+            self.available -= amount
+
+class AIRequestScheduler:
+    """
+    Runs OpenAI chat completions under shared concurrency and rate limits.
+
+    create() performs one rate-limited, retried request in the calling thread;
+    submit() fans work out to a thread pool so independent requests overlap.
+    """
+
+    def __init__(self, client, max_concurrency=4, requests_per_minute=500, tokens_per_minute=30000,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        # Retries are handled here, so disable the client's own retry loop
+        self.client = client.with_options(max_retries=0)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ai-request")
+        self._request_limiter = RateLimiter(requests_per_minute)
+        self._token_limiter = RateLimiter(tokens_per_minute)
+
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {
+            "requests": 0,
+            "failures": 0,
+            "retries": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn in the scheduler's thread pool and return a Future."""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def create(self, **kwargs):
+        """
+        Call chat.completions.create with rate limiting and retries.
+
+        Args:
+            **kwargs: Arguments passed to chat.completions.create
+
+        Returns:
+            The completion response
+        """
+        estimated_tokens = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+
+        for attempt in range(self.max_retries + 1):
+            self._request_limiter.acquire()
+            self._token_limiter.acquire(estimated_tokens)
+
+            started = time.monotonic()
+            try:
+                with self._semaphore:
+                    response = self.client.chat.completions.create(**kwargs)
+            except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._record_failure()
+                    raise
+
+                delay = self._backoff_delay(attempt, e)
+                self._record_retry()
+                logger.warning(f"OpenAI request failed ({describe_error(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started
+            usage = getattr(response, "usage", None)
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+            # Charge the difference between the estimate and the real usage
+            self._token_limiter.consume(prompt_tokens + completion_tokens - estimated_tokens)
+            self._record_success(latency, prompt_tokens, completion_tokens)
+
+            logger.debug(
+                f"OpenAI request took {latency:.2f}s "
+                f"({prompt_tokens} prompt + {completion_tokens} completion tokens)"
+            )
+            return response
+
+    def _backoff_delay(self, attempt, error):
+        """Exponential backoff with full jitter, honoring Retry-After when sent."""
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record_success(self, latency, prompt_tokens, completion_tokens):
+        with self._metrics_lock:
+            self._counters["requests"] += 1
+            self._counters["prompt_tokens"] += prompt_tokens
+            self._counters["completion_tokens"] += completion_tokens
+            self._latencies.append(latency)
+
+    def _record_failure(self):
+        with self._metrics_lock:
+            self._counters["failures"] += 1
+
+    def _record_retry(self):
+        with self._metrics_lock:
+            self._counters["retries"] += 1
+
+    def get_metrics(self):
+        """Return request counts, token usage and latency percentiles."""
+        with self._metrics_lock:
+            metrics = dict(self._counters)
+            latencies = sorted(self._latencies)
+
+        if latencies:
+            metrics["latency_avg"] = round(sum(latencies) / len(latencies), 3)
+            metrics["latency_p50"] = round(latencies[len(latencies) // 2], 3)
+            metrics["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+            metrics["latency_max"] = round(latencies[-1], 3)
+
+        return metrics
+
+def estimate_tokens(messages, max_tokens=None):
+    """Estimate the total tokens a request will use before sending it."""
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+def is_retryable(error):
+    """Retry rate limits, server errors and network failures."""
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+def get_retry_after(error):
+    """Read a Retry-After header (in seconds) from an API error, if present."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def describe_error(error):
+    status = getattr(error, "status_code", None)
+    return f"{status}: {error}" if status else str(error)
@@ -2,9 +2,22 @@ import os
 import json
 import logging
 from datetime import datetime
+from concurrent.futures import as_completed
 
 from app import db
 from models import Email, Category, Rule
+from config import current_config
+from rule_engine import apply_rules, invalidate_rules, get_compiled_rules
+from keyword_index import get_email_text
+from local_categorizer import get_local_categorizer
+from ai_scheduler import AIRequestScheduler
+from uncategorized_queue import get_uncategorized_emails, dequeue_emails, assign_categories
+from email_list import refresh_list_items
+from prompt_builder import prepare_body, compact_email, compact_json, pack_batches, count_tokens
+from ai_cache import (
+    make_cache_key, categorize_cache_input, analyze_cache_input,
+    get_cached, get_cached_many, set_cached, set_cached_many
+)
 
 # Import OpenAI API
 from openai import OpenAI
@@ -13,84 +26,209 @@ from openai import OpenAI
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 openai = OpenAI(api_key=OPENAI_API_KEY)
 
+# All OpenAI calls go through the scheduler for shared rate limits, retries and metrics
+ai_scheduler = AIRequestScheduler(
+    openai,
+    max_concurrency=current_config.AI_MAX_CONCURRENCY,
+    requests_per_minute=current_config.AI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=current_config.AI_TOKENS_PER_MINUTE,
+    max_retries=current_config.AI_MAX_RETRIES
+)
+
 logger = logging.getLogger(__name__)
 
-def categorize_uncategorized_emails(limit=100):
+# Bump these when a prompt changes so cached responses from the old prompt are ignored
+CATEGORIZE_PROMPT_VERSION = 1
+ANALYZE_PROMPT_VERSION = 2
+
+def categorize_uncategorized_emails(limit=100, use_local=None, progress=None):
     """
     Use OpenAI to categorize emails that don't have categories assigned.
     
+    Rules are applied first, then the local categorizer; only emails neither
+    can categorize confidently are sent to OpenAI.
+    
     Args:
         limit: Maximum number of emails to process at once
+        use_local: Use the local categorizer (defaults to LOCAL_CATEGORIZER_ENABLED)
+        progress: Optional callback taking (fraction, message), called as each AI batch completes
         
     Returns:
         Dict with results
     """
     try:
-        # Find emails without categories
-        uncategorized_emails = Email.query.filter(
-            ~Email.categories.any()
-        ).order_by(Email.date_sent.desc()).limit(limit).all()
+        # Read the backlog from the uncategorized queue
+        uncategorized_emails = get_uncategorized_emails(limit)
         
         if not uncategorized_emails:
             return {"success": True, "message": "No uncategorized emails to process", "categorized": 0}
         
-        # Get existing categories
-        existing_categories = Category.query.all()
-        category_names = [c.name for c in existing_categories]
-        
-        categorized_count = 0
-        
-        # Process emails in batches to avoid too large requests
-        batch_size = 10
-        for i in range(0, len(uncategorized_emails), batch_size):
-            batch = uncategorized_emails[i:i+batch_size]
+        # Apply local rules first so only unmatched emails are sent to the AI
+        # Keyword rules match the body as well as the subject, as they do at ingest
+        compiled = get_compiled_rules()
+        rule_categorized_ids = []
+        remaining_emails = []
+        for email in uncategorized_emails:
+            body_text = get_email_text(email) if compiled.keyword_rules else None
+            if apply_rules(email, body_text, compiled):
+                rule_categorized_ids.append(email.id)
+            else:
+                remaining_emails.append(email)
+        
+        rule_categorized_count = len(rule_categorized_ids)
+        if rule_categorized_count:
+            dequeue_emails(rule_categorized_ids)
+            refresh_list_items(rule_categorized_ids)
+            db.session.commit()
+        uncategorized_emails = remaining_emails
+        
+        # Index existing categories by name
+        categories_by_name = {c.name: c for c in Category.query.all()}
+        category_names = list(categories_by_name.keys())
+        
+        # Let the local model handle confident predictions; the rest escalate to the AI
+        local_categorized_count = 0
+        if use_local is None:
+            use_local = current_config.LOCAL_CATEGORIZER_ENABLED
+        
+        model = get_local_categorizer() if use_local and uncategorized_emails else None
+        if model:
+            predictions = model.predict(
+                [(email.sender, email.subject) for email in uncategorized_emails],
+                min_confidence=current_config.LOCAL_CATEGORIZER_MIN_CONFIDENCE
+            )
             
-            # Prepare email data for the model
-            email_data = []
-            for email in batch:
-                email_data.append({
-                    "id": email.id,
-                    "subject": email.subject,
-                    "sender": email.sender,
-                    "date": email.date_sent.isoformat() if email.date_sent else None
-                })
+            local_results = {}
+            for email, (predicted_names, confidence) in zip(uncategorized_emails, predictions):
+                predicted = [name for name in predicted_names if name in categories_by_name]
+                if predicted:
+                    local_results[email.id] = predicted
             
-            # Call OpenAI API to categorize emails
-            categories = categorize_emails_with_ai(email_data, category_names)
+            if local_results:
+                local_categorized_count = assign_categories(local_results, categories_by_name)
+                db.session.commit()
+                uncategorized_emails = [e for e in uncategorized_emails if e.id not in local_results]
+        
+        # Reuse cached AI answers for emails matching an earlier sender and subject pattern
+        cache_keys = {
+            email.id: make_cache_key(
+                "categorize", CATEGORIZE_PROMPT_VERSION, categorize_cache_input(email.sender, email.subject)
+            )
+            for email in uncategorized_emails
+        }
+        cached = get_cached_many(cache_keys.values())
+        cached_results = {
+            email_id: cached[key] for email_id, key in cache_keys.items() if key in cached
+        }
+        
+        cache_categorized_count = 0
+        if cached_results:
+            cache_categorized_count = assign_categories(cached_results, categories_by_name)
+            db.session.commit()
+            uncategorized_emails = [e for e in uncategorized_emails if e.id not in cached_results]
+        
+        categorized_count = rule_categorized_count + local_categorized_count + cache_categorized_count
+        
+        # Pack as many emails into each request as the prompt budget allows
+        system_prompt, user_prompt = build_categorize_prompts([], category_names)
+        batches = pack_batches(
+            [compact_email(email) for email in uncategorized_emails],
+            count_tokens(system_prompt) + count_tokens(user_prompt)
+        )
+        
+        # Send all batches concurrently; the scheduler enforces the API limits
+        futures = {}
+        for email_data in batches:
+            future = ai_scheduler.submit(categorize_emails_with_ai, email_data, category_names)
+            futures[future] = {item["id"] for item in email_data}
+        
+        # Apply results on this thread as each batch completes
+        for completed, future in enumerate(as_completed(futures), 1):
+            batch_ids = futures[future]
+            categories = clean_ai_categories(future.result(), batch_ids)
             
             # Process results
-            for email_id, assigned_categories in categories.items():
-                email = next((e for e in batch if e.id == email_id), None)
-                if not email:
-                    continue
-                
-                # Assign categories
-                for category_name in assigned_categories:
-                    category = next((c for c in existing_categories if c.name == category_name), None)
-                    if not category:
-                        # Create new category if it doesn't exist
-                        category = Category(name=category_name)
-                        db.session.add(category)
-                        existing_categories.append(category)
-                    
-                    email.categories.append(category)
-                    category.assigned_count += 1
-                
-                categorized_count += 1
+            categorized_count += assign_categories(categories, categories_by_name)
             
             # Commit after each batch
             db.session.commit()
+            
+            # Remember the answers for future emails with the same sender and subject pattern
+            set_cached_many("categorize", {
+                cache_keys[email_id]: assigned_categories
+                for email_id, assigned_categories in categories.items()
+                if email_id in cache_keys
+            })
+            
+            if progress:
+                progress(completed / len(futures), f"Categorized {completed} of {len(futures)} batches")
         
         return {
             "success": True, 
-            "message": f"Categorized {categorized_count} emails", 
-            "categorized": categorized_count
+            "message": (
+                f"Categorized {categorized_count} emails "
+                f"({rule_categorized_count} by rules, {local_categorized_count} by local model, "
+                f"{cache_categorized_count} from cache)"
+            ), 
+            "categorized": categorized_count,
+            "rule_categorized": rule_categorized_count,
+            "local_categorized": local_categorized_count,
+            "cache_categorized": cache_categorized_count
         }
         
     except Exception as e:
         logger.error(f"Error categorizing emails: {str(e)}")
+        db.session.rollback()
         return {"success": False, "message": f"Error: {str(e)}"}
 
+def clean_ai_categories(categories, email_ids):
+    """
+    Keep only well-formed results for emails that were actually in the request.
+    
+    Args:
+        categories: Dict returned by the model, mapping email IDs to category names
+        email_ids: Set of email IDs sent in the request
+        
+    Returns:
+        Dict mapping email IDs to de-duplicated lists of category names
+    """
+    cleaned = {}
+    for email_id, names in (categories or {}).items():
+        if email_id not in email_ids or not isinstance(names, list):
+            continue
+        names = list(dict.fromkeys(name.strip() for name in names if isinstance(name, str) and name.strip()))
+        if names:
+            cleaned[email_id] = names
+    return cleaned
+
+def build_categorize_prompts(email_data, existing_categories):
+    """
+    Build the system and user prompts for a categorization request.
+    
+    Emails are listed one compact JSON object per line to keep input tokens down.
+    
+    Returns:
+        Tuple of (system prompt, user prompt)
+    """
+    system_prompt = (
+        "You are an AI email categorization expert. Your task is to assign appropriate categories "
+        "to each email based on the subject, sender, and other available information. "
+        f"Here are the existing categories: {', '.join(existing_categories)}. "
+        "You can use these categories or suggest new ones if needed. "
+        "For each email, provide 1-3 relevant categories."
+    )
+    
+    user_prompt = (
+        "Please categorize the following emails. For each email, provide the email ID and "
+        "a list of 1-3 relevant categories. Return your response as a JSON object where keys are "
+        "email IDs and values are arrays of category names. Example format: "
+        '{"email_id_1": ["Category1", "Category2"], "email_id_2": ["Category3"]}\n\n'
+        "Emails to categorize, one per line:\n"
+        + "\n".join(compact_json(item) for item in email_data)
+    )
+    
+    return system_prompt, user_prompt
+
 def categorize_emails_with_ai(email_data, existing_categories):
     """
     Call OpenAI API to categorize a batch of emails.
@@ -103,26 +241,10 @@ def categorize_emails_with_ai(email_data, existing_categories):
         Dict mapping email IDs to assigned categories
     """
     try:
-        # Create system prompt
-        system_prompt = (
-            "You are an AI email categorization expert. Your task is to assign appropriate categories "
-            "to each email based on the subject, sender, and other available information. "
-            f"Here are the existing categories: {existing_categories}. "
-            "You can use these categories or suggest new ones if needed. "
-            "For each email, provide 1-3 relevant categories."
-        )
-        
-        # Create user prompt with email data
-        user_prompt = (
-            "Please categorize the following emails. For each email, provide the email ID and "
-            "a list of 1-3 relevant categories. Return your response as a JSON object where keys are "
-            "email IDs and values are arrays of category names. Example format: "
-            '{"email_id_1": ["Category1", "Category2"], "email_id_2": ["Category3"]}\n\n'
-            f"Emails to categorize: {json.dumps(email_data, indent=2)}"
-        )
+        system_prompt, user_prompt = build_categorize_prompts(email_data, existing_categories)
         
         # Call OpenAI API
-        response = openai.chat.completions.create(
+        response = ai_scheduler.create(
             model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -173,6 +295,7 @@ def suggest_rules(limit=5):
         
         # Create new rules in the database
         created_rules = []
+        new_rules = []
         for rule_data in suggested_rules:
             # Check if similar rule already exists
             existing_rule = Rule.query.filter_by(
@@ -190,9 +313,18 @@ def suggest_rules(limit=5):
                 )
                 db.session.add(new_rule)
                 created_rules.append(rule_data)
+                new_rules.append(new_rule)
         
         db.session.commit()
         
+        if new_rules:
+            invalidate_rules()
+            
+            # Apply the new rules to existing emails in the background
+            from rule_backfill import start_rule_backfill
+            for new_rule in new_rules:
+                start_rule_backfill(new_rule.id)
+        
         return {
             "success": True,
             "message": f"Created {len(created_rules)} new rules",
@@ -241,7 +373,7 @@ def suggest_rules_with_ai(email_data, limit=5):
         )
         
         # Call OpenAI API
-        response = openai.chat.completions.create(
+        response = ai_scheduler.create(
             model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -259,22 +391,37 @@ def suggest_rules_with_ai(email_data, limit=5):
         logger.error(f"Error calling OpenAI API: {str(e)}")
         return []
 
-def analyze_email_content(email_id):
+def analyze_email_content(email_id, force=False):
     """
-    Use OpenAI to analyze the content of an email and extract important information.
+    Analyze the content of an email and store the result.
+    
+    A stored analysis is returned without calling OpenAI unless it was
+    produced by an older prompt or force is set.
     
     Args:
         email_id: ID of the email to analyze
+        force: Re-analyze even if a stored analysis exists
         
     Returns:
         Dict with extracted information
     """
     from models import Email
     from storage import load_email_body
+    from email_analysis import get_stored_analysis, save_analysis, serialize_analysis
     
     try:
+        if not force:
+            analysis = get_stored_analysis(email_id, ANALYZE_PROMPT_VERSION)
+            if analysis:
+                return {
+                    "success": True,
+                    "message": "Email analyzed successfully",
+                    "analysis": analysis,
+                    "stored": True
+                }
+        
         # Get email
-        email = Email.query.get(email_id)
+        email = db.session.get(Email, email_id)
         if not email:
             return {"success": False, "message": "Email not found"}
         
@@ -283,25 +430,44 @@ def analyze_email_content(email_id):
         if not body_content:
             return {"success": False, "message": "Email body not found"}
         
+        # Send only the new text: no markup, quoted replies or disclaimers, within the token budget
+        body_text = prepare_body(body_content, email.format)
+        
         # Prepare email data
         email_data = {
             "subject": email.subject,
             "sender": email.sender,
             "date": email.date_sent.isoformat() if email.date_sent else None,
-            "body": body_content
+            "body": body_text
         }
         
-        # Call OpenAI API to analyze email
-        analysis = analyze_email_with_ai(email_data)
+        # Identical bodies (e.g. repeated notifications) reuse a cached analysis
+        cache_key = make_cache_key("analyze", ANALYZE_PROMPT_VERSION, analyze_cache_input(body_text))
+        analysis = get_cached(cache_key)
+        cached = analysis is not None
+        
+        if not cached:
+            # Call OpenAI API to analyze email
+            analysis = analyze_email_with_ai(email_data)
+            if analysis:
+                set_cached("analyze", cache_key, analysis)
+        
+        if not analysis:
+            return {"success": False, "message": "AI analysis failed"}
+        
+        record = save_analysis(email_id, analysis, ANALYZE_PROMPT_VERSION)
         
         return {
             "success": True,
             "message": "Email analyzed successfully",
-            "analysis": analysis
+            "analysis": serialize_analysis(record),
+            "stored": False,
+            "cached": cached
         }
         
     except Exception as e:
         logger.error(f"Error analyzing email: {str(e)}")
+        db.session.rollback()
         return {"success": False, "message": f"Error: {str(e)}"}
 
 def analyze_email_with_ai(email_data):
@@ -338,7 +504,7 @@ def analyze_email_with_ai(email_data):
         )
         
         # Call OpenAI API
-        response = openai.chat.completions.create(
+        response = ai_scheduler.create(
             model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -1,7 +1,8 @@
 import os
 import logging
-from flask import Flask, session, redirect, url_for, request, render_template, jsonify
+from flask import Flask, session, redirect, url_for, request, render_template, jsonify, abort, make_response
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -34,6 +35,13 @@ print(f"Using database URL: {database_url}")
 # Initialize the database with the app
 db.init_app(app)
 
+# Schema migrations for existing databases ('flask db upgrade'); batch mode lets SQLite alter tables
+migrate = Migrate(app, db, render_as_batch=True)
+
+# Conditional GETs, gzip/brotli compression and static file Cache-Control
+from http_cache import init_http_cache
+init_http_cache(app)
+
 # Create all tables
 with app.app_context():
     # Import models here to ensure they're registered before creating tables
@@ -165,55 +173,208 @@ def register_routes(app):
     @app.route('/accounts/delete/<int:account_id>', methods=['POST'])
     def delete_account(account_id):
         from models import EmailAccount
+        from imap_pool import imap_pool
+        from token_manager import token_manager
         account = EmailAccount.query.get_or_404(account_id)
         db.session.delete(account)
         db.session.commit()
+        imap_pool.close_account(account_id)
+        token_manager.forget(account_id)
         return redirect(url_for('list_accounts'))
     
     # Email viewing routes
-    @app.route('/emails', methods=['GET'])
-    def list_emails():
-        from models import Email
-        page = request.args.get('page', 1, type=int)
-        per_page = 50
+    def filter_email_query(args):
+        """Build the inbox row query for the /emails filters in request arguments."""
+        from models import Email, EmailListItem
+        from sqlalchemy import select
         
         # Get filter parameters
-        category = request.args.get('category')
-        sender = request.args.get('sender')
-        subject = request.args.get('subject')
+        category = args.get('category')
+        sender = args.get('sender')
+        subject = args.get('subject')
+        
+        # Rows come from the email_list_item projection, read in date index order
+        query = EmailListItem.query
+        if not (category or sender or subject):
+            return query
         
-        # Build query
-        query = Email.query
+        # Filters run on the email table's indexes and restrict the rows by ID
+        matching = select(Email.id)
         if category:
-            query = query.filter(Email.categories.contains(category))
+            # The category and its subcategories, through the closure table
+            from category_tree import filter_by_category
+            matching = filter_by_category(matching, category)
+        # Substring filters are served by trigram indexes
+        from trigram_index import filter_contains
         if sender:
-            query = query.filter(Email.sender.ilike(f'%{sender}%'))
+            matching = filter_contains(matching, 'sender', sender)
         if subject:
-            query = query.filter(Email.subject.ilike(f'%{subject}%'))
+            matching = filter_contains(matching, 'subject', subject)
+        return query.filter(EmailListItem.id.in_(matching))
+    
+    @app.route('/emails', methods=['GET'])
+    def list_emails():
+        from models import EmailListItem
+        from pagination import paginate_emails
+        from category_tree import get_category_signature
+        from http_cache import get_list_validators, not_modified, set_validators
+        
+        # Unchanged since the client's copy (the dashboard polls this) - answer before running the page query
+        validators = get_list_validators(get_category_signature())
+        cached = not_modified(*validators)
+        if cached:
+            return cached
+        
+        # Keyset pagination - each page seeks past the previous one instead of using OFFSET
+        try:
+            emails = paginate_emails(
+                filter_email_query(request.args),
+                per_page=50,
+                cursor=request.args.get('cursor'),
+                ascending=request.args.get('sort') == 'date_asc',
+                count=request.args.get('count', 'approximate'),
+                model=EmailListItem
+            )
+        except ValueError:
+            abort(400)
         
-        # Order by date, newest first
-        emails = query.order_by(Email.date_sent.desc()).paginate(page=page, per_page=per_page)
+        from category_tree import get_category_tree
+        categories = get_category_tree().ordered
         
-        return render_template('emails.html', emails=emails)
+        response = make_response(render_template('emails.html', emails=emails, categories=categories))
+        return set_validators(response, *validators)
+    
+    @app.route('/api/emails', methods=['GET'])
+    def list_emails_api():
+        from models import EmailListItem
+        from pagination import paginate_emails
+        from http_cache import get_list_validators, not_modified, set_validators
+        validators = get_list_validators()
+        cached = not_modified(*validators)
+        if cached:
+            return cached
+        
+        try:
+            emails = paginate_emails(
+                filter_email_query(request.args),
+                per_page=request.args.get('per_page', 50, type=int),
+                cursor=request.args.get('cursor'),
+                ascending=request.args.get('sort') == 'date_asc',
+                count=request.args.get('count', 'none'),
+                model=EmailListItem
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        response = jsonify({'success': True, 'emails': [item.to_dict() for item in emails.items], **emails.to_dict()})
+        return set_validators(response, *validators)
+    
+    @app.route('/api/threads/<string:thread_id>/emails', methods=['GET'])
+    def list_thread_emails_api(thread_id):
+        from models import Email
+        from email_queries import email_list_query, to_list_rows
+        from pagination import paginate_emails
+        try:
+            emails = paginate_emails(
+                email_list_query().filter(Email.thread_id == thread_id),
+                per_page=request.args.get('per_page', 50, type=int),
+                cursor=request.args.get('cursor'),
+                ascending=True,
+                count=request.args.get('count', 'none')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        rows = to_list_rows(emails.items)
+        return jsonify({'success': True, 'emails': [row.to_dict() for row in rows], **emails.to_dict()})
+    
+    @app.route('/emails/autocomplete/senders', methods=['GET'])
+    def autocomplete_senders():
+        from trigram_index import autocomplete
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        return jsonify({'success': True, 'suggestions': autocomplete('sender', query, limit)})
+    
+    @app.route('/emails/autocomplete/subjects', methods=['GET'])
+    def autocomplete_subjects():
+        from trigram_index import autocomplete
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        return jsonify({'success': True, 'suggestions': autocomplete('subject', query, limit)})
     
     @app.route('/email/<string:email_id>', methods=['GET'])
     def view_email(email_id):
-        from models import Email
-        email = Email.query.get_or_404(email_id)
+        from email_queries import get_email_detail
+        from http_cache import get_email_validators, not_modified, set_validators
+        
+        # Email content doesn't change after ingest, so repeat views are answered with 304
+        # before the email is loaded or its body file read
+        validators = get_email_validators(email_id)
+        cached = not_modified(*validators)
+        if cached:
+            return cached
+        
+        # Thread, categories and attachments are loaded up front
+        email = get_email_detail(email_id)
         
         # Load email body content
         from storage import load_email_body
         body_content = load_email_body(email.body_id, email.format)
         
-        return render_template('email_view.html', email=email, body_content=body_content)
+        # Show a stored AI analysis without calling the API
+        from email_analysis import get_stored_analysis
+        analysis = get_stored_analysis(email_id)
+        
+        response = make_response(render_template('email_view.html', email=email, body_content=body_content, analysis=analysis))
+        return set_validators(response, *validators)
+    
+    @app.route('/email/<string:email_id>/read', methods=['POST'])
+    def mark_email_read(email_id):
+        from models import Email
+        from thread_summary import set_read_state
+        Email.query.get_or_404(email_id)
+        
+        # read=0 marks the email unread again
+        set_read_state([email_id], request.form.get('read', '1') != '0')
+        db.session.commit()
+        
+        return redirect(url_for('view_email', email_id=email_id))
+    
+    @app.route('/api/emails/read', methods=['POST'])
+    def mark_emails_read_api():
+        from thread_summary import set_read_state
+        data = request.get_json(silent=True) or {}
+        email_ids = data.get('ids')
+        if not isinstance(email_ids, list):
+            return jsonify({'success': False, 'message': 'ids must be a list of email IDs'}), 400
+        
+        changed = set_read_state(email_ids, bool(data.get('read', True)))
+        db.session.commit()
+        return jsonify({'success': True, 'changed': changed})
+    
+    @app.route('/api/threads/<string:thread_id>', methods=['GET'])
+    def thread_summary_api(thread_id):
+        from models import Thread
+        thread = Thread.query.get_or_404(thread_id)
+        return jsonify({'success': True, 'thread': thread.to_dict()})
     
     @app.route('/thread/<string:thread_id>', methods=['GET'])
     def view_thread(thread_id):
-        from models import Thread, Email
-        thread = Thread.query.get_or_404(thread_id)
+        from email_queries import get_thread, thread_email_query
+        from pagination import paginate_emails
+        thread = get_thread(thread_id)
         
-        # Get all emails in this thread, ordered by date
-        emails = Email.query.filter(Email.thread_id == thread_id).order_by(Email.date_sent).all()
+        # Emails in this thread, oldest first, a page at a time, with their attachments;
+        # the header comes from the thread's summary aggregates rather than counting emails
+        try:
+            emails = paginate_emails(
+                thread_email_query(thread_id),
+                per_page=50,
+                cursor=request.args.get('cursor'),
+                ascending=True
+            )
+        except ValueError:
+            abort(400)
         
         return render_template('thread_view.html', thread=thread, emails=emails)
     
@@ -221,8 +382,11 @@ def register_routes(app):
     @app.route('/categories', methods=['GET'])
     def list_categories():
         from models import Category
-        categories = Category.query.all()
-        return render_template('categories.html', categories=categories)
+        from category_tree import get_category_tree
+        # Hierarchy from the cached tree; only the counts are read fresh
+        categories = get_category_tree().ordered
+        counts = dict(db.session.query(Category.id, Category.assigned_count).all())
+        return render_template('categories.html', categories=categories, counts=counts)
     
     @app.route('/categories/add', methods=['POST'])
     def add_category():
@@ -243,9 +407,19 @@ def register_routes(app):
     def delete_category(category_id):
         from models import Category
         category = Category.query.get_or_404(category_id)
+        email_ids = [email.id for email in category.emails]
         db.session.delete(category)
         db.session.commit()
         
+        # Emails left without any category go back on the uncategorized queue
+        from uncategorized_queue import requeue_if_uncategorized
+        requeue_if_uncategorized(email_ids)
+        
+        # Drop the category's name from its emails' list rows
+        from email_list import refresh_list_items
+        refresh_list_items(email_ids)
+        db.session.commit()
+        
         return redirect(url_for('list_categories'))
     
     # Rule management
@@ -273,6 +447,13 @@ def register_routes(app):
         db.session.add(rule)
         db.session.commit()
         
+        from rule_engine import invalidate_rules
+        invalidate_rules()
+        
+        # Apply the new rule to existing emails in the background
+        from rule_backfill import start_rule_backfill
+        start_rule_backfill(rule.id)
+        
         return redirect(url_for('list_rules'))
     
     @app.route('/rules/delete/<int:rule_id>', methods=['POST'])
@@ -282,60 +463,142 @@ def register_routes(app):
         db.session.delete(rule)
         db.session.commit()
         
+        from rule_engine import invalidate_rules
+        invalidate_rules()
+        
         return redirect(url_for('list_rules'))
     
+    @app.route('/rules/<int:rule_id>/apply', methods=['POST'])
+    def apply_rule(rule_id):
+        from models import Rule
+        from rule_backfill import start_rule_backfill, get_backfill_status
+        rule = Rule.query.get_or_404(rule_id)
+        backfill = start_rule_backfill(rule.id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Applying rule {rule.id} to existing emails',
+            'backfill': get_backfill_status(backfill)
+        })
+    
+    @app.route('/rules/backfill/<int:backfill_id>', methods=['GET'])
+    def rule_backfill_status(backfill_id):
+        from models import RuleBackfill
+        from rule_backfill import get_backfill_status
+        backfill = RuleBackfill.query.get_or_404(backfill_id)
+        
+        return jsonify({
+            'success': backfill.status != 'failed',
+            'backfill': get_backfill_status(backfill)
+        })
+    
     # Email processing
     @app.route('/process/refresh', methods=['POST'])
     def refresh_emails():
-        from email_processor import process_new_emails
-        result = process_new_emails()
+        from job_queue import submit_job, PRIORITY_HIGH
+        result = submit_job('sync_all', priority=PRIORITY_HIGH)
         
-        return jsonify({
-            'success': result['success'],
-            'message': result['message'],
-            'processed': result.get('processed', 0)
-        })
+        return jsonify(result)
         
     @app.route('/accounts/<int:account_id>/sync', methods=['POST'])
     def sync_account(account_id):
         from models import EmailAccount
-        from email_processor import process_account_emails
-        from datetime import datetime
+        from job_queue import submit_job, PRIORITY_HIGH
         
         account = EmailAccount.query.get_or_404(account_id)
-        result = process_account_emails(account)
+        result = submit_job('sync_account', {'account_id': account.id}, priority=PRIORITY_HIGH)
         
-        # Update last sync time
-        account.last_sync = datetime.utcnow()
-        db.session.commit()
-        
-        return jsonify({
-            'success': result['success'],
-            'message': result['message'],
-            'processed': result.get('processed', 0)
-        })
+        return jsonify(result)
     
     # AI operations
     @app.route('/ai/categorize', methods=['POST'])
     def ai_categorize():
-        from ai_service import categorize_uncategorized_emails
-        result = categorize_uncategorized_emails()
+        from job_queue import submit_job
+        result = submit_job('categorize', {'limit': 100})
         
-        return jsonify({
-            'success': result['success'],
-            'message': result['message'],
-            'categorized': result.get('categorized', 0)
-        })
+        return jsonify(result)
+    
+    @app.route('/ai/train-categorizer', methods=['POST'])
+    def ai_train_categorizer():
+        from job_queue import submit_job
+        result = submit_job('train_categorizer')
+        
+        return jsonify(result)
     
     @app.route('/ai/suggest-rules', methods=['POST'])
     def ai_suggest_rules():
-        from ai_service import suggest_rules
-        result = suggest_rules()
+        from job_queue import submit_job
+        result = submit_job('suggest_rules', {'limit': 5})
+        
+        return jsonify(result)
+    
+    # Background jobs
+    @app.route('/jobs', methods=['GET'])
+    def list_jobs():
+        from models import Job
+        from job_queue import get_job_status
+        
+        query = Job.query
+        status = request.args.get('status')
+        if status:
+            query = query.filter(Job.status == status)
+        kind = request.args.get('kind')
+        if kind:
+            query = query.filter(Job.kind == kind)
+        
+        limit = min(request.args.get('limit', 50, type=int), 200)
+        jobs = query.order_by(Job.id.desc()).limit(limit).all()
         
         return jsonify({
-            'success': result['success'],
-            'message': result['message'],
-            'rules': result.get('rules', [])
+            'success': True,
+            'jobs': [get_job_status(job) for job in jobs]
+        })
+    
+    @app.route('/jobs/<int:job_id>', methods=['GET'])
+    def job_status(job_id):
+        from models import Job
+        from job_queue import get_job_status
+        job = Job.query.get_or_404(job_id)
+        
+        return jsonify({
+            'success': True,
+            'job': get_job_status(job)
+        })
+    
+    @app.route('/ai/analyze/<string:email_id>', methods=['POST'])
+    def ai_analyze_email(email_id):
+        from ai_service import analyze_email_content
+        force = request.args.get('force', 'false').lower() == 'true'
+        result = analyze_email_content(email_id, force=force)
+        return jsonify(result)
+    
+    @app.route('/ai/analysis/<string:email_id>', methods=['GET'])
+    def ai_get_analysis(email_id):
+        from email_analysis import get_stored_analysis
+        analysis = get_stored_analysis(email_id)
+        if not analysis:
+            return jsonify({'success': False, 'message': 'Email has not been analyzed'}), 404
+        return jsonify({'success': True, 'analysis': analysis})
+    
+    @app.route('/ai/preanalysis', methods=['GET'])
+    def ai_preanalysis_status():
+        from email_analysis import get_preanalysis_status
+        return jsonify({'success': True, 'status': get_preanalysis_status()})
+    
+    @app.route('/ai/metrics', methods=['GET'])
+    def ai_metrics():
+        from ai_service import ai_scheduler
+        return jsonify({
+            'success': True,
+            'metrics': ai_scheduler.get_metrics()
+        })
+    
+    @app.route('/ai/cache', methods=['GET'])
+    def ai_cache_stats():
+        from ai_cache import get_cache_stats
+        return jsonify({
+            'success': True,
+            'cache': get_cache_stats()
         })
     
     # Search
@@ -345,11 +608,17 @@ def register_routes(app):
         if not query:
             return render_template('search.html', results=None)
         
-        from models import Email
-        # Simple search in email subjects and senders
-        results = Email.query.filter(
-            (Email.subject.contains(query)) | 
-            (Email.sender.contains(query))
-        ).order_by(Email.date_sent.desc()).limit(100).all()
+        from config import current_config
+        if current_config.SEARCH_ENGINE == 'index':
+            from inverted_index import search_inverted_index
+            # Boolean and field-scoped search (from:, subject:, has:attachment, category:), newest first
+            results = search_inverted_index(query, limit=100)
+        else:
+            from fulltext_search import search_emails
+            # Ranked full-text search over subjects, senders and bodies
+            results = search_emails(query, limit=100)
+        
+        from email_queries import to_list_rows
+        results = to_list_rows(results)
         
         return render_template('search.html', results=results, query=query)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot query paths before and after the index migrations.
+
+Seeds a throwaway database with synthetic mail, downgrades it to the schema
+without indexes, times each query, upgrades it with 'flask db upgrade' and
+times them again.
+
+Usage:
+    python benchmark.py --database sqlite:////tmp/benchmark.db --emails 1000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+SEED_BATCH_SIZE = 10000
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark query timings before and after the index migrations")
+    parser.add_argument("--database", required=True, help="Database URL to seed; its contents are replaced")
+    parser.add_argument("--emails", type=int, default=1000000, help="Number of emails to seed")
+    parser.add_argument("--accounts", type=int, default=5, help="Number of accounts to spread emails across")
+    parser.add_argument("--categories", type=int, default=50, help="Number of categories")
+    parser.add_argument("--emails-per-thread", type=int, default=5, help="Average thread length")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query")
+    return parser.parse_args()
+
+
+def seed(db, args):
+    """Insert synthetic accounts, categories, threads, emails and category links."""
+    from models import EmailAccount, Category, Thread, Email, email_categories
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    span_seconds = 365 * 24 * 3600
+
+    db.session.execute(EmailAccount.__table__.insert(), [
+        {"id": i + 1, "email": f"user{i}@example.com", "account_type": "gmail"}
+        for i in range(args.accounts)
+    ])
+    db.session.execute(Category.__table__.insert(), [
+        {"id": i + 1, "name": f"Category {i}", "assigned_count": 0}
+        for i in range(args.categories)
+    ])
+
+    senders = [f"sender{i}@domain{i % 500}.com" for i in range(20000)]
+    sample_email_ids = []
+    thread_count = max(1, args.emails // args.emails_per_thread)
+    threads = []
+    for start in range(0, thread_count, SEED_BATCH_SIZE):
+        rows = []
+        for i in range(start, min(thread_count, start + SEED_BATCH_SIZE)):
+            last_date = now - timedelta(seconds=rng.randrange(span_seconds))
+            rows.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "subject": f"Subject {i}",
+                "date_started": last_date - timedelta(days=rng.randrange(7)),
+                "last_date": last_date
+            })
+        db.session.execute(Thread.__table__.insert(), rows)
+        threads.extend((row["id"], row["subject"], row["last_date"]) for row in rows)
+
+    for start in range(0, args.emails, SEED_BATCH_SIZE):
+        email_rows = []
+        link_rows = []
+        for i in range(start, min(args.emails, start + SEED_BATCH_SIZE)):
+            email_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            if i % 1000 == 0:
+                sample_email_ids.append(email_id)
+            thread_id, subject, last_date = threads[rng.randrange(len(threads))]
+            email_rows.append({
+                "id": email_id,
+                "account_id": rng.randrange(args.accounts) + 1,
+                "message_id": f"<{i}@example.com>",
+                "sender": senders[rng.randrange(len(senders))],
+                "subject": subject,
+                "date_sent": last_date - timedelta(seconds=rng.randrange(7 * 24 * 3600)),
+                "thread_id": thread_id,
+                "format": "text"
+            })
+            # Most emails have one category, a few have none
+            if rng.random() < 0.9:
+                link_rows.append({"email_id": email_id, "category_id": rng.randrange(args.categories) + 1})
+
+        db.session.execute(Email.__table__.insert(), email_rows)
+        db.session.execute(email_categories.insert(), link_rows)
+        db.session.commit()
+        print(f"  seeded {min(args.emails, start + SEED_BATCH_SIZE)}/{args.emails} emails", end="\r", flush=True)
+
+    print()
+    return threads, senders, sample_email_ids
+
+
+def build_queries(db, args, threads, senders, sample_email_ids):
+    """Return (name, fn(rng)) pairs mirroring the queries in the app, processor and AI service."""
+    from sqlalchemy import func
+    from models import Email, Thread, Category, email_categories
+
+    week_ago = datetime.utcnow() - timedelta(days=7)
+
+    def duplicate_check(rng):
+        # email_processor.process_email
+        Email.query.filter_by(message_id=f"<{rng.randrange(args.emails)}@example.com>").first()
+
+    def thread_match(rng):
+        # email_processor.find_or_create_thread
+        _, subject, _ = threads[rng.randrange(len(threads))]
+        Thread.query.join(Email).filter(
+            Thread.subject == subject,
+            Thread.last_date > week_ago
+        ).order_by(Thread.last_date.desc()).first()
+
+    def thread_view(rng):
+        # app.view_thread
+        thread_id, _, _ = threads[rng.randrange(len(threads))]
+        Email.query.filter(Email.thread_id == thread_id).order_by(Email.date_sent).all()
+
+    def category_page(rng):
+        # app.list_emails with a category filter
+        category = db.session.get(Category, rng.randrange(args.categories) + 1)
+        Email.query.filter(Email.categories.contains(category)).order_by(Email.date_sent.desc()).limit(50).all()
+
+    def email_categories_lookup(rng):
+        # Loading email.categories for an email
+        email_id = sample_email_ids[rng.randrange(len(sample_email_ids))]
+        db.session.query(email_categories.c.category_id).filter(email_categories.c.email_id == email_id).all()
+
+    def sender_lookup(rng):
+        # Sender rules and contact history
+        Email.query.filter(Email.sender == senders[rng.randrange(len(senders))]).limit(100).all()
+
+    def arrival_rate(rng):
+        # sync_scheduler.get_arrival_rate
+        since = datetime.utcnow() - timedelta(days=rng.randrange(1, 30))
+        db.session.query(func.count(Email.id)).filter(
+            Email.account_id == rng.randrange(args.accounts) + 1,
+            Email.date_sent >= since
+        ).scalar()
+
+    def recent_categorized(rng):
+        # ai_service.suggest_rules
+        db.session.query(Email).filter(Email.categories.any()).order_by(Email.date_sent.desc()).limit(100).all()
+
+    return [
+        ("duplicate check by message_id", duplicate_check),
+        ("thread match by subject", thread_match),
+        ("thread view", thread_view),
+        ("category page", category_page),
+        ("categories of an email", email_categories_lookup),
+        ("emails from a sender", sender_lookup),
+        ("account arrival rate", arrival_rate),
+        ("recent categorized emails", recent_categorized),
+    ]
+
+
+def time_queries(db, queries, repeat):
+    """Return the median milliseconds per query, after one warm-up run each."""
+    timings = {}
+    for name, fn in queries:
+        rng = random.Random(name)
+        fn(rng)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(rng)
+            samples.append((time.perf_counter() - start) * 1000)
+            db.session.rollback()
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database
+
+    # Importing the app creates every table at the current schema
+    from app import app, db
+    from flask_migrate import stamp, upgrade, downgrade
+    from models import Email
+
+    with app.app_context():
+        if db.session.query(Email.id).first() is not None:
+            print(f"{args.database} already contains emails; use an empty database.")
+            sys.exit(1)
+
+        # Start from the schema before the index migrations
+        stamp(directory=MIGRATIONS_DIR)
+        downgrade(directory=MIGRATIONS_DIR, revision="base")
+
+        print(f"Seeding {args.emails} emails...")
+        start = time.perf_counter()
+        threads, senders, sample_email_ids = seed(db, args)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+        queries = build_queries(db, args, threads, senders, sample_email_ids)
+
+        print("Timing queries without indexes...")
+        before = time_queries(db, queries, args.repeat)
+
+        print("Applying migrations...")
+        db.session.remove()
+        start = time.perf_counter()
+        upgrade(directory=MIGRATIONS_DIR)
+        print(f"Migrated in {time.perf_counter() - start:.1f}s")
+
+        print("Timing queries with indexes...")
+        after = time_queries(db, queries, args.repeat)
+
+    print()
+    print(f"{'Query':<32} {'Before (ms)':>12} {'After (ms)':>12} {'Speedup':>9}")
+    for name, _ in queries:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<32} {before[name]:>12.2f} {after[name]:>12.2f} {speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import logging
+import threading
+
+from sqlalchemy import func, select, false, event, inspect
+
+from app import db
+from models import Email, Category, email_categories, category_closure
+
+logger = logging.getLogger(__name__)
+
+class CategoryNode:
+    """A category in the cached tree, with the same hierarchy attributes as Category."""
+
+    def __init__(self, id, name, parent_id):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.parent = None
+        self.subcategories = []
+        self.depth = 0
+
+class CategoryTree:
+    """In-memory category hierarchy, loaded with one query."""
+
+    def __init__(self, rows, signature=None):
+        self.signature = signature
+        self.nodes = {id: CategoryNode(id, name, parent_id) for id, name, parent_id in rows}
+        self.by_name = {node.name.lower(): node for node in self.nodes.values()}
+        self.roots = []
+
+        for node in self.nodes.values():
+            parent = self.nodes.get(node.parent_id)
+            if parent is None:
+                self.roots.append(node)
+            else:
+                node.parent = parent
+                parent.subcategories.append(node)
+
+        for node in self.nodes.values():
+            node.subcategories.sort(key=lambda child: child.name.lower())
+        self.roots.sort(key=lambda root: root.name.lower())
+
+        # Depth-first order, each category followed by its subtree
+        self.ordered = []
+        stack = list(reversed(self.roots))
+        while stack:
+            node = stack.pop()
+            node.depth = node.parent.depth + 1 if node.parent else 0
+            self.ordered.append(node)
+            stack.extend(reversed(node.subcategories))
+
+    def get(self, category_id):
+        return self.nodes.get(category_id)
+
+    def find(self, value):
+        """Find a category by ID or, failing that, by name ignoring case."""
+        if not value:
+            return None
+        if str(value).isdigit() and int(value) in self.nodes:
+            return self.nodes[int(value)]
+        return self.by_name.get(str(value).lower())
+
+_tree = None
+_tree_lock = threading.Lock()
+
+def get_category_signature():
+    """Return a cheap fingerprint of the Category table, to notice categories changed by other processes."""
+    return tuple(db.session.query(
+        func.count(Category.id), func.max(Category.id), func.max(Category.updated_at)
+    ).one())
+
+def get_category_tree():
+    """Return the cached category tree, reloading it if categories were added, removed, renamed or moved."""
+    global _tree
+
+    signature = get_category_signature()
+    if _tree is not None and _tree.signature == signature:
+        return _tree
+
+    with _tree_lock:
+        if _tree is None or _tree.signature != signature:
+            rows = db.session.query(Category.id, Category.name, Category.parent_id).all()
+            _tree = CategoryTree(rows, signature)
+        return _tree
+
+def invalidate_category_tree():
+    """Drop the cached tree so the next lookup reloads it."""
+    global _tree
+    with _tree_lock:
+        _tree = None
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_delete')
+def invalidate_on_change(mapper, connection, category):
+    invalidate_category_tree()
+
+@event.listens_for(Category, 'after_update')
+def invalidate_on_rename_or_move(mapper, connection, category):
+    # assigned_count changes on every categorized email and isn't part of the tree
+    state = inspect(category)
+    if state.attrs.name.history.has_changes() or state.attrs.parent_id.history.has_changes():
+        invalidate_category_tree()
+
+def resolve_category(value):
+    """Find a category by ID or, failing that, by name ignoring case."""
+    return get_category_tree().find(value)
+
+def get_subtree_email_ids(category_id):
+    """Select the IDs of emails in a category or any of its descendants."""
+    return select(email_categories.c.email_id).join(
+        category_closure, category_closure.c.descendant_id == email_categories.c.category_id
+    ).where(category_closure.c.ancestor_id == category_id)
+
+def filter_by_category(query, value):
+    """
+    Restrict an Email query to a category and its subcategories.
+
+    Args:
+        query: Email query
+        value: Category ID or name
+    """
+    category = resolve_category(value)
+    if category is None:
+        return query.filter(false())
+    return query.filter(Email.id.in_(get_subtree_email_ids(category.id)))
+
+def rebuild_category_closure():
+    """
+    Rebuild the category closure table from Category.parent_id.
+
+    Returns:
+        Dict with results
+    """
+    try:
+        db.session.execute(category_closure.delete())
+        db.session.execute(category_closure.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(Category.id, Category.id, 0)
+        ))
+
+        # Extend every path by one parent link per pass until no paths remain
+        depth = 0
+        while True:
+            inserted = db.session.execute(category_closure.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(Category.parent_id, category_closure.c.descendant_id, depth + 1).join(
+                    Category, Category.id == category_closure.c.ancestor_id
+                ).where(category_closure.c.depth == depth, Category.parent_id.isnot(None))
+            )).rowcount
+            if not inserted:
+                break
+            depth += 1
+
+        db.session.commit()
+        invalidate_category_tree()
+        return {"success": True, "message": f"Rebuilt category hierarchy ({depth} levels deep)"}
+
+    except Exception as e:
+        logger.error(f"Error rebuilding category closure: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
@@ -9,7 +9,7 @@ import sys
 
 from app import app, db
 from email_processor import process_new_emails
-from models import EmailAccount, Category
+from models import EmailAccount
 
 
 def setup_database():
@@ -35,15 +35,15 @@ def list_accounts():
 def list_categories():
     """List all email categories."""
     with app.app_context():
-        categories = Category.query.all()
+        from category_tree import get_category_tree
+        categories = get_category_tree().ordered
         if not categories:
             print("No categories configured.")
             return
         
         print(f"Found {len(categories)} categories:")
         for category in categories:
-            parent = category.parent.name if category.parent else "None"
-            print(f"  - {category.name} (Parent: {parent})")
+            print(f"  {'  ' * category.depth}- {category.name}")
 
 
 def sync_emails():
@@ -54,6 +54,161 @@ def sync_emails():
         print(f"Processed {result.get('processed_count', 0)} emails.")
 
 
+def index_keywords():
+    """Rebuild keyword links for all existing emails."""
+    print("Indexing keywords across existing emails...")
+    with app.app_context():
+        from keyword_index import reindex_keywords
+        result = reindex_keywords()
+        print(result["message"])
+
+
+def reindex_search():
+    """Rebuild the configured search index for all existing emails."""
+    print("Indexing existing emails for search...")
+    with app.app_context():
+        from config import current_config
+        if current_config.SEARCH_ENGINE == 'index':
+            from inverted_index import rebuild_inverted_index
+            result = rebuild_inverted_index()
+        else:
+            from fulltext_search import rebuild_search_index
+            result = rebuild_search_index()
+        print(result["message"])
+
+
+def index_filters():
+    """Rebuild the sender and subject filter index for all existing emails."""
+    print("Indexing senders and subjects for filters...")
+    with app.app_context():
+        from trigram_index import rebuild_filter_index
+        result = rebuild_filter_index()
+        print(result["message"])
+
+
+def index_categories():
+    """Rebuild the category hierarchy closure table."""
+    print("Rebuilding category hierarchy...")
+    with app.app_context():
+        from category_tree import rebuild_category_closure
+        result = rebuild_category_closure()
+        print(result["message"])
+
+
+def index_email_list():
+    """Rebuild the denormalized inbox rows."""
+    print("Rebuilding email list...")
+    with app.app_context():
+        from email_list import rebuild_email_list
+        result = rebuild_email_list()
+        print(result["message"])
+
+
+def index_threads():
+    """Rebuild the thread summary aggregates."""
+    print("Rebuilding thread summaries...")
+    with app.app_context():
+        from thread_summary import rebuild_thread_summaries
+        result = rebuild_thread_summaries()
+        print(result["message"])
+
+
+def check_queries():
+    """Report how many queries each page runs against its budget."""
+    from app import register_routes
+    register_routes(app)
+    
+    with app.app_context():
+        from query_counter import check_route_query_budgets
+        results = check_route_query_budgets(app)
+        for result in results:
+            status = "ok" if result["ok"] else "OVER BUDGET" if result["status"] < 400 else f"HTTP {result['status']}"
+            print(f"  {result['path']}: {result['queries']}/{result['budget']} queries - {status}")
+        return all(result["ok"] for result in results)
+
+
+def apply_rules(rule_id=None, resume=False):
+    """Apply rules retroactively to existing emails."""
+    with app.app_context():
+        from models import Rule
+        from rule_backfill import start_rule_backfill, resume_rule_backfills
+        
+        if resume:
+            resumed = resume_rule_backfills()
+            print(f"Resumed {len(resumed)} rule backfill(s).")
+            return
+        
+        rules = [Rule.query.get(rule_id)] if rule_id else Rule.query.all()
+        for rule in rules:
+            if not rule:
+                print(f"Rule {rule_id} not found.")
+                continue
+            backfill = start_rule_backfill(rule.id, background=False)
+            print(f"Rule {rule.id} ({rule.type}): {backfill.status}, applied to {backfill.matched} emails")
+
+
+def train_categorizer():
+    """Train the local categorizer on already-categorized emails."""
+    print("Training local categorizer...")
+    with app.app_context():
+        from config import current_config
+        from local_categorizer import train_local_categorizer
+        result = train_local_categorizer(min_examples=current_config.LOCAL_CATEGORIZER_MIN_EXAMPLES)
+        print(result["message"])
+
+
+def rebuild_uncategorized():
+    """Rebuild the queue of emails waiting to be categorized."""
+    print("Rebuilding uncategorized email queue...")
+    with app.app_context():
+        from uncategorized_queue import rebuild_uncategorized_queue
+        count = rebuild_uncategorized_queue()
+        print(f"{count} emails waiting to be categorized")
+
+
+def run_worker(kinds=None, once=False, poll_interval=None):
+    """Run queued background jobs."""
+    print("Starting job worker (Ctrl+C to stop)...")
+    with app.app_context():
+        from job_queue import run_worker as run_job_worker
+        from token_manager import token_manager
+        if not once:
+            token_manager.start_background_refresh(app)
+        try:
+            processed = run_job_worker(kinds=kinds, poll_interval=poll_interval, once=once)
+            print(f"Ran {processed} jobs.")
+        except KeyboardInterrupt:
+            print("Worker stopped.")
+
+
+def run_daemon(once=False):
+    """Poll each account on an adaptive schedule."""
+    print("Starting sync daemon (Ctrl+C to stop)...")
+    with app.app_context():
+        from sync_scheduler import run_sync_daemon
+        from token_manager import token_manager
+        if not once:
+            token_manager.start_background_refresh(app)
+        try:
+            started = run_sync_daemon(once=once)
+            print(f"Started {started} syncs.")
+        except KeyboardInterrupt:
+            print("Daemon stopped.")
+
+
+def listen():
+    """Ingest new Gmail messages as they arrive using IMAP IDLE."""
+    print("Listening for new mail (Ctrl+C to stop)...")
+    with app.app_context():
+        from imap_idle import run_idle_listeners
+        from token_manager import token_manager
+        token_manager.start_background_refresh(app)
+        try:
+            run_idle_listeners()
+        except KeyboardInterrupt:
+            print("Listener stopped.")
+
+
 def main():
     """Main CLI function."""
     parser = argparse.ArgumentParser(description="AI-Enhanced Email Management System CLI")
@@ -71,6 +226,53 @@ def main():
     # Sync emails command
     sync_parser = subparsers.add_parser("sync", help="Synchronize emails from all accounts")
     
+    # Index keywords command
+    index_keywords_parser = subparsers.add_parser("index-keywords", help="Rebuild keyword links for existing emails")
+    
+    # Reindex search command
+    reindex_search_parser = subparsers.add_parser("reindex-search", help="Rebuild the search index")
+    
+    # Index filters command
+    index_filters_parser = subparsers.add_parser("index-filters", help="Rebuild the sender and subject filter index")
+    
+    # Index categories command
+    index_categories_parser = subparsers.add_parser("index-categories", help="Rebuild the category hierarchy closure table")
+    
+    # Rebuild email list command
+    index_email_list_parser = subparsers.add_parser("index-email-list", help="Rebuild the denormalized inbox rows")
+    
+    # Rebuild thread summaries command
+    index_threads_parser = subparsers.add_parser("index-threads", help="Rebuild the thread summary aggregates")
+    
+    # Check query budgets command
+    check_queries_parser = subparsers.add_parser("check-queries", help="Check that pages stay within their query budgets")
+    
+    # Apply rules command
+    apply_rules_parser = subparsers.add_parser("apply-rules", help="Apply rules to existing emails")
+    apply_rules_parser.add_argument("--rule-id", type=int, help="Only apply this rule")
+    apply_rules_parser.add_argument("--resume", action="store_true", help="Resume interrupted rule backfills")
+    
+    # Train categorizer command
+    train_parser = subparsers.add_parser("train-categorizer", help="Train the local email categorizer")
+    
+    # Rebuild uncategorized queue command
+    rebuild_uncategorized_parser = subparsers.add_parser(
+        "rebuild-uncategorized", help="Rebuild the queue of emails waiting to be categorized"
+    )
+    
+    # Job worker command
+    worker_parser = subparsers.add_parser("worker", help="Run queued sync and AI jobs")
+    worker_parser.add_argument("--kind", action="append", dest="kinds", help="Only run jobs of this kind (repeatable)")
+    worker_parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    worker_parser.add_argument("--poll-interval", type=float, help="Seconds to wait when the queue is empty")
+    
+    # Sync daemon command
+    daemon_parser = subparsers.add_parser("daemon", help="Sync accounts periodically, polling busy accounts more often")
+    daemon_parser.add_argument("--once", action="store_true", help="Sync the accounts that are due and exit")
+    
+    # IMAP IDLE listener command
+    listen_parser = subparsers.add_parser("listen", help="Ingest Gmail messages in near real time with IMAP IDLE")
+    
     # Run web app command
     run_parser = subparsers.add_parser("run", help="Run the web application")
     run_parser.add_argument("--host", default="0.0.0.0", help="Host to run the server on")
@@ -87,6 +289,33 @@ def main():
         list_categories()
     elif args.command == "sync":
         sync_emails()
+    elif args.command == "index-keywords":
+        index_keywords()
+    elif args.command == "reindex-search":
+        reindex_search()
+    elif args.command == "index-filters":
+        index_filters()
+    elif args.command == "index-categories":
+        index_categories()
+    elif args.command == "index-email-list":
+        index_email_list()
+    elif args.command == "index-threads":
+        index_threads()
+    elif args.command == "check-queries":
+        if not check_queries():
+            return 1
+    elif args.command == "apply-rules":
+        apply_rules(args.rule_id, args.resume)
+    elif args.command == "train-categorizer":
+        train_categorizer()
+    elif args.command == "rebuild-uncategorized":
+        rebuild_uncategorized()
+    elif args.command == "worker":
+        run_worker(args.kinds, args.once, args.poll_interval)
+    elif args.command == "daemon":
+        run_daemon(args.once)
+    elif args.command == "listen":
+        listen()
     elif args.command == "run":
         print(f"Starting web server on {args.host}:{args.port}...")
         app.run(host=args.host, port=args.port, debug=args.debug)
@@ -34,8 +34,75 @@ class Config:
     # Email processing
     MAX_EMAILS_PER_FETCH = 50
     
+    # Background jobs - when enabled, web requests queue sync and AI work for 'cli.py worker', which must be running;
+    # disabled by default so a plain gunicorn deployment runs that work inline
+    BACKGROUND_JOBS_ENABLED = os.environ.get("BACKGROUND_JOBS_ENABLED", "false").lower() == "true"
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2.0"))
+    JOB_LOCK_TIMEOUT_MINUTES = int(os.environ.get("JOB_LOCK_TIMEOUT_MINUTES", "30"))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+    
+    # Sync daemon - each account is polled between the min and max interval depending on its recent arrival rate
+    SYNC_MIN_INTERVAL_SECONDS = int(os.environ.get("SYNC_MIN_INTERVAL_SECONDS", "60"))
+    SYNC_MAX_INTERVAL_SECONDS = int(os.environ.get("SYNC_MAX_INTERVAL_SECONDS", "3600"))
+    SYNC_RATE_WINDOW_HOURS = int(os.environ.get("SYNC_RATE_WINDOW_HOURS", "6"))
+    SYNC_JITTER = float(os.environ.get("SYNC_JITTER", "0.1"))
+    
+    # IMAP IDLE listener - sessions are re-issued before servers drop them (RFC 2177 allows 29 minutes)
+    IMAP_IDLE_TIMEOUT_SECONDS = int(os.environ.get("IMAP_IDLE_TIMEOUT_SECONDS", "1500"))
+    
+    # IMAP connection pool - authenticated sessions kept open between syncs
+    IMAP_POOL_MAX_PER_PROVIDER = int(os.environ.get("IMAP_POOL_MAX_PER_PROVIDER", "10"))
+    IMAP_POOL_MAX_IDLE_SECONDS = int(os.environ.get("IMAP_POOL_MAX_IDLE_SECONDS", "900"))
+    
+    # Full-text search - PostgreSQL text search configuration and how much of each body is indexed
+    SEARCH_TEXT_CONFIG = os.environ.get("SEARCH_TEXT_CONFIG", "english")
+    SEARCH_MAX_BODY_CHARS = int(os.environ.get("SEARCH_MAX_BODY_CHARS", "100000"))
+    
+    # Search engine for /search: 'database' (PostgreSQL/SQLite full-text index) or 'index' (embedded on-disk inverted index)
+    # Run 'cli.py reindex-search' after switching
+    SEARCH_ENGINE = os.environ.get("SEARCH_ENGINE", "database")
+    # Inverted index - documents buffered per segment, and segments per size tier before they are merged
+    SEARCH_INDEX_FLUSH_DOCS = int(os.environ.get("SEARCH_INDEX_FLUSH_DOCS", "1000"))
+    SEARCH_INDEX_MERGE_FACTOR = int(os.environ.get("SEARCH_INDEX_MERGE_FACTOR", "10"))
+    
+    # HTTP caching - pages revalidate with ETags; static files are reused for STATIC_CACHE_MAX_AGE seconds
+    STATIC_CACHE_MAX_AGE = int(os.environ.get("STATIC_CACHE_MAX_AGE", "86400"))
+    # Response compression - brotli when installed and accepted, otherwise gzip; smaller responses are sent as is
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "500"))
+    COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+    
+    # OAuth tokens are refreshed this long before they expire; the background refresher checks every TOKEN_REFRESH_CHECK_SECONDS
+    TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+    TOKEN_REFRESH_CHECK_SECONDS = int(os.environ.get("TOKEN_REFRESH_CHECK_SECONDS", "60"))
+    
     # AI settings
     AI_MODEL = "gpt-4o"  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
+    
+    # OpenAI request scheduling - concurrency, per-minute budgets and retries
+    AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "4"))
+    AI_REQUESTS_PER_MINUTE = int(os.environ.get("AI_REQUESTS_PER_MINUTE", "500"))
+    AI_TOKENS_PER_MINUTE = int(os.environ.get("AI_TOKENS_PER_MINUTE", "30000"))
+    AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", "5"))
+    
+    # Prompt token budgets - bodies are trimmed and categorization requests packed to fit
+    AI_ANALYZE_MAX_BODY_TOKENS = int(os.environ.get("AI_ANALYZE_MAX_BODY_TOKENS", "2000"))
+    AI_CATEGORIZE_MAX_PROMPT_TOKENS = int(os.environ.get("AI_CATEGORIZE_MAX_PROMPT_TOKENS", "4000"))
+    AI_CATEGORIZE_MAX_BATCH = int(os.environ.get("AI_CATEGORIZE_MAX_BATCH", "50"))
+    
+    # AI response cache - entries expire after the TTL and the oldest are evicted past the size cap
+    AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "true").lower() == "true"
+    AI_CACHE_TTL_DAYS = int(os.environ.get("AI_CACHE_TTL_DAYS", "30"))
+    AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", "100000"))
+    
+    # Background pre-analysis of new emails from contacts or domains at or above this priority
+    AI_PREANALYZE_ENABLED = os.environ.get("AI_PREANALYZE_ENABLED", "false").lower() == "true"
+    AI_PREANALYZE_MIN_PRIORITY = int(os.environ.get("AI_PREANALYZE_MIN_PRIORITY", "1"))
+    
+    # Local categorizer settings - emails the local model is unsure about are escalated to the AI
+    LOCAL_CATEGORIZER_ENABLED = os.environ.get("LOCAL_CATEGORIZER_ENABLED", "true").lower() == "true"
+    LOCAL_CATEGORIZER_MIN_CONFIDENCE = float(os.environ.get("LOCAL_CATEGORIZER_MIN_CONFIDENCE", "0.8"))
+    LOCAL_CATEGORIZER_MIN_EXAMPLES = int(os.environ.get("LOCAL_CATEGORIZER_MIN_EXAMPLES", "50"))
 
 class DevelopmentConfig(Config):
     """Development configuration."""
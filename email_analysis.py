@@ -0,0 +1,115 @@
+import json
+import logging
+from datetime import datetime
+
+from app import db
+from config import current_config
+from models import EmailAnalysis, Contact, Domain
+
+logger = logging.getLogger(__name__)
+
+# List fields stored as JSON text
+LIST_FIELDS = ('key_points', 'action_items', 'deadlines', 'contacts')
+
+def serialize_analysis(record):
+    """Convert a stored EmailAnalysis into the dict shape returned by the AI."""
+    analysis = {field: json.loads(getattr(record, field) or '[]') for field in LIST_FIELDS}
+    analysis['sentiment'] = record.sentiment
+    analysis['importance'] = record.importance
+    analysis['analyzed_at'] = record.analyzed_at.isoformat() if record.analyzed_at else None
+    return analysis
+
+def get_stored_analysis(email_id, prompt_version=None):
+    """
+    Return the stored analysis for an email.
+
+    Args:
+        email_id: ID of the email
+        prompt_version: Ignore analyses produced by a different prompt version
+
+    Returns:
+        Analysis dict, or None if the email hasn't been analyzed
+    """
+    record = db.session.get(EmailAnalysis, email_id)
+    if not record:
+        return None
+    if prompt_version is not None and record.prompt_version != prompt_version:
+        return None
+    return serialize_analysis(record)
+
+def as_text(item):
+    """Flatten one AI response item (e.g. {"name": ..., "email": ...}) to display text."""
+    if isinstance(item, dict):
+        return ', '.join(str(value) for value in item.values() if value)
+    return str(item)
+
+def as_list(value):
+    """Coerce an AI response field to a list of strings."""
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [as_text(item) for item in value]
+    return [as_text(value)]
+
+def save_analysis(email_id, analysis, prompt_version=None):
+    """Store (or replace) the analysis for an email."""
+    record = db.session.get(EmailAnalysis, email_id) or EmailAnalysis(email_id=email_id)
+    for field in LIST_FIELDS:
+        setattr(record, field, json.dumps(as_list(analysis.get(field))))
+    record.sentiment = str(analysis.get('sentiment') or '')[:20] or None
+    record.importance = str(analysis.get('importance') or '')[:20] or None
+    record.prompt_version = prompt_version
+    record.analyzed_at = datetime.utcnow()
+
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+def is_priority_sender(sender):
+    """Check whether a sender's contact or domain is marked high priority."""
+    from email_processor import extract_email, extract_domain
+
+    address = extract_email(sender) if sender else None
+    if not address:
+        return False
+
+    min_priority = current_config.AI_PREANALYZE_MIN_PRIORITY
+    contact_priority = db.session.query(Contact.priority).filter(Contact.email == address).scalar()
+    if contact_priority is not None and contact_priority >= min_priority:
+        return True
+
+    domain_priority = db.session.query(Domain.priority).filter(
+        Domain.email_domain == extract_domain(address)
+    ).scalar()
+    return domain_priority is not None and domain_priority >= min_priority
+
+def queue_preanalysis(email_id):
+    """
+    Queue an email for analysis by the background worker.
+
+    Returns:
+        The queued Job
+    """
+    from job_queue import enqueue_job, PRIORITY_LOW
+    return enqueue_job('analyze_email', {'email_id': email_id}, priority=PRIORITY_LOW)
+
+def queue_preanalysis_if_priority(email_obj):
+    """Queue a newly stored email for analysis if pre-analysis is enabled and its sender is high priority."""
+    if not current_config.AI_PREANALYZE_ENABLED or not current_config.BACKGROUND_JOBS_ENABLED:
+        return None
+
+    try:
+        if is_priority_sender(email_obj.sender):
+            return queue_preanalysis(email_obj.id)
+    except Exception as e:
+        logger.error(f"Error queueing email {email_obj.id} for pre-analysis: {str(e)}")
+    return None
+
+def get_preanalysis_status():
+    """Report whether pre-analysis is enabled and how many emails are waiting."""
+    from models import Job
+
+    return {
+        "enabled": current_config.AI_PREANALYZE_ENABLED and current_config.BACKGROUND_JOBS_ENABLED,
+        "queued": Job.query.filter(Job.kind == 'analyze_email', Job.status == 'pending').count()
+    }
@@ -0,0 +1,119 @@
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from app import db
+from models import Email, EmailListItem
+from email_queries import get_category_names, get_attachment_counts
+
+logger = logging.getLogger(__name__)
+
+# Emails refreshed per round of queries
+BATCH_SIZE = 500
+
+def refresh_list_items(email_ids):
+    """
+    Recompute the email_list_item rows of the given emails from the normalized tables.
+
+    Call after anything that changes what an email's list row shows. Runs in
+    the caller's transaction; the caller commits.
+
+    Args:
+        email_ids: IDs of the emails to refresh
+
+    Returns:
+        Number of rows written
+    """
+    email_ids = list(set(email_ids))
+    written = 0
+
+    for start in range(0, len(email_ids), BATCH_SIZE):
+        batch = email_ids[start:start + BATCH_SIZE]
+        emails = db.session.query(
+            Email.id, Email.sender, Email.subject, Email.date_sent, Email.thread_id,
+            Email.is_read, Email.is_confidential
+        ).filter(Email.id.in_(batch)).all()
+        if not emails:
+            continue
+
+        category_names = get_category_names(batch)
+        attachment_counts = get_attachment_counts(batch)
+        thread_ids = {email.thread_id for email in emails if email.thread_id}
+        thread_sizes = dict(db.session.query(Email.thread_id, func.count(Email.id)).filter(
+            Email.thread_id.in_(thread_ids)
+        ).group_by(Email.thread_id).all()) if thread_ids else {}
+
+        now = datetime.utcnow()
+        # Replace rather than upsert, which has no portable spelling
+        db.session.execute(EmailListItem.__table__.delete().where(EmailListItem.id.in_(batch)))
+        db.session.execute(EmailListItem.__table__.insert(), [
+            {
+                "id": email.id,
+                "sender": email.sender,
+                "subject": email.subject,
+                "date_sent": email.date_sent,
+                "thread_id": email.thread_id,
+                "thread_size": thread_sizes.get(email.thread_id, 1),
+                "is_read": email.is_read,
+                "is_confidential": email.is_confidential,
+                "categories": json.dumps(category_names.get(email.id, [])),
+                "attachment_count": attachment_counts.get(email.id, 0),
+                "updated_at": now
+            }
+            for email in emails
+        ])
+        written += len(emails)
+
+    return written
+
+def refresh_thread_sizes(thread_ids):
+    """
+    Recount the thread size on every list row in the given threads.
+
+    Call after adding emails to existing threads. Runs in the caller's
+    transaction; the caller commits.
+    """
+    thread_ids = [thread_id for thread_id in set(thread_ids) if thread_id]
+    if not thread_ids:
+        return
+
+    size = select(func.count(Email.id)).where(Email.thread_id == EmailListItem.thread_id).scalar_subquery()
+    db.session.execute(
+        update(EmailListItem)
+        .where(EmailListItem.thread_id.in_(thread_ids))
+        .values(thread_size=size, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+def rebuild_email_list(batch_size=5000):
+    """
+    Rebuild the email_list_item projection for every email.
+
+    Returns:
+        Dict with results
+    """
+    try:
+        db.session.execute(EmailListItem.__table__.delete())
+
+        count = 0
+        last_id = None
+        while True:
+            query = db.session.query(Email.id)
+            if last_id is not None:
+                query = query.filter(Email.id > last_id)
+            batch = [email_id for email_id, in query.order_by(Email.id).limit(batch_size)]
+            if not batch:
+                break
+            count += refresh_list_items(batch)
+            last_id = batch[-1]
+            db.session.commit()
+
+        db.session.commit()
+        return {"success": True, "message": f"Rebuilt list rows for {count} emails"}
+
+    except Exception as e:
+        logger.error(f"Error rebuilding email list: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
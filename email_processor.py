@@ -17,8 +17,15 @@ from email_services import fetch_emails_gmail, fetch_emails_exchange
 
 logger = logging.getLogger(__name__)
 
-def process_account_emails(account, max_emails=50):
-    """Fetch and process new emails from a specific account."""
+def process_account_emails(account, max_emails=50, progress=None):
+    """
+    Fetch and process new emails from a specific account.
+    
+    Args:
+        account: EmailAccount to sync
+        max_emails: Maximum number of emails to fetch
+        progress: Optional callback taking (fraction, message), called after each email
+    """
     try:
         processed_count = 0
         
@@ -32,9 +39,15 @@ def process_account_emails(account, max_emails=50):
             return {"success": False, "message": f"Unknown account type: {account.account_type}"}
         
         # Process each email
-        for email_data in emails:
+        for index, email_data in enumerate(emails, 1):
             if process_email(email_data, account):
                 processed_count += 1
+            if progress:
+                progress(index / len(emails), f"Processed {index} of {len(emails)} emails for {account.email}")
+        
+        # Make the new emails searchable from other processes
+        from inverted_index import flush_search_index
+        flush_search_index()
         
         return {
             "success": True,
@@ -45,8 +58,13 @@ def process_account_emails(account, max_emails=50):
         logger.error(f"Error processing emails for {account.email}: {str(e)}")
         return {"success": False, "message": f"Error: {str(e)}"}
 
-def process_new_emails():
-    """Fetch and process new emails from all configured accounts."""
+def process_new_emails(progress=None):
+    """
+    Fetch and process new emails from all configured accounts.
+    
+    Args:
+        progress: Optional callback taking (fraction, message), called as each account syncs
+    """
     try:
         accounts = EmailAccount.query.all()
         if not accounts:
@@ -54,8 +72,13 @@ def process_new_emails():
         
         processed_count = 0
         
-        for account in accounts:
-            result = process_account_emails(account)
+        for index, account in enumerate(accounts):
+            account_progress = None
+            if progress:
+                def account_progress(fraction, message=None, index=index):
+                    progress((index + fraction) / len(accounts), message)
+            
+            result = process_account_emails(account, progress=account_progress)
             if result["success"]:
                 processed_count += result.get("processed", 0)
             
@@ -107,28 +130,74 @@ def process_email(email_data, account):
             email_obj.bcc = json.dumps(parse_addresses(msg.get('Bcc', '')))
         
         # Process body and attachments
-        process_email_content(msg, email_obj)
+        body_text = process_email_content(msg, email_obj)
         
         # Find or create thread
         thread = find_or_create_thread(email_obj)
         email_obj.thread_id = thread.id
         
+        # Count the email in the thread's summary
+        from thread_summary import add_email_to_thread
+        add_email_to_thread(thread, email_obj)
+        
         # Process contacts and domains
         process_contacts_and_domains(email_obj)
         
+        # Apply categorization rules so matched emails never need an AI call
+        from rule_engine import apply_rules
+        apply_rules(email_obj, body_text)
+        
         # Save the email
         db.session.add(email_obj)
+        db.session.flush()  # Generate ID
+        
+        # Queue emails no rule matched for categorization
+        if not email_obj.categories:
+            from uncategorized_queue import enqueue_emails
+            enqueue_emails([email_obj])
+        
+        # Link keywords found in the subject and body
+        from keyword_index import index_email_keywords
+        index_email_keywords(email_obj, body_text)
+        
+        # Make the subject, sender and body searchable
+        from fulltext_search import index_email_text
+        index_email_text(email_obj, body_text)
+        from inverted_index import index_email_document
+        index_email_document(email_obj, body_text)
+        
+        # Count the sender and subject for /emails filters and autocomplete
+        from trigram_index import index_filter_values
+        index_filter_values(email_obj)
+        
+        # Write the email's inbox row and grow the thread size on its thread's rows
+        from email_list import refresh_list_items, refresh_thread_sizes
+        refresh_list_items([email_obj.id])
+        refresh_thread_sizes([email_obj.thread_id])
+        
         db.session.commit()
         
+        # Analyze mail from high-priority senders ahead of time
+        from email_analysis import queue_preanalysis_if_priority
+        queue_preanalysis_if_priority(email_obj)
+        
         logger.info(f"Processed email: {email_obj.subject}")
         return True
     
     except Exception as e:
+        # Discard this email's partial writes, including staged thread counters,
+        # so the session stays usable for the rest of the batch
+        db.session.rollback()
         logger.error(f"Error processing individual email: {str(e)}")
         return False
 
 def process_email_content(msg, email_obj):
-    """Process the content of an email including body and attachments."""
+    """Process the content of an email including body and attachments.
+    
+    Returns the plain text of the body (or None) for rule and keyword matching.
+    """
+    body_text = None
+    
     # Check if this is a multipart message
     if msg.is_multipart():
         # Process each part
@@ -148,9 +217,9 @@ def process_email_content(msg, email_obj):
         
         # Prefer HTML over plain text if available
         if html_part:
-            process_html_body(html_part, email_obj)
+            body_text = process_html_body(html_part, email_obj)
         elif text_part:
-            process_text_body(text_part, email_obj)
+            body_text = process_text_body(text_part, email_obj)
         
         # Process attachments
         for attachment_part in attachments:
@@ -161,9 +230,11 @@ def process_email_content(msg, email_obj):
         content_type = msg.get_content_type()
         
         if content_type == 'text/plain':
-            process_text_body(msg, email_obj)
+            body_text = process_text_body(msg, email_obj)
         elif content_type == 'text/html':
-            process_html_body(msg, email_obj)
+            body_text = process_html_body(msg, email_obj)
+    
+    return body_text
 
 def process_text_body(part, email_obj):
     """Process a plain text email body."""
@@ -187,7 +258,8 @@ def process_text_body(part, email_obj):
     # Add disclaimers if found
     for disclaimer_text in disclaimers:
         disclaimer = find_or_create_disclaimer(disclaimer_text)
-        body.disclaimers.append(disclaimer)
+        if disclaimer not in body.disclaimers:
+            body.disclaimers.append(disclaimer)
     
     # Set email body
     email_obj.body_id = body.id
@@ -196,6 +268,8 @@ def process_text_body(part, email_obj):
     # Process any forwarded content
     if forwarded_content:
         process_forwarded_content(forwarded_content, email_obj)
+    
+    return text_content
 
 def process_html_body(part, email_obj):
     """Process an HTML email body."""
@@ -238,7 +312,8 @@ def process_html_body(part, email_obj):
     # Add disclaimers if found
     for disclaimer_text in disclaimers:
         disclaimer = find_or_create_disclaimer(disclaimer_text)
-        body.disclaimers.append(disclaimer)
+        if disclaimer not in body.disclaimers:
+            body.disclaimers.append(disclaimer)
     
     # Set email body
     email_obj.body_id = body.id
@@ -248,6 +323,8 @@ def process_html_body(part, email_obj):
     forwarded_content = extract_html_forwarded_content(soup)
     if forwarded_content:
         process_forwarded_content(forwarded_content, email_obj)
+    
+    return soup.get_text(' ', strip=True)
 
 def process_attachment(part, email_obj):
     """Process an email attachment."""
@@ -261,8 +338,9 @@ def process_attachment(part, email_obj):
     # Check if attachment already exists
     existing = Attachment.query.filter_by(id=content_hash).first()
     if existing:
-        # Reuse existing attachment
-        email_obj.attachments.append(existing)
+        # Reuse existing attachment, once per email
+        if existing not in email_obj.attachments:
+            email_obj.attachments.append(existing)
         return
     
     # Create new attachment record
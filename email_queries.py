@@ -0,0 +1,111 @@
+from flask import abort
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from app import db
+from models import Email, Thread, Category, email_categories, email_attachments
+
+# Columns shown in email lists; everything else stays unloaded
+LIST_COLUMNS = (
+    Email.id,
+    Email.account_id,
+    Email.sender,
+    Email.subject,
+    Email.date_sent,
+    Email.thread_id,
+    Email.is_read,
+    Email.is_confidential,
+)
+
+# Loading strategies per view, so templates never trigger a lazy load per row
+EMAIL_DETAIL_OPTIONS = (
+    joinedload(Email.thread),
+    selectinload(Email.categories),
+    selectinload(Email.attachments),
+)
+THREAD_EMAIL_OPTIONS = (
+    selectinload(Email.attachments),
+)
+
+class EmailListRow:
+    """An email as shown in lists, with its category names and attachment count already loaded."""
+
+    __slots__ = (
+        'id', 'account_id', 'sender', 'subject', 'date_sent', 'thread_id',
+        'is_read', 'is_confidential', 'category_names', 'attachment_count'
+    )
+
+    def __init__(self, email, category_names=(), attachment_count=0):
+        for column in LIST_COLUMNS:
+            setattr(self, column.key, getattr(email, column.key))
+        self.category_names = list(category_names)
+        self.attachment_count = attachment_count
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'sender': self.sender,
+            'subject': self.subject,
+            'date_sent': self.date_sent.isoformat() if self.date_sent else None,
+            'thread_id': self.thread_id,
+            'is_read': self.is_read,
+            'categories': self.category_names,
+            'attachment_count': self.attachment_count
+        }
+
+def email_list_query():
+    """Email query loading only the columns lists show."""
+    return Email.query.options(load_only(*LIST_COLUMNS))
+
+def get_category_names(email_ids):
+    """Map email IDs to their category names, sorted, with one query."""
+    category_names = {}
+    for email_id, name in db.session.query(email_categories.c.email_id, Category.name).join(
+        Category, Category.id == email_categories.c.category_id
+    ).filter(email_categories.c.email_id.in_(email_ids)).order_by(Category.name):
+        category_names.setdefault(email_id, []).append(name)
+    return category_names
+
+def get_attachment_counts(email_ids):
+    """Map email IDs to their number of attachments, with one query."""
+    return dict(db.session.query(
+        email_attachments.c.email_id, func.count(email_attachments.c.attachment_id)
+    ).filter(email_attachments.c.email_id.in_(email_ids)).group_by(email_attachments.c.email_id).all())
+
+def to_list_rows(emails):
+    """
+    Convert emails to EmailListRows.
+
+    Category names and attachment counts for the whole list are fetched with
+    one query each.
+    """
+    email_ids = [email.id for email in emails]
+    if not email_ids:
+        return []
+
+    category_names = get_category_names(email_ids)
+    attachment_counts = get_attachment_counts(email_ids)
+
+    return [
+        EmailListRow(email, category_names.get(email.id, ()), attachment_counts.get(email.id, 0))
+        for email in emails
+    ]
+
+def get_email_detail(email_id):
+    """Load an email with its thread, categories and attachments, or abort with 404."""
+    email = Email.query.options(*EMAIL_DETAIL_OPTIONS).filter(Email.id == email_id).first()
+    if email is None:
+        abort(404)
+    return email
+
+def get_thread(thread_id):
+    """Load a thread with its categories, or abort with 404."""
+    thread = Thread.query.options(selectinload(Thread.categories)).filter(Thread.id == thread_id).first()
+    if thread is None:
+        abort(404)
+    return thread
+
+def thread_email_query(thread_id):
+    """Emails in a thread, with attachments loaded alongside."""
+    return Email.query.options(*THREAD_EMAIL_OPTIONS).filter(Email.thread_id == thread_id)
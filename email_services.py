@@ -27,6 +27,7 @@ GMAIL_REDIRECT_URI = f"https://{replit_dev_domain}/accounts/add/gmail" if replit
 GMAIL_AUTH_URL = "https://accounts.google.com/o/oauth2/auth"
 GMAIL_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GMAIL_SCOPE = "https://mail.google.com/"
+GMAIL_IMAP_HOST = "imap.gmail.com"
 
 # Microsoft OAuth2 constants
 MS_CLIENT_ID = os.environ.get("MS_CLIENT_ID")
@@ -362,55 +363,60 @@ def refresh_exchange_token(account):
         logger.error(f"Error refreshing Exchange token: {str(e)}")
         return False
 
+def connect_gmail(account, access_token=None):
+    """Open an IMAP connection to Gmail authenticated with an OAuth2 token (the account's by default)."""
+    mail = imaplib.IMAP4_SSL(GMAIL_IMAP_HOST)
+    
+    # Authenticate with OAuth2
+    auth_string = f'user={account.email}\1auth=Bearer {access_token or account.access_token}\1\1'
+    mail.authenticate('XOAUTH2', lambda x: auth_string)
+    
+    return mail
+
 def fetch_emails_gmail(account, max_emails=50):
     """Fetch emails from Gmail using IMAP."""
+    from imap_pool import imap_pool
+    from token_manager import token_manager
+    
     emails = []
     
     try:
-        # Check if token needs refresh
-        if account.token_expiry and account.token_expiry < datetime.utcnow():
-            if not refresh_gmail_token(account):
-                logger.error(f"Failed to refresh token for {account.email}")
-                return emails
-        
-        # Connect to Gmail IMAP
-        mail = imaplib.IMAP4_SSL('imap.gmail.com')
-        
-        # Authenticate with OAuth2
-        auth_string = f'user={account.email}\1auth=Bearer {account.access_token}\1\1'
-        mail.authenticate('XOAUTH2', lambda x: auth_string)
-        
-        # Select inbox
-        mail.select('INBOX')
-        
-        # Get last sync time or default to last week
-        last_sync = account.last_sync or (datetime.utcnow() - timedelta(days=7))
-        
-        # Search for emails since last sync
-        date_str = last_sync.strftime("%d-%b-%Y")
-        result, data = mail.search(None, f'(SINCE {date_str})')
-        
-        if result != 'OK':
-            logger.error(f"Error searching emails: {result}")
+        # Make sure a valid token is available (refreshed ahead of expiry if needed)
+        if not token_manager.get_token(account):
+            logger.error(f"Failed to refresh token for {account.email}")
             return emails
         
-        # Get email IDs
-        email_ids = data[0].split()
-        
-        # Limit number of emails to process
-        email_ids = email_ids[-max_emails:] if len(email_ids) > max_emails else email_ids
-        
-        # Fetch emails
-        for e_id in reversed(email_ids):  # Process newest first
-            result, data = mail.fetch(e_id, '(RFC822)')
+        # Borrow a warm, authenticated session from the pool
+        with imap_pool.connection(account) as mail:
+            # Select inbox
+            mail.select('INBOX')
+            
+            # Get last sync time or default to last week
+            last_sync = account.last_sync or (datetime.utcnow() - timedelta(days=7))
+            
+            # Search for emails since last sync
+            date_str = last_sync.strftime("%d-%b-%Y")
+            result, data = mail.search(None, f'(SINCE {date_str})')
+            
             if result != 'OK':
-                logger.error(f"Error fetching email {e_id}: {result}")
-                continue
+                logger.error(f"Error searching emails: {result}")
+                return emails
             
-            raw_email = data[0][1]
-            emails.append(raw_email)
-        
-        mail.logout()
+            # Get email IDs
+            email_ids = data[0].split()
+            
+            # Limit number of emails to process
+            email_ids = email_ids[-max_emails:] if len(email_ids) > max_emails else email_ids
+            
+            # Fetch emails
+            for e_id in reversed(email_ids):  # Process newest first
+                result, data = mail.fetch(e_id, '(RFC822)')
+                if result != 'OK':
+                    logger.error(f"Error fetching email {e_id}: {result}")
+                    continue
+                
+                raw_email = data[0][1]
+                emails.append(raw_email)
     
     except Exception as e:
         logger.error(f"Error fetching Gmail emails: {str(e)}")
@@ -419,15 +425,11 @@ def fetch_emails_gmail(account, max_emails=50):
 
 def fetch_emails_exchange(account, max_emails=50):
     """Fetch emails from Exchange Online using Microsoft Graph API."""
+    from token_manager import request_with_token
+    
     emails = []
     
     try:
-        # Check if token needs refresh
-        if account.token_expiry and account.token_expiry < datetime.utcnow():
-            if not refresh_exchange_token(account):
-                logger.error(f"Failed to refresh token for {account.email}")
-                return emails
-        
         logger.info(f"Fetching emails for {account.email} using Microsoft Graph API")
         
         # Get last sync time or default to last week
@@ -436,9 +438,6 @@ def fetch_emails_exchange(account, max_emails=50):
         # Format date for Graph API (ISO 8601)
         date_str = last_sync.strftime("%Y-%m-%dT%H:%M:%SZ")
         
-        # Prepare the Graph API request
-        headers = {"Authorization": f"Bearer {account.access_token}"}
-        
         # Query for messages in the inbox, received after last sync
         query_params = {
             "$filter": f"receivedDateTime gt {date_str}",
@@ -446,9 +445,13 @@ def fetch_emails_exchange(account, max_emails=50):
             "$orderby": "receivedDateTime desc"
         }
         
-        # Make the request to Graph API
+        # Make the request to Graph API; a rejected token is refreshed and the request retried once
         url = "https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages"
-        response = requests.get(url, headers=headers, params=query_params)
+        response = request_with_token(account, "GET", url, params=query_params)
+        
+        if response is None:
+            logger.error(f"Failed to refresh token for {account.email}")
+            return emails
         
         if response.status_code != 200:
             logger.error(f"Error fetching emails: {response.status_code} - {response.text}")
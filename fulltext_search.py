@@ -0,0 +1,226 @@
+import re
+import logging
+
+from sqlalchemy import text
+
+from app import db
+from config import current_config
+from models import Email
+
+logger = logging.getLogger(__name__)
+
+# Quoted phrases or bare words, either optionally negated with a leading '-'
+TERM_PATTERN = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)')
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# BM25 column weights for email_fts(email_id, subject, sender, body)
+FTS5_WEIGHTS = "0.0, 10.0, 5.0, 1.0"
+
+def get_search_backend():
+    """Return 'postgresql' or 'sqlite' if the database has a full-text index, otherwise None."""
+    dialect = db.engine.dialect.name
+    return dialect if dialect in ('postgresql', 'sqlite') else None
+
+def parse_search_query(query):
+    """
+    Split a search string into terms.
+
+    Supports quoted phrases ("quarterly report"), prefixes (invoic*),
+    alternatives (invoice OR receipt) and exclusions (-newsletter); all other
+    terms must match.
+
+    Returns:
+        List of dicts with 'words', 'prefix', 'negated' and 'alternative' keys,
+        where 'alternative' means the term may match instead of the one before it
+    """
+    terms = []
+    alternative = False
+    for match in TERM_PATTERN.finditer(query or ''):
+        if match.group(2) is not None:
+            negated, raw, prefix = bool(match.group(1)), match.group(2), False
+        else:
+            negated, raw = bool(match.group(3)), match.group(4)
+            prefix = raw.endswith('*')
+            if raw == 'OR' and not negated:
+                alternative = bool(terms)
+                continue
+
+        words = WORD_PATTERN.findall(raw.lower())
+        if words:
+            terms.append({
+                "words": words,
+                "prefix": prefix,
+                "negated": negated,
+                "alternative": alternative and not negated and not terms[-1]["negated"]
+            })
+        alternative = False
+    return terms
+
+def group_terms(terms):
+    """Split terms into required groups (any one term of a group may match) and exclusions."""
+    groups, excluded = [], []
+    for term in terms:
+        if term["negated"]:
+            excluded.append(term)
+        elif term["alternative"] and groups:
+            groups[-1].append(term)
+        else:
+            groups.append([term])
+    return groups, excluded
+
+def build_tsquery(terms):
+    """Render parsed terms as a PostgreSQL tsquery string."""
+    def phrase(term):
+        words = list(term["words"])
+        if term["prefix"]:
+            words[-1] += ':*'
+        return f"({' <-> '.join(words)})"
+
+    groups, excluded = group_terms(terms)
+    parts = [f"({' | '.join(phrase(term) for term in group)})" for group in groups]
+    parts += [f"!{phrase(term)}" for term in excluded]
+    return ' & '.join(parts)
+
+def build_fts5_query(terms):
+    """Render parsed terms as an SQLite FTS5 MATCH expression."""
+    def phrase(term):
+        rendered = '"' + ' '.join(term["words"]) + '"'
+        return rendered + ' *' if term["prefix"] else rendered
+
+    groups, excluded = group_terms(terms)
+    # FTS5 NOT is binary, so exclusions follow the required terms
+    expression = ' AND '.join(f"({' OR '.join(phrase(term) for term in group)})" for group in groups)
+    for term in excluded:
+        expression += f" NOT {phrase(term)}"
+    return expression
+
+def searchable_sender(sender):
+    """Split addresses into words so 'example' matches 'john@example.com'."""
+    return re.sub(r'[\W_]+', ' ', sender or '')
+
+def index_email_text(email_obj, body_text):
+    """
+    Add an email to the full-text index.
+
+    The email must already have an ID (i.e. be flushed). Runs in a savepoint
+    so an indexing failure never aborts ingestion of the email itself.
+    """
+    backend = get_search_backend()
+    if backend is None or current_config.SEARCH_ENGINE != 'database':
+        return
+
+    params = {
+        "email_id": email_obj.id,
+        "subject": email_obj.subject or '',
+        "sender": searchable_sender(email_obj.sender),
+        "body": (body_text or '')[:current_config.SEARCH_MAX_BODY_CHARS]
+    }
+
+    try:
+        with db.session.begin_nested():
+            if backend == 'postgresql':
+                db.session.execute(text("""
+                    INSERT INTO email_search (email_id, document)
+                    VALUES (:email_id,
+                        setweight(to_tsvector(CAST(:config AS regconfig), :subject), 'A') ||
+                        setweight(to_tsvector(CAST(:config AS regconfig), :sender), 'B') ||
+                        setweight(to_tsvector(CAST(:config AS regconfig), :body), 'C'))
+                    ON CONFLICT (email_id) DO UPDATE SET document = EXCLUDED.document
+                """), {**params, "config": current_config.SEARCH_TEXT_CONFIG})
+            else:
+                # email_id is unindexed in FTS5, so entries are only ever added; rebuilds clear the table first
+                db.session.execute(text(
+                    "INSERT INTO email_fts (email_id, subject, sender, body) "
+                    "VALUES (:email_id, :subject, :sender, :body)"
+                ), params)
+
+    except Exception as e:
+        logger.error(f"Error indexing email {email_obj.id} for search: {str(e)}")
+
+def search_emails(query, limit=100):
+    """
+    Full-text search over subjects, senders and bodies, best matches first.
+
+    Subject matches rank above sender matches, which rank above body matches;
+    ties go to the newest email. Databases without a full-text index fall back
+    to substring matching on subject and sender.
+
+    Returns:
+        List of Email objects
+    """
+    terms = parse_search_query(query)
+    if not any(not term["negated"] for term in terms):
+        return []
+
+    backend = get_search_backend()
+    if backend == 'postgresql':
+        rows = db.session.execute(text("""
+            SELECT s.email_id
+            FROM email_search s
+            JOIN email e ON e.id = s.email_id,
+                to_tsquery(CAST(:config AS regconfig), :query) q
+            WHERE s.document @@ q
+            ORDER BY ts_rank_cd(s.document, q) DESC, e.date_sent DESC
+            LIMIT :limit
+        """), {"config": current_config.SEARCH_TEXT_CONFIG, "query": build_tsquery(terms), "limit": limit})
+    elif backend == 'sqlite':
+        rows = db.session.execute(text(f"""
+            SELECT f.email_id
+            FROM email_fts f
+            JOIN email e ON e.id = f.email_id
+            WHERE email_fts MATCH :query
+            ORDER BY bm25(email_fts, {FTS5_WEIGHTS}), e.date_sent DESC
+            LIMIT :limit
+        """), {"query": build_fts5_query(terms), "limit": limit})
+    else:
+        return Email.query.filter(
+            (Email.subject.contains(query)) |
+            (Email.sender.contains(query))
+        ).order_by(Email.date_sent.desc()).limit(limit).all()
+
+    email_ids = [email_id for (email_id,) in rows]
+    emails = {email.id: email for email in Email.query.filter(Email.id.in_(email_ids)).all()}
+    return [emails[email_id] for email_id in email_ids if email_id in emails]
+
+def rebuild_search_index(batch_size=500):
+    """
+    Re-index every email, e.g. after enabling search on an existing database.
+
+    Returns:
+        Dict with results
+    """
+    from keyword_index import get_email_text
+
+    try:
+        backend = get_search_backend()
+        if backend is None:
+            return {"success": False, "message": f"Full-text search is not supported on {db.engine.dialect.name}"}
+
+        db.session.execute(text("DELETE FROM email_search" if backend == 'postgresql' else "DELETE FROM email_fts"))
+        db.session.commit()
+
+        indexed_count = 0
+        last_id = ''
+
+        while True:
+            batch = Email.query.filter(Email.id > last_id).order_by(Email.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            for email in batch:
+                index_email_text(email, get_email_text(email))
+            db.session.commit()
+
+            indexed_count += len(batch)
+            last_id = batch[-1].id
+
+        return {
+            "success": True,
+            "message": f"Indexed {indexed_count} emails for search",
+            "indexed": indexed_count
+        }
+
+    except Exception as e:
+        logger.error(f"Error rebuilding search index: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import logging
+from pathlib import Path
+
+from flask import request, current_app, abort
+from sqlalchemy import func
+from werkzeug.http import is_resource_modified
+
+from config import current_config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # Serve gzip only
+    brotli = None
+
+# Response types worth compressing; images and attachments are already compressed
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/javascript', 'application/json'
+)
+
+TEMPLATE_DIR = Path(__file__).parent / 'templates'
+
+_template_version = None
+
+def get_template_version():
+    """Return the newest template modification time, so deploying new templates invalidates cached pages."""
+    global _template_version
+    if _template_version is None:
+        _template_version = max((path.stat().st_mtime_ns for path in TEMPLATE_DIR.glob('*.html')), default=0)
+    return _template_version
+
+def make_etag(*parts):
+    """Hash the values a response is built from into an entity tag."""
+    return hashlib.sha1('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+def get_email_validators(email_id):
+    """
+    Return the ETag and Last-Modified time of an email page, with one query.
+
+    The body is write-once, so the body ID stands in for its content hash.
+    Read state, categories and the stored analysis are the only parts that
+    change, and each bumps the email list row's updated_at or the analysis
+    time.
+
+    Returns:
+        Tuple of (etag, last modified datetime or None)
+    """
+    from app import db
+    from models import Email, EmailListItem, EmailAnalysis
+
+    row = db.session.query(
+        Email.id, Email.body_id, EmailListItem.updated_at, EmailAnalysis.analyzed_at, EmailAnalysis.prompt_version
+    ).outerjoin(EmailListItem, EmailListItem.id == Email.id).outerjoin(
+        EmailAnalysis, EmailAnalysis.email_id == Email.id
+    ).filter(Email.id == email_id).first()
+    if row is None:
+        abort(404)
+
+    etag = make_etag('email', get_template_version(), *row)
+    last_modified = max((time for time in (row.updated_at, row.analyzed_at) if time), default=None)
+    return etag, last_modified
+
+def get_list_validators(*parts):
+    """
+    Return the ETag and Last-Modified time of an email list, from the newest
+    change to any email_list_item row.
+
+    The request path and query string are part of the tag, so each page and
+    filter revalidates separately.
+
+    Args:
+        parts: Anything else the response depends on
+
+    Returns:
+        Tuple of (etag, last modified datetime or None)
+    """
+    from app import db
+    from models import EmailListItem
+
+    latest = db.session.query(func.max(EmailListItem.updated_at)).scalar()
+    etag = make_etag('list', get_template_version(), request.full_path, latest, *parts)
+    return etag, latest
+
+def set_validators(response, etag, last_modified=None):
+    """Attach validators, and have clients revalidate before reusing their copy."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, last_modified=None):
+    """
+    Answer a conditional GET whose cached copy is still current.
+
+    Returns:
+        A 304 response, or None if the client has no current copy
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+def compress_response(response):
+    """Compress a text or JSON response with brotli or gzip, whichever the client accepts."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_config.COMPRESSION_MIN_SIZE:
+        return response
+
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(data, quality=current_config.COMPRESSION_LEVEL))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=current_config.COMPRESSION_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+
+    # The encoded bytes differ from what the tag was computed on
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+def finalize_response(response):
+    """
+    Add validators to GET responses that have none and compress the result.
+
+    Pages without their own validators are tagged by a hash of their content,
+    which still saves the transfer when nothing changed.
+    """
+    if (request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough
+            and not response.is_streamed and response.mimetype in COMPRESSIBLE_TYPES
+            and 'ETag' not in response.headers):
+        response.add_etag()
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+
+    if current_config.COMPRESSION_ENABLED:
+        response = compress_response(response)
+    return response
+
+def init_http_cache(app):
+    """Set static file caching and register conditional GET handling and compression."""
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = current_config.STATIC_CACHE_MAX_AGE
+    app.after_request(finalize_response)
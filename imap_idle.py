@@ -0,0 +1,335 @@
+import re
+import time
+import imaplib
+import random
+import ssl
+import select
+import logging
+import threading
+from datetime import datetime
+
+from app import db
+from config import current_config
+from models import EmailAccount, MailboxSyncState
+
+logger = logging.getLogger(__name__)
+
+MAILBOX = 'INBOX'
+
+# Reconnect delays after a dropped session grow from RECONNECT_MIN to RECONNECT_MAX seconds
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 300
+
+# How often a blocked IDLE checks whether the listener was asked to stop
+STOP_CHECK_SECONDS = 5
+
+# Messages fetched per UID FETCH command
+FETCH_BATCH_SIZE = 25
+
+UID_PATTERN = re.compile(rb'UID (\d+)')
+
+def parse_uid_list(data):
+    """Parse the UIDs from a UID SEARCH response."""
+    if not data or not data[0]:
+        return []
+    return [int(uid) for uid in data[0].split()]
+
+def parse_fetch_response(data):
+    """
+    Pull (uid, raw message) pairs out of a UID FETCH response.
+
+    Returns:
+        List of (uid, bytes) tuples
+    """
+    messages = []
+    for part in data or []:
+        if isinstance(part, tuple) and len(part) == 2:
+            match = UID_PATTERN.search(part[0])
+            if match:
+                messages.append((int(match.group(1)), part[1]))
+    return messages
+
+def has_buffered_data(mail):
+    """
+    Whether imaplib's buffered reader already holds unread server data.
+
+    select() only sees the socket, so lines read off it along with an earlier
+    one would otherwise wait unnoticed until more data arrives.
+    """
+    sock = mail.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+def idle_wait(mail, timeout, stop_event=None):
+    """
+    Issue IDLE and block until the server reports new mail or the timeout passes.
+
+    Args:
+        mail: Authenticated IMAP4 connection with a mailbox selected
+        timeout: Seconds to wait before ending the IDLE
+        stop_event: Optional threading.Event that ends the wait early
+
+    Returns:
+        True if the server sent an EXISTS notification
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+
+    # Wait for the continuation, noting any untagged EXISTS sent first
+    new_mail = False
+    while True:
+        line = mail.readline()
+        if not line:
+            raise mail.abort("Connection closed starting IDLE")
+        if line.startswith(b'+'):
+            break
+        if line.startswith(tag):
+            raise mail.error(f"IDLE rejected: {line!r}")
+        if b'EXISTS' in line:
+            new_mail = True
+
+    deadline = time.monotonic() + timeout
+    sock = mail.socket()
+
+    try:
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (stop_event and stop_event.is_set()):
+                break
+
+            # Wait on the socket rather than setting a timeout, which would break the buffered reader
+            if not has_buffered_data(mail) and not sock.pending():
+                readable, _, _ = select.select([sock], [], [], min(remaining, STOP_CHECK_SECONDS))
+                if not readable:
+                    continue
+
+            line = mail.readline()
+            if not line:
+                raise mail.abort("Connection closed during IDLE")
+            if b'EXISTS' in line:
+                new_mail = True
+            elif line.startswith(b'* BYE'):
+                raise mail.abort(f"Server ended IDLE: {line!r}")
+
+    finally:
+        # End the IDLE and drain responses up to its tagged completion
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line:
+                raise mail.abort("Connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+
+    return new_mail
+
+def get_mailbox_state(account_id, mail, mailbox=MAILBOX):
+    """
+    Load the sync state for a selected mailbox, resetting it if UIDVALIDITY changed.
+
+    New or reset states start at the current end of the mailbox; older mail is
+    left to the regular polling sync.
+    """
+    uidvalidity = int(mail.response('UIDVALIDITY')[1][0])
+    state = db.session.get(MailboxSyncState, (account_id, mailbox))
+
+    if state is None or state.uidvalidity != uidvalidity:
+        typ, data = mail.uid('search', None, 'ALL')
+        uids = parse_uid_list(data) if typ == 'OK' else []
+
+        if state is None:
+            state = MailboxSyncState(account_id=account_id, mailbox=mailbox)
+            db.session.add(state)
+        state.uidvalidity = uidvalidity
+        state.last_uid = max(uids) if uids else 0
+        state.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    return state
+
+def fetch_new_messages(mail, account, state):
+    """
+    Fetch and process messages with UIDs above the last one seen.
+
+    Returns:
+        Number of emails processed
+    """
+    from email_processor import process_email
+
+    typ, data = mail.uid('search', None, f'UID {state.last_uid + 1}:*')
+    if typ != 'OK':
+        logger.error(f"UID search failed for {account.email}: {typ}")
+        return 0
+
+    # "n:*" always matches the newest message, even if its UID is below n
+    uids = sorted(uid for uid in parse_uid_list(data) if uid > state.last_uid)
+    processed_count = 0
+
+    for start in range(0, len(uids), FETCH_BATCH_SIZE):
+        batch = uids[start:start + FETCH_BATCH_SIZE]
+        # BODY.PEEK leaves the messages unread in Gmail
+        typ, data = mail.uid('fetch', ','.join(str(uid) for uid in batch), '(BODY.PEEK[])')
+        if typ != 'OK':
+            logger.error(f"UID fetch failed for {account.email}: {typ}")
+            break
+
+        for uid, raw_email in sorted(parse_fetch_response(data)):
+            if process_email(raw_email, account):
+                processed_count += 1
+            state.last_uid = max(state.last_uid, uid)
+
+        state.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    if processed_count:
+        from inverted_index import flush_search_index
+        flush_search_index()
+        logger.info(f"Ingested {processed_count} new emails for {account.email}")
+    return processed_count
+
+class GmailIdleListener(threading.Thread):
+    """
+    Holds one IMAP IDLE session for a Gmail account and ingests new mail as it arrives.
+
+    The session is re-established with exponential backoff when it drops, and
+    proactively before the OAuth token expires so it can re-authenticate with
+    a refreshed token.
+    """
+
+    def __init__(self, app, account_id):
+        super().__init__(name=f"imap-idle-{account_id}", daemon=True)
+        self.app = app
+        self.account_id = account_id
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        backoff = RECONNECT_MIN_SECONDS
+
+        with self.app.app_context():
+            while not self.stop_event.is_set():
+                try:
+                    if self._run_session():
+                        backoff = RECONNECT_MIN_SECONDS
+                        continue
+                except Exception as e:
+                    logger.error(f"IDLE session for account {self.account_id} failed: {str(e)}")
+                    db.session.rollback()
+
+                delay = random.uniform(backoff / 2, backoff)
+                logger.info(f"Reconnecting IDLE session for account {self.account_id} in {delay:.0f}s")
+                self.stop_event.wait(delay)
+                backoff = min(RECONNECT_MAX_SECONDS, backoff * 2)
+
+            db.session.remove()
+
+    def _run_session(self):
+        """
+        Connect, catch up and IDLE until the token needs refreshing.
+
+        Returns:
+            True if the session ended normally and should be re-established right away
+        """
+        from email_services import connect_gmail
+        from token_manager import token_manager
+
+        account = db.session.get(EmailAccount, self.account_id, populate_existing=True)
+        if account is None:
+            self.stop()
+            return True
+
+        access_token = token_manager.get_token(account)
+        if access_token is None:
+            raise RuntimeError(f"Failed to refresh token for {account.email}")
+
+        try:
+            mail = connect_gmail(account, access_token)
+        except imaplib.IMAP4.error as e:
+            # Token rejected despite not being expired; refresh and try once more
+            logger.info(f"IDLE authentication failed for {account.email}, refreshing token: {str(e)}")
+            access_token = token_manager.get_token(account, stale_token=access_token)
+            if access_token is None:
+                raise
+            mail = connect_gmail(account, access_token)
+
+        # Expiry of the token this session authenticated with, even if it is refreshed meanwhile
+        session_expiry = token_manager.get_expiry(account.id)
+
+        try:
+            mail.select(MAILBOX, readonly=True)
+            state = get_mailbox_state(account.id, mail)
+            logger.info(f"IDLE session open for {account.email} from UID {state.last_uid}")
+
+            # Pick up anything that arrived while disconnected
+            fetch_new_messages(mail, account, state)
+
+            while not self.stop_event.is_set():
+                timeout = current_config.IMAP_IDLE_TIMEOUT_SECONDS
+                if session_expiry:
+                    until_refresh = (session_expiry - token_manager.margin - datetime.utcnow()).total_seconds()
+                    if until_refresh <= 0:
+                        # Reconnect to authenticate with a fresh token
+                        return True
+                    timeout = min(timeout, until_refresh)
+
+                idle_wait(mail, timeout, self.stop_event)
+
+                # Also runs after a plain timeout, catching anything a dropped notification missed
+                fetch_new_messages(mail, account, state)
+
+            return True
+
+        finally:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+def run_idle_listeners(refresh_seconds=60):
+    """
+    Keep one IDLE listener running per Gmail account until interrupted.
+
+    New accounts get a listener and deleted ones are stopped every refresh_seconds.
+    """
+    from flask import current_app
+
+    app = current_app._get_current_object()
+    listeners = {}
+
+    try:
+        while True:
+            account_ids = {
+                account_id for (account_id,) in
+                db.session.query(EmailAccount.id).filter(EmailAccount.account_type == 'gmail').all()
+            }
+            db.session.remove()
+
+            for account_id in account_ids - set(listeners):
+                listener = GmailIdleListener(app, account_id)
+                listener.start()
+                listeners[account_id] = listener
+
+            for account_id in set(listeners) - account_ids:
+                listeners.pop(account_id).stop()
+
+            # Restart any listener whose thread died
+            for account_id, listener in list(listeners.items()):
+                if not listener.is_alive():
+                    listeners[account_id] = GmailIdleListener(app, account_id)
+                    listeners[account_id].start()
+
+            time.sleep(refresh_seconds)
+
+    finally:
+        for listener in listeners.values():
+            listener.stop()
+        for listener in listeners.values():
+            listener.join(timeout=STOP_CHECK_SECONDS * 2)
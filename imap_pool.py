@@ -0,0 +1,209 @@
+import time
+import imaplib
+import logging
+import threading
+from contextlib import contextmanager
+
+from config import current_config
+
+logger = logging.getLogger(__name__)
+
+class PooledConnection:
+    """An authenticated IMAP session plus the token it was authenticated with."""
+
+    def __init__(self, mail, account_id, provider, access_token):
+        self.mail = mail
+        self.account_id = account_id
+        self.provider = provider
+        self.access_token = access_token
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+
+    def is_alive(self):
+        """Validate the session with a NOOP."""
+        try:
+            typ, _ = self.mail.noop()
+            return typ == 'OK'
+        except Exception:
+            return False
+
+class ImapConnectionPool:
+    """
+    Keeps authenticated IMAP sessions warm between syncs, keyed by account.
+
+    Sessions are validated with NOOP before reuse and re-created when the
+    account's access token has been refreshed since they were authenticated.
+    A rejected token is refreshed and authentication retried once.
+    The number of open connections per provider is capped; when the cap is
+    reached, idle sessions of other accounts are closed first, otherwise
+    callers wait for a connection to be released.
+    """
+
+    def __init__(self, connect_fns, get_token, max_per_provider=10, max_idle_seconds=900, acquire_timeout=60):
+        self.connect_fns = connect_fns  # provider -> fn(account, access_token) returning an authenticated IMAP4
+        self.get_token = get_token  # fn(account, stale_token=None) returning a valid access token or None
+        self.max_per_provider = max_per_provider
+        self.max_idle_seconds = max_idle_seconds
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = {}  # account_id -> list of idle PooledConnections, most recent last
+        self._open = {}  # provider -> open connection count, idle or in use
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def connection(self, account):
+        """
+        Borrow an authenticated IMAP connection for an account.
+
+        The connection is returned to the pool afterwards, or closed if the
+        block raised.
+        """
+        conn = self.acquire(account)
+        try:
+            yield conn.mail
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self, account):
+        provider = account.account_type
+        deadline = time.monotonic() + self.acquire_timeout
+
+        access_token = self.get_token(account)
+        if access_token is None:
+            raise RuntimeError(f"No valid token for {account.email}")
+
+        while True:
+            conn = None
+            with self._cond:
+                self._close_expired()
+
+                idle = self._idle.get(account.id)
+                if idle:
+                    conn = idle.pop()
+                elif self._open.get(provider, 0) < self.max_per_provider or self._evict_idle(provider):
+                    self._open[provider] = self._open.get(provider, 0) + 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No {provider} IMAP connection available")
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                return self._connect(account, provider, access_token)
+
+            # Reuse only sessions authenticated with the current token that still answer
+            if conn.access_token == access_token and conn.is_alive():
+                logger.debug(f"Reusing IMAP connection for account {account.id}")
+                return conn
+
+            # Replace the stale session in place, keeping its slot under the cap
+            conn.close()
+            return self._connect(account, provider, access_token)
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._discard(conn)
+            return
+
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.setdefault(conn.account_id, []).append(conn)
+            self._cond.notify()
+
+    def close_account(self, account_id):
+        """Close every idle connection for an account, e.g. after its account is removed."""
+        with self._cond:
+            idle = self._idle.pop(account_id, [])
+        for conn in idle:
+            self._discard(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "open": dict(self._open),
+                "idle": sum(len(conns) for conns in self._idle.values())
+            }
+
+    def _connect(self, account, provider, access_token):
+        connect = self.connect_fns[provider]
+        try:
+            try:
+                mail = connect(account, access_token)
+            except imaplib.IMAP4.error as e:
+                # The server rejected the token; refresh it and authenticate once more
+                logger.info(f"IMAP authentication failed for {account.email}, retrying with a refreshed token: {str(e)}")
+                access_token = self.get_token(account, stale_token=access_token)
+                if access_token is None:
+                    raise
+                mail = connect(account, access_token)
+        except Exception:
+            with self._cond:
+                self._open[provider] -= 1
+                self._cond.notify()
+            raise
+
+        logger.debug(f"Opened IMAP connection for account {account.id}")
+        return PooledConnection(mail, account.id, provider, access_token)
+
+    def _discard(self, conn):
+        conn.close()
+        with self._cond:
+            self._open[conn.provider] = max(0, self._open.get(conn.provider, 0) - 1)
+            self._cond.notify()
+
+    def _evict_idle(self, provider):
+        """Close the least recently used idle connection of a provider. Caller holds the lock."""
+        candidates = [
+            (conn.last_used, account_id, conn)
+            for account_id, conns in self._idle.items()
+            for conn in conns
+            if conn.provider == provider
+        ]
+        if not candidates:
+            return False
+
+        _, account_id, conn = min(candidates, key=lambda c: c[0])
+        self._idle[account_id].remove(conn)
+        conn.close()
+        self._open[provider] -= 1
+        return True
+
+    def _close_expired(self):
+        """Close sessions idle for longer than max_idle_seconds. Caller holds the lock."""
+        cutoff = time.monotonic() - self.max_idle_seconds
+        for account_id, conns in list(self._idle.items()):
+            for conn in [c for c in conns if c.last_used < cutoff]:
+                conns.remove(conn)
+                conn.close()
+                self._open[conn.provider] -= 1
+            if not conns:
+                del self._idle[account_id]
+
+def create_imap_pool():
+    from email_services import connect_gmail
+    from token_manager import token_manager
+
+    return ImapConnectionPool(
+        {'gmail': connect_gmail},
+        token_manager.get_token,
+        max_per_provider=current_config.IMAP_POOL_MAX_PER_PROVIDER,
+        max_idle_seconds=current_config.IMAP_POOL_MAX_IDLE_SECONDS
+    )
+
+imap_pool = create_imap_pool()
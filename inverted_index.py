@@ -0,0 +1,682 @@
+import os
+import re
+import json
+import mmap
+import fcntl
+import atexit
+import struct
+import logging
+import calendar
+import threading
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy as np
+
+from app import db
+from config import current_config
+from models import Email, Category, email_attachments, email_categories
+
+logger = logging.getLogger(__name__)
+
+# Segment file layout: header, fixed-width email IDs, int64 dates, newline-joined
+# sorted terms, uint64 postings offsets (one per term plus an end offset), postings
+SEGMENT_MAGIC = b'EMIDX001'
+SEGMENT_HEADER = struct.Struct('<8sIIIQQQQQ')  # magic, docs, terms, id width, then section offsets
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = 'write.lock'
+
+# Term prefixes for each searchable field
+SUBJECT = 's:'
+SENDER = 'f:'
+BODY = 'b:'
+FLAG = 'h:'
+
+FIELD_PREFIXES = {
+    'subject': (SUBJECT,),
+    'from': (SENDER,),
+    'sender': (SENDER,),
+    'body': (BODY,),
+}
+ANY_FIELD = (SUBJECT, SENDER, BODY)
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# [-][field:]("quoted value" | value)
+QUERY_TERM_PATTERN = re.compile(r'(-?)(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+# Most terms a single prefix query (invoic*) expands to
+MAX_PREFIX_TERMS = 200
+
+# Candidates checked per database round trip when filtering by category
+CATEGORY_FILTER_CHUNK = 500
+
+def encode_varints(values):
+    """Encode non-negative integers as LEB128 varints."""
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return b''
+
+    lengths = np.ones(len(values), dtype=np.int64)
+    remaining = values >> 7
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= 7
+
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        low_bits = (values[mask] >> (7 * k)) & 0x7f
+        continues = (lengths[mask] > k + 1).astype(np.int64) << 7
+        out[starts[mask] + k] = (low_bits | continues).astype(np.uint8)
+    return out.tobytes()
+
+def decode_varints(data):
+    """Decode a buffer of LEB128 varints into an int64 array."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    if data.max() < 0x80:
+        return data.astype(np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, lengths))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+def encode_postings(doc_ids):
+    """Delta-encode a sorted array of document numbers as varints."""
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    return encode_varints(np.diff(doc_ids, prepend=0))
+
+def decode_postings(data):
+    return np.cumsum(decode_varints(data))
+
+def write_segment(path, email_ids, dates, postings):
+    """
+    Write a segment file atomically.
+
+    Args:
+        path: Destination path
+        email_ids: Email ID for each document number
+        dates: Send time (epoch seconds) for each document number
+        postings: Dict mapping terms to sorted arrays of document numbers
+    """
+    terms = sorted(postings)
+    blobs = [encode_postings(postings[term]) for term in terms]
+
+    id_width = max((len(email_id) for email_id in email_ids), default=1)
+    ids = np.array([email_id.encode() for email_id in email_ids], dtype=f'S{id_width}')
+    dates = np.asarray(dates, dtype='<i8')
+    terms_blob = '\n'.join(terms).encode()
+    offsets = np.zeros(len(terms) + 1, dtype='<u8')
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+
+    ids_offset = SEGMENT_HEADER.size
+    dates_offset = ids_offset + ids.nbytes
+    terms_offset = dates_offset + dates.nbytes
+    offsets_offset = terms_offset + len(terms_blob)
+    postings_offset = offsets_offset + offsets.nbytes
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SEGMENT_HEADER.pack(
+            SEGMENT_MAGIC, len(email_ids), len(terms), id_width,
+            ids_offset, dates_offset, terms_offset, offsets_offset, postings_offset
+        ))
+        f.write(ids.tobytes())
+        f.write(dates.tobytes())
+        f.write(terms_blob)
+        f.write(offsets.tobytes())
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class Segment:
+    """A read-only, memory-mapped segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.doc_count, term_count, id_width, ids_offset, dates_offset,
+         terms_offset, offsets_offset, self._postings_offset) = SEGMENT_HEADER.unpack_from(self._map)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a search index segment")
+
+        self._ids = np.frombuffer(self._map, dtype=f'S{id_width}', count=self.doc_count, offset=ids_offset)
+        self.dates = np.frombuffer(self._map, dtype='<i8', count=self.doc_count, offset=dates_offset)
+        terms_blob = self._map[terms_offset:offsets_offset].decode()
+        self.terms = terms_blob.split('\n') if term_count else []
+        self._offsets = np.frombuffer(self._map, dtype='<u8', count=term_count + 1, offset=offsets_offset)
+
+    def email_id(self, doc):
+        return self._ids[doc].decode()
+
+    def postings(self, term):
+        i = bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return np.empty(0, dtype=np.int64)
+        start = self._postings_offset + int(self._offsets[i])
+        end = self._postings_offset + int(self._offsets[i + 1])
+        return decode_postings(self._map[start:end])
+
+    def terms_with_prefix(self, prefix):
+        i = bisect_left(self.terms, prefix)
+        matches = []
+        while i < len(self.terms) and self.terms[i].startswith(prefix) and len(matches) < MAX_PREFIX_TERMS:
+            matches.append(self.terms[i])
+            i += 1
+        return matches
+
+class MemorySegment:
+    """Documents added in this process that have not been flushed to disk yet."""
+
+    def __init__(self):
+        self.email_ids = []
+        self.date_list = []
+        self.term_docs = {}
+
+    @property
+    def doc_count(self):
+        return len(self.email_ids)
+
+    @property
+    def dates(self):
+        return np.array(self.date_list, dtype=np.int64)
+
+    def add(self, email_id, date, terms):
+        doc = len(self.email_ids)
+        self.email_ids.append(email_id)
+        self.date_list.append(date)
+        for term in terms:
+            self.term_docs.setdefault(term, []).append(doc)
+
+    def email_id(self, doc):
+        return self.email_ids[doc]
+
+    def postings(self, term):
+        return np.array(self.term_docs.get(term, ()), dtype=np.int64)
+
+    def terms_with_prefix(self, prefix):
+        return sorted(term for term in self.term_docs if term.startswith(prefix))[:MAX_PREFIX_TERMS]
+
+class InvertedIndex:
+    """
+    Embedded on-disk inverted index of email subjects, senders and bodies.
+
+    New documents are buffered in memory and flushed as immutable segment
+    files; a manifest lists the live segments. Segments of similar size are
+    merged once merge_factor of them accumulate, keeping the segment count
+    logarithmic in the number of documents. Writers in different processes
+    serialize on a lock file; readers pick up new segments when the manifest
+    changes.
+    """
+
+    def __init__(self, directory, flush_docs=1000, merge_factor=10):
+        self.directory = Path(directory)
+        self.flush_docs = flush_docs
+        self.merge_factor = merge_factor
+
+        self._lock = threading.RLock()
+        self._buffer = MemorySegment()
+        self._segments = {}  # file name -> open Segment
+        self._manifest_mtime = None
+
+    def add(self, email_id, date, terms):
+        with self._lock:
+            self._buffer.add(email_id, date, terms)
+            if self._buffer.doc_count >= self.flush_docs:
+                self.flush()
+
+    def flush(self):
+        """Write buffered documents to a new segment and merge segments if needed."""
+        with self._lock:
+            if not self._buffer.doc_count:
+                return
+
+            buffer = self._buffer
+            with self._write_lock():
+                manifest = self._read_manifest()
+                name = f"seg_{manifest['generation']:08d}.idx"
+                write_segment(
+                    self.directory / name,
+                    buffer.email_ids,
+                    buffer.date_list,
+                    {term: np.array(docs, dtype=np.int64) for term, docs in buffer.term_docs.items()}
+                )
+                manifest['generation'] += 1
+                manifest['segments'].append({"name": name, "doc_count": buffer.doc_count})
+                self._write_manifest(manifest)
+
+                self._buffer = MemorySegment()
+                self._merge_tiers(manifest)
+
+            logger.debug(f"Flushed {buffer.doc_count} documents to search index segment {name}")
+
+    def optimize(self):
+        """Merge every segment into one."""
+        with self._lock, self._write_lock():
+            manifest = self._read_manifest()
+            if len(manifest['segments']) > 1:
+                self._merge(manifest, manifest['segments'])
+
+    def clear(self):
+        """Remove every document from the index."""
+        with self._lock, self._write_lock():
+            manifest = self._read_manifest()
+            old = [entry['name'] for entry in manifest['segments']]
+            manifest['segments'] = []
+            self._write_manifest(manifest)
+            self._remove_segment_files(old)
+            self._buffer = MemorySegment()
+
+    def get_segments(self):
+        """Return the live segments, including unflushed documents from this process."""
+        with self._lock:
+            manifest_path = self.directory / MANIFEST_NAME
+            try:
+                mtime = manifest_path.stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+
+            if mtime != self._manifest_mtime:
+                names = [entry['name'] for entry in self._read_manifest()['segments']]
+                segments = {}
+                for name in names:
+                    segment = self._segments.get(name)
+                    if segment is None:
+                        try:
+                            segment = Segment(self.directory / name)
+                        except FileNotFoundError:
+                            # Merged away since the manifest was read; retry on the next call
+                            mtime = None
+                            continue
+                    segments[name] = segment
+                self._segments = segments
+                self._manifest_mtime = mtime
+
+            segments = list(self._segments.values())
+            if self._buffer.doc_count:
+                segments.append(self._buffer)
+            return segments
+
+    def get_stats(self):
+        segments = self.get_segments()
+        return {
+            "segments": len(segments),
+            "documents": sum(segment.doc_count for segment in segments),
+            "buffered": self._buffer.doc_count
+        }
+
+    def _merge_tiers(self, manifest):
+        """Merge groups of merge_factor segments within the same size tier. Caller holds the write lock."""
+        while True:
+            tiers = {}
+            for entry in manifest['segments']:
+                tier = 0
+                size = entry['doc_count']
+                while size >= self.flush_docs * self.merge_factor ** (tier + 1):
+                    tier += 1
+                tiers.setdefault(tier, []).append(entry)
+
+            full = [entries for _, entries in sorted(tiers.items()) if len(entries) >= self.merge_factor]
+            if not full:
+                return
+            self._merge(manifest, full[0][:self.merge_factor])
+
+    def _merge(self, manifest, entries):
+        """Combine segments into one, renumbering documents in manifest order. Caller holds the write lock."""
+        names = [entry['name'] for entry in entries]
+        sources = [Segment(self.directory / name) for name in names]
+
+        email_ids, dates, bases = [], [], []
+        for segment in sources:
+            bases.append(len(email_ids))
+            email_ids.extend(segment.email_id(doc) for doc in range(segment.doc_count))
+            dates.append(np.asarray(segment.dates))
+
+        postings = {}
+        for base, segment in zip(bases, sources):
+            for term in segment.terms:
+                postings.setdefault(term, []).append(segment.postings(term) + base)
+
+        name = f"seg_{manifest['generation']:08d}.idx"
+        write_segment(
+            self.directory / name,
+            email_ids,
+            np.concatenate(dates) if dates else [],
+            {term: np.concatenate(parts) for term, parts in postings.items()}
+        )
+
+        # The merged segment takes the place of the first one, keeping document order stable
+        position = min(manifest['segments'].index(entry) for entry in entries)
+        remaining = [entry for entry in manifest['segments'] if entry['name'] not in names]
+        remaining.insert(position, {"name": name, "doc_count": len(email_ids)})
+        manifest['segments'] = remaining
+        manifest['generation'] += 1
+        self._write_manifest(manifest)
+        self._remove_segment_files(names)
+
+        logger.info(f"Merged {len(names)} search index segments into {name} ({len(email_ids)} documents)")
+
+    def _read_manifest(self):
+        try:
+            with open(self.directory / MANIFEST_NAME) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "segments": []}
+
+    def _write_manifest(self, manifest):
+        path = self.directory / MANIFEST_NAME
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_segment_files(self, names):
+        # Readers that still have a removed segment mapped keep working until they reload
+        for name in names:
+            try:
+                os.remove(self.directory / name)
+            except FileNotFoundError:
+                pass
+
+    def _write_lock(self):
+        return FileLock(self.directory / LOCK_NAME)
+
+class FileLock:
+    """Exclusive lock shared by every process writing to the index."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+def to_epoch(value):
+    return calendar.timegm(value.utctimetuple()) if value else 0
+
+def get_document_terms(subject, sender, body_text, has_attachment):
+    """Return the set of field-prefixed terms for an email."""
+    terms = {SUBJECT + word for word in WORD_PATTERN.findall((subject or '').lower())}
+    terms.update(SENDER + word for word in WORD_PATTERN.findall((sender or '').lower()))
+    body = (body_text or '')[:current_config.SEARCH_MAX_BODY_CHARS]
+    terms.update(BODY + word for word in WORD_PATTERN.findall(body.lower()))
+    if has_attachment:
+        terms.add(FLAG + 'attachment')
+    return terms
+
+def index_email_document(email_obj, body_text):
+    """
+    Add a newly processed email to the inverted index when it is the configured search engine.
+
+    The email must already have an ID (i.e. be flushed).
+    """
+    if current_config.SEARCH_ENGINE != 'index':
+        return
+
+    try:
+        terms = get_document_terms(email_obj.subject, email_obj.sender, body_text, bool(email_obj.attachments))
+        get_inverted_index().add(email_obj.id, to_epoch(email_obj.date_sent), terms)
+    except Exception as e:
+        logger.error(f"Error adding email {email_obj.id} to the search index: {str(e)}")
+
+def flush_search_index():
+    """Persist buffered documents so other processes can search them."""
+    if current_config.SEARCH_ENGINE != 'index' or _index is None:
+        return
+    try:
+        _index.flush()
+    except Exception as e:
+        logger.error(f"Error flushing search index: {str(e)}")
+
+def parse_index_query(query):
+    """
+    Parse a search string into clauses.
+
+    Bare words match the subject, sender or body; from:, subject: and body:
+    restrict a word or quoted value to one field; has:attachment and
+    category:"Name" filter results. Terms may be prefixed with '-' to exclude
+    them, joined with OR, or end in '*' to match as a prefix.
+
+    Returns:
+        Dict with 'groups' (required; any clause in a group may match),
+        'excluded' clauses, and 'categories' / 'excluded_categories' names
+    """
+    parsed = {"groups": [], "excluded": [], "categories": [], "excluded_categories": []}
+    alternative = False
+
+    for match in QUERY_TERM_PATTERN.finditer(query or ''):
+        negated = bool(match.group(1))
+        field = (match.group(2) or '').lower()
+        quoted = match.group(3) is not None
+        value = match.group(3) if quoted else match.group(4)
+
+        if not field and not quoted and value == 'OR' and not negated:
+            alternative = bool(parsed["groups"])
+            continue
+
+        if field == 'category':
+            parsed["excluded_categories" if negated else "categories"].append(value.lower())
+            alternative = False
+            continue
+
+        if field == 'has':
+            clause = {"words": [value.lower()], "prefixes": (FLAG,), "prefix": False}
+        else:
+            prefixes = FIELD_PREFIXES.get(field)
+            if prefixes is None:
+                # Not a known field, so the colon was part of the text
+                prefixes = ANY_FIELD
+                value = match.group(0).lstrip('-')
+            clause = {
+                "words": WORD_PATTERN.findall(value.lower()),
+                "prefixes": prefixes,
+                "prefix": not quoted and value.endswith('*')
+            }
+
+        if clause["words"]:
+            if negated:
+                parsed["excluded"].append(clause)
+            elif alternative:
+                parsed["groups"][-1].append(clause)
+            else:
+                parsed["groups"].append([clause])
+        alternative = False
+
+    return parsed
+
+def match_clause(segment, clause):
+    """Return a mask of the documents in a segment matching every word of a clause."""
+    result = np.ones(segment.doc_count, dtype=bool)
+    last = len(clause["words"]) - 1
+    for i, word in enumerate(clause["words"]):
+        if clause["prefix"] and i == last:
+            terms = [term for field_prefix in clause["prefixes"] for term in segment.terms_with_prefix(field_prefix + word)]
+        else:
+            terms = [field_prefix + word for field_prefix in clause["prefixes"]]
+
+        matches = np.zeros(segment.doc_count, dtype=bool)
+        for term in terms:
+            matches[segment.postings(term)] = True
+        result &= matches
+    return result
+
+def match_segment(segment, parsed):
+    """
+    Evaluate a parsed query against one segment.
+
+    Bitmaps over the segment's documents keep AND/OR/NOT linear in the
+    segment size, however common the terms are.
+
+    Returns:
+        Sorted array of matching document numbers
+    """
+    result = np.ones(segment.doc_count, dtype=bool)
+    for group in parsed["groups"]:
+        matches = match_clause(segment, group[0])
+        for clause in group[1:]:
+            matches |= match_clause(segment, clause)
+        result &= matches
+
+    for clause in parsed["excluded"]:
+        result &= ~match_clause(segment, clause)
+    return np.flatnonzero(result)
+
+def filter_by_categories(email_ids, categories, excluded_categories):
+    """Keep emails in every listed category and none of the excluded ones."""
+    from sqlalchemy import func
+
+    wanted = {name: set() for name in categories + excluded_categories}
+    rows = db.session.query(email_categories.c.email_id, func.lower(Category.name)).join(
+        Category, Category.id == email_categories.c.category_id
+    ).filter(
+        email_categories.c.email_id.in_(email_ids),
+        func.lower(Category.name).in_(list(wanted))
+    ).all()
+    for email_id, name in rows:
+        wanted[name].add(email_id)
+
+    return [
+        email_id for email_id in email_ids
+        if all(email_id in wanted[name] for name in categories)
+        and not any(email_id in wanted[name] for name in excluded_categories)
+    ]
+
+def search_inverted_index(query, limit=100):
+    """
+    Search the inverted index, newest matches first.
+
+    Returns:
+        List of Email objects
+    """
+    from sqlalchemy import func
+
+    parsed = parse_index_query(query)
+    categories, excluded_categories = parsed["categories"], parsed["excluded_categories"]
+
+    if not parsed["groups"]:
+        if not categories:
+            return []
+        # Category-only queries are answered from the database's category links
+        email_query = Email.query
+        for name in categories:
+            email_query = email_query.filter(Email.categories.any(func.lower(Category.name) == name))
+        for name in excluded_categories:
+            email_query = email_query.filter(~Email.categories.any(func.lower(Category.name) == name))
+        return email_query.order_by(Email.date_sent.desc()).limit(limit).all()
+
+    matches = []
+    for segment in get_inverted_index().get_segments():
+        docs = match_segment(segment, parsed)
+        if len(docs):
+            matches.append((segment, docs, segment.dates[docs]))
+    if not matches:
+        return []
+
+    segment_index = np.concatenate([np.full(len(docs), i) for i, (_, docs, _) in enumerate(matches)])
+    docs = np.concatenate([docs for _, docs, _ in matches])
+    dates = np.concatenate([dates for _, _, dates in matches])
+
+    # Only the newest `limit` matches are needed unless categories filter some out
+    if not (categories or excluded_categories) and len(dates) > limit:
+        top = np.argpartition(-dates, limit)[:limit]
+        order = top[np.argsort(-dates[top], kind='stable')]
+    else:
+        order = np.argsort(-dates, kind='stable')
+
+    email_ids = []
+    for start in range(0, len(order), CATEGORY_FILTER_CHUNK):
+        chunk = [matches[segment_index[i]][0].email_id(docs[i]) for i in order[start:start + CATEGORY_FILTER_CHUNK]]
+        if categories or excluded_categories:
+            chunk = filter_by_categories(chunk, categories, excluded_categories)
+        email_ids.extend(chunk)
+        if len(email_ids) >= limit:
+            break
+
+    email_ids = email_ids[:limit]
+    emails = {email.id: email for email in Email.query.filter(Email.id.in_(email_ids)).all()}
+    return [emails[email_id] for email_id in email_ids if email_id in emails]
+
+def rebuild_inverted_index(batch_size=1000):
+    """
+    Rebuild the inverted index from every stored email.
+
+    Returns:
+        Dict with results
+    """
+    from keyword_index import get_email_text
+
+    try:
+        index = get_inverted_index()
+        index.clear()
+
+        indexed_count = 0
+        last_id = ''
+
+        while True:
+            batch = Email.query.filter(Email.id > last_id).order_by(Email.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            with_attachments = {
+                email_id for (email_id,) in db.session.query(email_attachments.c.email_id).filter(
+                    email_attachments.c.email_id.in_([email.id for email in batch])
+                ).distinct()
+            }
+            for email in batch:
+                terms = get_document_terms(email.subject, email.sender, get_email_text(email), email.id in with_attachments)
+                index.add(email.id, to_epoch(email.date_sent), terms)
+
+            indexed_count += len(batch)
+            last_id = batch[-1].id
+            db.session.expunge_all()
+
+        index.flush()
+        index.optimize()
+
+        return {
+            "success": True,
+            "message": f"Indexed {indexed_count} emails for search",
+            "indexed": indexed_count
+        }
+
+    except Exception as e:
+        logger.error(f"Error rebuilding search index: {str(e)}")
+        return {"success": False, "message": f"Error: {str(e)}"}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_inverted_index():
+    """Return this process's handle on the shared on-disk index."""
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            from storage import SEARCH_INDEX_DIR
+            _index = InvertedIndex(
+                SEARCH_INDEX_DIR,
+                flush_docs=current_config.SEARCH_INDEX_FLUSH_DOCS,
+                merge_factor=current_config.SEARCH_INDEX_MERGE_FACTOR
+            )
+            # Don't lose buffered documents when the process exits normally
+            atexit.register(_index.flush)
+        return _index
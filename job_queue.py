@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import random
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import db
+from config import current_config
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job priorities; higher runs first
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+# Retry delays grow as RETRY_BASE_SECONDS * 2 ** (attempt - 1), capped at RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+# How often an idle worker looks for jobs abandoned by crashed workers
+RECOVERY_INTERVAL_SECONDS = 60
+
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """Register a function as the handler for a job kind."""
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+def job_progress(job):
+    """
+    Build a progress callback for a handler's long-running work.
+
+    Each call records progress and refreshes the job's lock, so the worker
+    isn't mistaken for a crashed one and the job requeued while it runs.
+    Returns None when the handler is running inline rather than as a job.
+    """
+    if job is None:
+        return None
+
+    job_id = job.id
+    def progress(fraction, message=None):
+        update_job_progress(job_id, fraction, message)
+    return progress
+
+@job_handler('sync_all')
+def handle_sync_all(payload, job):
+    from email_processor import process_new_emails
+    return process_new_emails(progress=job_progress(job))
+
+@job_handler('sync_account')
+def handle_sync_account(payload, job):
+    from models import EmailAccount
+    from email_processor import process_account_emails
+
+    account = db.session.get(EmailAccount, payload['account_id'])
+    if not account:
+        return {"success": False, "message": "Account not found"}
+
+    result = process_account_emails(account, progress=job_progress(job))
+
+    # Update last sync time
+    account.last_sync = datetime.utcnow()
+    db.session.commit()
+    return result
+
+@job_handler('categorize')
+def handle_categorize(payload, job):
+    from ai_service import categorize_uncategorized_emails
+    return categorize_uncategorized_emails(limit=payload.get('limit', 100), progress=job_progress(job))
+
+@job_handler('suggest_rules')
+def handle_suggest_rules(payload, job):
+    from ai_service import suggest_rules
+    return suggest_rules(limit=payload.get('limit', 5))
+
+@job_handler('analyze_email')
+def handle_analyze_email(payload, job):
+    from ai_service import analyze_email_content
+    return analyze_email_content(payload['email_id'], force=payload.get('force', False))
+
+@job_handler('train_categorizer')
+def handle_train_categorizer(payload, job):
+    from local_categorizer import train_local_categorizer
+    return train_local_categorizer(min_examples=current_config.LOCAL_CATEGORIZER_MIN_EXAMPLES)
+
+@job_handler('rule_backfill')
+def handle_rule_backfill(payload, job):
+    from rule_backfill import run_rule_backfill
+    return run_rule_backfill(payload['backfill_id'], progress=job_progress(job))
+
+def make_dedupe_key(kind, payload):
+    return f"{kind}:{json.dumps(payload or {}, sort_keys=True, separators=(',', ':'))}"
+
+def enqueue_job(kind, payload=None, priority=PRIORITY_NORMAL, max_attempts=None, dedupe=True):
+    """
+    Add a job to the queue.
+
+    Args:
+        kind: Registered job kind
+        payload: JSON-serializable arguments for the handler
+        priority: Higher priorities are claimed first
+        max_attempts: Attempts before the job is marked failed (defaults to JOB_MAX_ATTEMPTS)
+        dedupe: Return an identical pending job instead of adding another
+
+    Returns:
+        The queued (or existing) Job
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    dedupe_key = make_dedupe_key(kind, payload)
+    if dedupe:
+        existing = Job.query.filter(
+            Job.dedupe_key == dedupe_key,
+            Job.status == 'pending'
+        ).order_by(Job.id).first()
+        if existing:
+            # A more urgent request promotes the waiting job
+            if priority > (existing.priority or 0):
+                existing.priority = priority
+                db.session.commit()
+            return existing
+
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        dedupe_key=dedupe_key,
+        status='pending',
+        priority=priority,
+        attempts=0,
+        max_attempts=max_attempts or current_config.JOB_MAX_ATTEMPTS,
+        run_after=datetime.utcnow()
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def submit_job(kind, payload=None, priority=PRIORITY_NORMAL):
+    """
+    Queue a job for the worker, or run it inline when background jobs are disabled.
+
+    Returns:
+        Dict with the job ID when queued, otherwise the handler's result
+    """
+    if not current_config.BACKGROUND_JOBS_ENABLED:
+        return JOB_HANDLERS[kind](payload or {}, None)
+
+    job = enqueue_job(kind, payload, priority=priority)
+    return {
+        "success": True,
+        "message": "Job queued",
+        "job_id": job.id,
+        "status": job.status
+    }
+
+def claim_job(worker_id, kinds=None):
+    """
+    Lock the highest-priority runnable job for this worker.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, so
+    concurrent workers never wait on or claim the same row; the conditional
+    UPDATE keeps claiming safe on databases without row locks (SQLite).
+
+    Returns:
+        The claimed Job, or None if nothing is runnable
+    """
+    for _ in range(3):
+        now = datetime.utcnow()
+        query = db.session.query(Job.id).filter(Job.status == 'pending', Job.run_after <= now)
+        if kinds:
+            query = query.filter(Job.kind.in_(kinds))
+        job_id = query.order_by(Job.priority.desc(), Job.id).limit(1).with_for_update(skip_locked=True).scalar()
+
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'pending')
+            .values(
+                status='running',
+                locked_by=worker_id,
+                locked_at=now,
+                started_at=now,
+                attempts=Job.attempts + 1
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        if result.rowcount:
+            return db.session.get(Job, job_id, populate_existing=True)
+
+    return None
+
+def update_job_progress(job_id, progress, message=None):
+    """Record progress (0.0 to 1.0) for a running job and refresh its lock."""
+    if job_id is None:
+        return
+
+    values = {"progress": max(0.0, min(1.0, progress)), "locked_at": datetime.utcnow()}
+    if message is not None:
+        values["message"] = message
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(**values).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+class JobHeartbeat(threading.Thread):
+    """
+    Refreshes a running job's lock on a timer, on its own connection.
+
+    Covers handlers that make a single long call (an AI request, model
+    training) and can't report progress as they go.
+    """
+
+    def __init__(self, engine, job_id, interval):
+        super().__init__(name=f"job-heartbeat-{job_id}", daemon=True)
+        self.engine = engine
+        self.job_id = job_id
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        update(Job)
+                        .where(Job.id == self.job_id, Job.status == 'running')
+                        .values(locked_at=datetime.utcnow())
+                    )
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {self.job_id} failed: {str(e)}")
+
+def run_job(job):
+    """
+    Run a claimed job and record the outcome.
+
+    A handler result with success False fails the job immediately; exceptions
+    are retried with exponential backoff until max_attempts is reached.
+    """
+    handler = JOB_HANDLERS.get(job.kind)
+    job_id = job.id
+    kind = job.kind
+
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind {kind}")
+
+        # Beat well inside the lock timeout so recover_stale_jobs leaves the job alone
+        heartbeat = JobHeartbeat(db.engine, job_id, current_config.JOB_LOCK_TIMEOUT_MINUTES * 60 / 3)
+        heartbeat.start()
+        try:
+            result = handler(json.loads(job.payload or '{}'), job)
+        finally:
+            heartbeat.stop()
+        job = db.session.get(Job, job_id)
+
+        succeeded = not isinstance(result, dict) or result.get("success", True)
+        job.status = 'completed' if succeeded else 'failed'
+        job.result = json.dumps(result, default=str)
+        job.message = result.get("message") if isinstance(result, dict) else None
+        job.progress = 1.0
+        job.finished_at = datetime.utcnow()
+        job.locked_by = None
+        db.session.commit()
+
+        logger.info(f"Job {job_id} ({kind}) {job.status}: {job.message}")
+
+    except Exception as e:
+        # Roll back first; a failed flush leaves the session unusable, even for reading job
+        db.session.rollback()
+        logger.error(f"Job {job_id} ({kind}) raised: {str(e)}")
+
+        job = db.session.get(Job, job_id)
+        job.error = str(e)
+        job.locked_by = None
+        if job.attempts < job.max_attempts:
+            delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            job.status = 'pending'
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    return job
+
+def recover_stale_jobs():
+    """
+    Return jobs whose worker stopped refreshing its lock to the queue.
+
+    Returns:
+        Number of jobs recovered
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=current_config.JOB_LOCK_TIMEOUT_MINUTES)
+    stale = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).all()
+
+    for job in stale:
+        logger.warning(f"Job {job.id} ({job.kind}) lost its worker {job.locked_by}, requeueing")
+        job.locked_by = None
+        if job.attempts < job.max_attempts:
+            job.status = 'pending'
+            job.run_after = datetime.utcnow()
+        else:
+            job.status = 'failed'
+            job.error = 'Worker stopped responding'
+            job.finished_at = datetime.utcnow()
+
+    db.session.commit()
+    return len(stale)
+
+def run_worker(worker_id=None, kinds=None, poll_interval=None, once=False):
+    """
+    Claim and run jobs until interrupted.
+
+    Args:
+        worker_id: Name recorded on claimed jobs (defaults to host:pid)
+        kinds: Only run these job kinds
+        poll_interval: Seconds to sleep when the queue is empty (defaults to JOB_POLL_INTERVAL)
+        once: Exit as soon as the queue is empty
+
+    Returns:
+        Number of jobs run
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = poll_interval or current_config.JOB_POLL_INTERVAL
+    processed = 0
+    last_recovery = 0
+
+    logger.info(f"Worker {worker_id} started")
+    while True:
+        if time.monotonic() - last_recovery > RECOVERY_INTERVAL_SECONDS:
+            recover_stale_jobs()
+            last_recovery = time.monotonic()
+
+        job = claim_job(worker_id, kinds)
+        if job is None:
+            if once:
+                break
+            db.session.remove()
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Worker {worker_id} running job {job.id} ({job.kind}), attempt {job.attempts}")
+        run_job(job)
+        processed += 1
+
+    return processed
+
+def get_job_status(job):
+    """Serialize a job for JSON responses."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "payload": json.loads(job.payload or '{}'),
+        "status": job.status,
+        "priority": job.priority,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "progress": job.progress or 0.0,
+        "message": job.message,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
@@ -0,0 +1,318 @@
+import logging
+import threading
+from collections import deque
+
+from bs4 import BeautifulSoup
+from sqlalchemy import func, update
+
+from app import db
+from models import Email, Keyword, keyword_emails
+
+logger = logging.getLogger(__name__)
+
+class AhoCorasick:
+    """
+    Case-insensitive Aho-Corasick automaton for matching many patterns in one pass.
+
+    Patterns can be added at any time; failure links are rebuilt on the next
+    build() or search, so adding keywords never requires re-reading existing
+    ones. Adding and searching are not safe to run concurrently, so shared
+    automatons are built before use and guarded by their owner.
+    """
+
+    def __init__(self, patterns=()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._own = [[]]  # patterns ending exactly at each node
+        self._out = [[]]  # own patterns plus those reachable through failure links
+        self._dirty = False
+        self.pattern_count = 0
+
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return self.pattern_count
+
+    def add(self, pattern):
+        """Insert a pattern into the trie."""
+        pattern = (pattern or '').lower()
+        if not pattern:
+            return
+
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+                self._out.append([])
+            node = next_node
+
+        if pattern not in self._own[node]:
+            self._own[node].append(pattern)
+            self.pattern_count += 1
+            self._dirty = True
+
+    def build(self):
+        """Compute failure links and merged outputs with a breadth-first walk."""
+        if not self._dirty:
+            return
+
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._out[child] = list(self._own[child])
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._out[child] = self._own[child] + self._out[fail]
+                queue.append(child)
+
+        self._dirty = False
+
+    def search(self, text):
+        """
+        Scan text once and yield every pattern occurrence.
+
+        Yields:
+            (start, end, pattern) tuples with offsets into the lowercased text
+        """
+        if not text or not self.pattern_count:
+            return
+
+        self.build()
+
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, char in enumerate(text.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern in out[node]:
+                yield i - len(pattern) + 1, i + 1, pattern
+
+def is_whole_word(text, start, end):
+    """Check that a match is not embedded inside a longer word."""
+    if start > 0 and text[start - 1].isalnum():
+        return False
+    if end < len(text) and text[end].isalnum():
+        return False
+    return True
+
+class KeywordIndex:
+    """Automaton over all Keyword.text values, mapping matches back to keyword IDs."""
+
+    def __init__(self):
+        # IDLE listeners ingest on separate threads; refresh mutates the automaton that matching walks
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.automaton = AhoCorasick()
+        self.keyword_ids = {}  # lowercased text -> set of keyword IDs
+        self.keyword_count = 0
+        self.last_id = 0
+
+    def add(self, keyword_id, text):
+        pattern = (text or '').strip().lower()
+        if not pattern:
+            return
+        self.automaton.add(pattern)
+        self.keyword_ids.setdefault(pattern, set()).add(keyword_id)
+
+    def refresh(self):
+        """Load keywords added since the last refresh, rebuilding if any were removed."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        count, max_id = db.session.query(func.count(Keyword.id), func.max(Keyword.id)).one()
+        max_id = max_id or 0
+
+        if count == self.keyword_count and max_id == self.last_id:
+            return self
+
+        new_keywords = Keyword.query.filter(Keyword.id > self.last_id).all()
+        if self.keyword_count + len(new_keywords) != count:
+            # Keywords were deleted, so start over from the full table
+            logger.info("Keyword table shrank, rebuilding keyword index")
+            self.reset()
+            new_keywords = Keyword.query.all()
+
+        for keyword in new_keywords:
+            self.add(keyword.id, keyword.text)
+
+        self.automaton.build()
+        self.keyword_count = count
+        self.last_id = max_id
+        logger.debug(f"Keyword index refreshed with {len(new_keywords)} new keywords")
+        return self
+
+    def match_ids(self, *texts):
+        """Return the IDs of all keywords appearing as whole words in any text."""
+        matched = set()
+        with self._lock:
+            for text in texts:
+                if not text:
+                    continue
+                lowered = text.lower()
+                for start, end, pattern in self.automaton.search(lowered):
+                    if is_whole_word(lowered, start, end):
+                        matched.update(self.keyword_ids.get(pattern, ()))
+        return matched
+
+_index = KeywordIndex()
+
+def get_keyword_index():
+    """Return the shared keyword index, picking up any newly added keywords."""
+    return _index.refresh()
+
+def add_keywords(texts):
+    """
+    Create Keyword rows for new texts and add them to the index.
+
+    Args:
+        texts: Iterable of keyword strings
+
+    Returns:
+        List of created Keyword objects
+    """
+    texts = {t.strip() for t in texts if t and t.strip()}
+    if not texts:
+        return []
+
+    existing = {k.text for k in Keyword.query.filter(Keyword.text.in_(texts)).all()}
+    created = [Keyword(text=text, assigned_count=0) for text in sorted(texts - existing)]
+    db.session.add_all(created)
+    db.session.commit()
+
+    get_keyword_index()
+    return created
+
+def link_keywords(email_keyword_pairs):
+    """Bulk insert keyword_emails rows and bump each keyword's assigned_count."""
+    if not email_keyword_pairs:
+        return
+
+    db.session.execute(keyword_emails.insert(), [
+        {"keyword_id": keyword_id, "email_id": email_id}
+        for email_id, keyword_id in email_keyword_pairs
+    ])
+
+    counts = {}
+    for _, keyword_id in email_keyword_pairs:
+        counts[keyword_id] = counts.get(keyword_id, 0) + 1
+
+    for keyword_id, count in counts.items():
+        db.session.execute(
+            update(Keyword)
+            .where(Keyword.id == keyword_id)
+            .values(assigned_count=func.coalesce(Keyword.assigned_count, 0) + count)
+        )
+
+def index_email_keywords(email_obj, body_text=None):
+    """
+    Link an email to every keyword found in its subject or body.
+
+    The email must already have an ID (i.e. be flushed).
+
+    Returns:
+        Set of matched keyword IDs
+    """
+    try:
+        index = get_keyword_index()
+        if not len(index.automaton):
+            return set()
+
+        keyword_ids = index.match_ids(email_obj.subject, body_text)
+        link_keywords([(email_obj.id, keyword_id) for keyword_id in keyword_ids])
+        return keyword_ids
+
+    except Exception as e:
+        logger.error(f"Error indexing keywords for email {email_obj.id}: {str(e)}")
+        return set()
+
+def get_email_text(email_obj):
+    """Load an email's body from storage as plain text."""
+    from storage import load_email_body
+
+    if not email_obj.body_id:
+        return None
+
+    content = load_email_body(email_obj.body_id, email_obj.format)
+    if content and email_obj.format == 'html':
+        content = BeautifulSoup(content, 'html.parser').get_text(' ', strip=True)
+    return content
+
+def reindex_keywords(keyword_ids=None, batch_size=500):
+    """
+    Rebuild keyword_emails links for existing emails.
+
+    Args:
+        keyword_ids: Optional list of keyword IDs to backfill (defaults to all)
+        batch_size: Number of emails scanned per commit
+
+    Returns:
+        Dict with results
+    """
+    try:
+        query = Keyword.query
+        if keyword_ids:
+            query = query.filter(Keyword.id.in_(keyword_ids))
+        keywords = query.all()
+
+        if not keywords:
+            return {"success": True, "message": "No keywords to index", "linked": 0}
+
+        index = KeywordIndex()
+        for keyword in keywords:
+            index.add(keyword.id, keyword.text)
+
+        # Clear existing links so the backfill can be re-run safely
+        ids = [k.id for k in keywords]
+        db.session.execute(keyword_emails.delete().where(keyword_emails.c.keyword_id.in_(ids)))
+        db.session.execute(update(Keyword).where(Keyword.id.in_(ids)).values(assigned_count=0))
+        db.session.commit()
+
+        linked_count = 0
+        scanned_count = 0
+        last_id = ''
+
+        while True:
+            batch = Email.query.filter(Email.id > last_id).order_by(Email.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            pairs = []
+            for email in batch:
+                for keyword_id in index.match_ids(email.subject, get_email_text(email)):
+                    pairs.append((email.id, keyword_id))
+
+            link_keywords(pairs)
+            db.session.commit()
+
+            linked_count += len(pairs)
+            scanned_count += len(batch)
+            last_id = batch[-1].id
+
+        return {
+            "success": True,
+            "message": f"Linked {linked_count} keyword occurrences across {scanned_count} emails",
+            "linked": linked_count
+        }
+
+    except Exception as e:
+        logger.error(f"Error reindexing keywords: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
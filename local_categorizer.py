@@ -0,0 +1,288 @@
+import re
+import zlib
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from app import db
+from models import Email, Category, email_categories
+from storage import MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+# Number of hashed feature buckets; large enough to keep collisions rare
+FEATURE_DIM = 2 ** 15
+
+# Emails vectorized at once, bounding memory to BATCH_SIZE x FEATURE_DIM floats
+BATCH_SIZE = 256
+
+# Maximum number of categories predicted per email, matching the AI prompt
+MAX_CATEGORIES = 3
+
+# Gradient descent settings for training; small training sets get extra epochs
+EPOCHS = 20
+MIN_STEPS = 300
+LEARNING_RATE = 2.0
+L2_PENALTY = 1e-4
+
+MODEL_PATH = MODEL_DIR / "categorizer.npz"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'_-]+")
+
+_model = None
+_model_mtime = None
+_model_lock = threading.Lock()
+
+class LocalCategorizer:
+    """
+    One-vs-rest logistic regression over hashed TF-IDF features.
+
+    Each category gets an independent probability, so an email can be assigned
+    several categories; a whole batch is scored with a single matrix product.
+    """
+
+    def __init__(self, weights, bias, idf, categories, trained_at=None, example_count=0):
+        self.weights = weights
+        self.bias = bias
+        self.idf = idf
+        self.categories = list(categories)
+        self.trained_at = trained_at
+        self.example_count = example_count
+
+    def score(self, emails):
+        """Return a (len(emails) x len(categories)) matrix of category probabilities."""
+        scores = np.zeros((len(emails), len(self.categories)), dtype=np.float32)
+        for start in range(0, len(emails), BATCH_SIZE):
+            batch = emails[start:start + BATCH_SIZE]
+            features = vectorize([extract_features(sender, subject) for sender, subject in batch], self.idf)
+            scores[start:start + len(batch)] = sigmoid(features @ self.weights.T + self.bias)
+        return scores
+
+    def predict(self, emails, min_confidence=0.8):
+        """
+        Predict categories for a list of emails.
+
+        Args:
+            emails: List of (sender, subject) tuples
+            min_confidence: Minimum probability for a category to be assigned
+
+        Returns:
+            List of (category names, confidence) tuples; an empty list of names
+            means the email should be escalated to the AI
+        """
+        if not emails:
+            return []
+
+        scores = self.score(emails)
+        top = np.argsort(-scores, axis=1)[:, :MAX_CATEGORIES]
+
+        predictions = []
+        for row, indices in enumerate(top):
+            names = [self.categories[i] for i in indices if scores[row, i] >= min_confidence]
+            predictions.append((names, float(scores[row, indices[0]])))
+
+        return predictions
+
+    def save(self, path=MODEL_PATH):
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights,
+                bias=self.bias,
+                idf=self.idf,
+                categories=np.array(self.categories),
+                trained_at=np.array(self.trained_at.isoformat() if self.trained_at else ''),
+                example_count=np.array(self.example_count)
+            )
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            trained_at = str(data["trained_at"])
+            return cls(
+                weights=data["weights"],
+                bias=data["bias"],
+                idf=data["idf"],
+                categories=[str(c) for c in data["categories"]],
+                trained_at=datetime.fromisoformat(trained_at) if trained_at else None,
+                example_count=int(data["example_count"])
+            )
+
+def extract_features(sender, subject):
+    """
+    Turn an email's sender and subject into hashed feature counts.
+
+    Returns:
+        Dict mapping feature bucket to count
+    """
+    from email_processor import extract_email, extract_domain, normalize_subject
+
+    tokens = []
+
+    address = extract_email(sender) if sender else None
+    if address:
+        tokens.append(f"from:{address}")
+        domain = extract_domain(address)
+        if domain:
+            tokens.append(f"domain:{domain}")
+
+    words = TOKEN_PATTERN.findall(normalize_subject(subject).lower()) if subject else []
+    tokens.extend(f"w:{word}" for word in words)
+    tokens.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+
+    # crc32 rather than hash() so buckets are stable across processes
+    counts = {}
+    for token in tokens:
+        bucket = zlib.crc32(token.encode("utf-8")) % FEATURE_DIM
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    return counts
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30.0, 30.0)))
+
+def vectorize(feature_counts, idf=None):
+    """Build an L2-normalized TF-IDF matrix from a list of feature count dicts."""
+    matrix = np.zeros((len(feature_counts), FEATURE_DIM), dtype=np.float32)
+
+    for row, counts in enumerate(feature_counts):
+        if counts:
+            buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            matrix[row, buckets] = 1.0 + np.log(values)
+
+    if idf is not None:
+        matrix *= idf
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def load_training_data(limit=20000):
+    """
+    Load the most recent categorized emails with their category names.
+
+    Returns:
+        List of (sender, subject, [category names]) tuples
+    """
+    recent_ids = db.session.query(Email.id).filter(
+        Email.categories.any()
+    ).order_by(Email.date_sent.desc()).limit(limit).subquery()
+
+    rows = db.session.query(Email.id, Email.sender, Email.subject, Category.name).join(
+        email_categories, email_categories.c.email_id == Email.id
+    ).join(
+        Category, Category.id == email_categories.c.category_id
+    ).filter(Email.id.in_(db.select(recent_ids.c.id))).all()
+
+    examples = {}
+    for email_id, sender, subject, category_name in rows:
+        example = examples.setdefault(email_id, (sender, subject, []))
+        example[2].append(category_name)
+
+    return list(examples.values())
+
+def train_local_categorizer(min_examples=50, save=True):
+    """
+    Train the local categorizer on already-categorized emails.
+
+    Args:
+        min_examples: Minimum number of categorized emails required
+        save: Persist the model to the storage directory
+
+    Returns:
+        Dict with results
+    """
+    global _model, _model_mtime
+
+    try:
+        examples = load_training_data()
+        if len(examples) < min_examples:
+            return {
+                "success": False,
+                "message": f"Need at least {min_examples} categorized emails to train, found {len(examples)}"
+            }
+
+        categories = sorted({name for _, _, names in examples for name in names})
+        if len(categories) < 2:
+            return {"success": False, "message": "Need at least two categories to train"}
+
+        category_index = {name: i for i, name in enumerate(categories)}
+        features = [extract_features(sender, subject) for sender, subject, _ in examples]
+
+        # Document frequency per bucket, for smoothed IDF weights
+        document_frequency = np.zeros(FEATURE_DIM, dtype=np.float32)
+        for counts in features:
+            document_frequency[list(counts.keys())] += 1
+        idf = np.log((1.0 + len(features)) / (1.0 + document_frequency)) + 1.0
+
+        labels = np.zeros((len(examples), len(categories)), dtype=np.float32)
+        for row, (_, _, names) in enumerate(examples):
+            labels[row, [category_index[name] for name in names]] = 1.0
+
+        # Start from each category's prior so rare categories begin with low scores
+        prior = np.clip(labels.mean(axis=0), 1e-3, 1 - 1e-3)
+        weights = np.zeros((len(categories), FEATURE_DIM), dtype=np.float32)
+        bias = np.log(prior / (1 - prior)).astype(np.float32)
+
+        # Mini-batch gradient descent; batches are vectorized on the fly to bound memory
+        order = np.arange(len(features))
+        rng = np.random.default_rng(0)
+        batches_per_epoch = -(-len(order) // BATCH_SIZE)
+        for _ in range(max(EPOCHS, -(-MIN_STEPS // batches_per_epoch))):
+            rng.shuffle(order)
+            for start in range(0, len(order), BATCH_SIZE):
+                indices = order[start:start + BATCH_SIZE]
+                batch = vectorize([features[i] for i in indices], idf)
+                error = sigmoid(batch @ weights.T + bias) - labels[indices]
+                weights -= LEARNING_RATE * (error.T @ batch / len(indices) + L2_PENALTY * weights)
+                bias -= LEARNING_RATE * error.mean(axis=0)
+
+        model = LocalCategorizer(
+            weights=weights,
+            bias=bias,
+            idf=idf.astype(np.float32),
+            categories=categories,
+            trained_at=datetime.utcnow(),
+            example_count=len(examples)
+        )
+
+        with _model_lock:
+            if save:
+                model.save()
+                _model_mtime = MODEL_PATH.stat().st_mtime
+            _model = model
+
+        logger.info(f"Trained local categorizer on {len(examples)} emails, {len(categories)} categories")
+        return {
+            "success": True,
+            "message": f"Trained on {len(examples)} emails across {len(categories)} categories",
+            "examples": len(examples),
+            "categories": len(categories)
+        }
+
+    except Exception as e:
+        logger.error(f"Error training local categorizer: {str(e)}")
+        return {"success": False, "message": f"Error: {str(e)}"}
+
+def get_local_categorizer():
+    """Return the current model, reloading it if the saved file has changed."""
+    global _model, _model_mtime
+
+    with _model_lock:
+        try:
+            if not MODEL_PATH.exists():
+                return _model
+
+            mtime = MODEL_PATH.stat().st_mtime
+            if _model is None or mtime != _model_mtime:
+                _model = LocalCategorizer.load()
+                _model_mtime = mtime
+
+        except Exception as e:
+            logger.error(f"Error loading local categorizer: {str(e)}")
+
+        return _model
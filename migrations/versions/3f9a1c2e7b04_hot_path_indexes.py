@@ -0,0 +1,143 @@
+"""Add composite primary keys to association tables and indexes for hot queries
+
+Databases created by db.create_all() from the current models already have
+this schema, so every step checks the live schema first and is skipped when
+already applied.
+
+Revision ID: 3f9a1c2e7b04
+Revises:
+Create Date: 2026-10-19 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2e7b04'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Association tables: (table, first column, second column). The pair becomes the
+# primary key and the second column gets its own index for reverse lookups.
+ASSOCIATION_TABLES = [
+    ('email_attachments', 'email_id', 'attachment_id'),
+    ('email_html_objects', 'email_id', 'html_object_id'),
+    ('email_disclaimers', 'email_id', 'disclaimer_id'),
+    ('email_categories', 'email_id', 'category_id'),
+    ('email_rules', 'email_id', 'rule_id'),
+    ('thread_emails', 'thread_id', 'email_id'),
+    ('thread_categories', 'thread_id', 'category_id'),
+    ('thread_rules', 'thread_id', 'rule_id'),
+    ('contact_categories', 'contact_id', 'category_id'),
+    ('group_contacts', 'group_id', 'contact_id'),
+    ('group_categories', 'group_id', 'category_id'),
+    ('group_threads', 'group_id', 'thread_id'),
+    ('domain_categories', 'domain_id', 'category_id'),
+    ('domain_rules', 'domain_id', 'rule_id'),
+    ('body_disclaimers', 'body_id', 'disclaimer_id'),
+    ('keyword_emails', 'keyword_id', 'email_id'),
+]
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_email_message_id', 'email', ['message_id']),  # Duplicate check on every ingested email
+    ('ix_email_sender', 'email', ['sender']),  # Sender rules and contact lookups
+    ('ix_email_account_date', 'email', ['account_id', 'date_sent']),  # Per-account listings and arrival rates
+    ('ix_email_thread_date', 'email', ['thread_id', 'date_sent']),  # Thread views in date order
+    ('ix_thread_subject_date', 'thread', ['subject', 'last_date']),  # Matching new emails to recent threads
+]
+
+# Superseded by ix_email_thread_date
+REPLACED_INDEXES = [
+    ('ix_email_thread_id', 'email', ['thread_id']),
+]
+
+
+def get_index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def has_primary_key(table):
+    return bool(sa.inspect(op.get_bind()).get_pk_constraint(table).get('constrained_columns'))
+
+
+def rebuild_table(table, first, second, primary_key):
+    """
+    Recreate an association table with or without its composite primary key.
+
+    Rows are copied with DISTINCT and rows with a NULL key are dropped, since
+    neither can satisfy the primary key. Works the same on SQLite, which
+    cannot add a primary key to an existing table, and PostgreSQL.
+    """
+    bind = op.get_bind()
+    old = sa.Table(table, sa.MetaData(), autoload_with=bind)
+    old_name = f'{table}_old'
+
+    op.rename_table(table, old_name)
+    op.create_table(
+        table,
+        *[
+            sa.Column(
+                column.name,
+                column.type,
+                *[sa.ForeignKey(fk.target_fullname) for fk in column.foreign_keys],
+                primary_key=primary_key and column.name in (first, second)
+            )
+            for column in old.columns
+        ]
+    )
+
+    if primary_key:
+        op.execute(
+            f'INSERT INTO {table} ({first}, {second}) '
+            f'SELECT DISTINCT {first}, {second} FROM {old_name} '
+            f'WHERE {first} IS NOT NULL AND {second} IS NOT NULL'
+        )
+    else:
+        op.execute(f'INSERT INTO {table} ({first}, {second}) SELECT {first}, {second} FROM {old_name}')
+
+    op.drop_table(old_name)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    for table, first, second in ASSOCIATION_TABLES:
+        if table not in tables:
+            continue
+        if not has_primary_key(table):
+            rebuild_table(table, first, second, primary_key=True)
+        if f'ix_{table}_{second}' not in get_index_names(table):
+            op.create_index(f'ix_{table}_{second}', table, [second])
+
+    for name, table, columns in REPLACED_INDEXES:
+        if name in get_index_names(table):
+            op.drop_index(name, table_name=table)
+
+    for name, table, columns in INDEXES:
+        if name not in get_index_names(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    for name, table, columns in INDEXES:
+        if name in get_index_names(table):
+            op.drop_index(name, table_name=table)
+
+    for name, table, columns in REPLACED_INDEXES:
+        if name not in get_index_names(table):
+            op.create_index(name, table, columns)
+
+    for table, first, second in ASSOCIATION_TABLES:
+        if table not in tables:
+            continue
+        if f'ix_{table}_{second}' in get_index_names(table):
+            op.drop_index(f'ix_{table}_{second}', table_name=table)
+        if has_primary_key(table):
+            rebuild_table(table, first, second, primary_key=False)
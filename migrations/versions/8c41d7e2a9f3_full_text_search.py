@@ -0,0 +1,50 @@
+"""Add the full-text search index
+
+PostgreSQL gets an email_search table holding a weighted tsvector per email
+with a GIN index; SQLite gets an FTS5 virtual table. Both match the DDL in
+models.py and are skipped if already present. Run 'python cli.py
+reindex-search' afterwards to index existing emails.
+
+Revision ID: 8c41d7e2a9f3
+Revises: 3f9a1c2e7b04
+Create Date: 2026-10-19 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d7e2a9f3'
+down_revision = '3f9a1c2e7b04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("""
+            CREATE TABLE IF NOT EXISTS email_search (
+                email_id VARCHAR(64) PRIMARY KEY REFERENCES email (id) ON DELETE CASCADE,
+                document TSVECTOR NOT NULL
+            )
+        """)
+        op.execute("CREATE INDEX IF NOT EXISTS ix_email_search_document ON email_search USING GIN (document)")
+    elif dialect == 'sqlite':
+        op.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS email_fts USING fts5(
+                email_id UNINDEXED, subject, sender, body,
+                tokenize = 'porter unicode61 remove_diacritics 2'
+            )
+        """)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("DROP TABLE IF EXISTS email_search")
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS email_fts")
@@ -0,0 +1,47 @@
+"""Track when each email_list_item row last changed
+
+Adds email_list_item.updated_at with an index, used as the HTTP cache
+validator for email pages and lists. Existing rows take the current time.
+Every step is skipped if already applied.
+
+Revision ID: a8c3e1f7b246
+Revises: f2b6d8e4a913
+Create Date: 2026-10-20 00:20:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c3e1f7b246'
+down_revision = 'f2b6d8e4a913'
+branch_labels = None
+depends_on = None
+
+
+def get_index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('email_list_item')}
+
+    if 'updated_at' not in columns:
+        with op.batch_alter_table('email_list_item') as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime()))
+        op.get_bind().execute(sa.text("UPDATE email_list_item SET updated_at = :now"), {"now": datetime.utcnow()})
+    if 'ix_email_list_item_updated' not in get_index_names('email_list_item'):
+        op.create_index('ix_email_list_item_updated', 'email_list_item', ['updated_at'])
+
+
+def downgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('email_list_item')}
+
+    if 'ix_email_list_item_updated' in get_index_names('email_list_item'):
+        op.drop_index('ix_email_list_item_updated', table_name='email_list_item')
+    if 'updated_at' in columns:
+        with op.batch_alter_table('email_list_item') as batch_op:
+            batch_op.drop_column('updated_at')
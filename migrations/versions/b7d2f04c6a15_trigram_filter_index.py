@@ -0,0 +1,81 @@
+"""Add trigram indexes for sender and subject filters
+
+Adds the filter_value and filter_trigrams tables behind /emails substring
+filters and autocomplete. PostgreSQL also gets pg_trgm GIN indexes on the
+email sender and subject and on filter values; SQLite gets an index on the
+email subject. Every step is skipped if already present. Run 'python cli.py
+index-filters' afterwards to index existing emails.
+
+Revision ID: b7d2f04c6a15
+Revises: 8c41d7e2a9f3
+Create Date: 2026-10-19 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f04c6a15'
+down_revision = '8c41d7e2a9f3'
+branch_labels = None
+depends_on = None
+
+# (index name, table, column)
+TRIGRAM_INDEXES = [
+    ('ix_email_sender_trgm', 'email', 'sender'),
+    ('ix_email_subject_trgm', 'email', 'subject'),
+    ('ix_filter_value_value_trgm', 'filter_value', 'value'),
+]
+
+
+def get_index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'filter_value' not in tables:
+        op.create_table(
+            'filter_value',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('field', sa.String(length=16), nullable=False),
+            sa.Column('value', sa.Text(), nullable=False),
+            sa.Column('email_count', sa.Integer()),
+            sa.UniqueConstraint('field', 'value', name='uq_filter_value_field_value')
+        )
+    if 'filter_trigrams' not in tables:
+        op.create_table(
+            'filter_trigrams',
+            sa.Column('trigram', sa.String(length=3), primary_key=True),
+            sa.Column('value_id', sa.Integer(), sa.ForeignKey('filter_value.id'), primary_key=True)
+        )
+    if 'ix_filter_trigrams_value_id' not in get_index_names('filter_trigrams'):
+        op.create_index('ix_filter_trigrams_value_id', 'filter_trigrams', ['value_id'])
+
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING GIN ({column} gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        if 'ix_email_subject' not in get_index_names('email'):
+            op.create_index('ix_email_subject', 'email', ['subject'])
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if dialect == 'postgresql':
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+    elif dialect == 'sqlite':
+        if 'ix_email_subject' in get_index_names('email'):
+            op.drop_index('ix_email_subject', table_name='email')
+
+    if 'filter_trigrams' in tables:
+        op.drop_table('filter_trigrams')
+    if 'filter_value' in tables:
+        op.drop_table('filter_value')
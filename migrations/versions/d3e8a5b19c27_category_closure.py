@@ -0,0 +1,77 @@
+"""Add the category closure table and a covering index for category filters
+
+Creates category_closure, holding every ancestor/descendant pair of the
+category hierarchy, and fills it from category.parent_id. Replaces the
+email_categories index on category_id with one on (category_id, email_id).
+Every step is skipped if already applied.
+
+Revision ID: d3e8a5b19c27
+Revises: b7d2f04c6a15
+Create Date: 2026-10-19 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3e8a5b19c27'
+down_revision = 'b7d2f04c6a15'
+branch_labels = None
+depends_on = None
+
+
+def get_index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def fill_closure():
+    """Insert each category paired with itself, then extend the paths one parent at a time."""
+    bind = op.get_bind()
+    bind.execute(sa.text(
+        "INSERT INTO category_closure (ancestor_id, descendant_id, depth) SELECT id, id, 0 FROM category"
+    ))
+    depth = 0
+    while True:
+        inserted = bind.execute(sa.text(
+            "INSERT INTO category_closure (ancestor_id, descendant_id, depth) "
+            "SELECT c.parent_id, cc.descendant_id, :depth + 1 "
+            "FROM category_closure cc JOIN category c ON c.id = cc.ancestor_id "
+            "WHERE cc.depth = :depth AND c.parent_id IS NOT NULL"
+        ), {"depth": depth}).rowcount
+        if not inserted:
+            break
+        depth += 1
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'category_closure' not in tables:
+        op.create_table(
+            'category_closure',
+            sa.Column('ancestor_id', sa.Integer(), sa.ForeignKey('category.id'), primary_key=True),
+            sa.Column('descendant_id', sa.Integer(), sa.ForeignKey('category.id'), primary_key=True),
+            sa.Column('depth', sa.Integer(), nullable=False)
+        )
+    if 'ix_category_closure_descendant_id' not in get_index_names('category_closure'):
+        op.create_index('ix_category_closure_descendant_id', 'category_closure', ['descendant_id'])
+    if op.get_bind().execute(sa.text("SELECT COUNT(*) FROM category_closure")).scalar() == 0:
+        fill_closure()
+
+    if 'ix_email_categories_category_email' not in get_index_names('email_categories'):
+        op.create_index('ix_email_categories_category_email', 'email_categories', ['category_id', 'email_id'])
+    if 'ix_email_categories_category_id' in get_index_names('email_categories'):
+        op.drop_index('ix_email_categories_category_id', table_name='email_categories')
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'ix_email_categories_category_id' not in get_index_names('email_categories'):
+        op.create_index('ix_email_categories_category_id', 'email_categories', ['category_id'])
+    if 'ix_email_categories_category_email' in get_index_names('email_categories'):
+        op.drop_index('ix_email_categories_category_email', table_name='email_categories')
+
+    if 'category_closure' in tables:
+        op.drop_table('category_closure')
@@ -0,0 +1,53 @@
+"""Delete an account's mailbox sync state with the account
+
+Recreates mailbox_sync_state.account_id's foreign key with ON DELETE
+CASCADE. Skipped if the table is missing or the key already cascades.
+
+Revision ID: d9b4e2f7a361
+Revises: c6f1a9d24e58
+Create Date: 2026-10-20 01:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b4e2f7a361'
+down_revision = 'c6f1a9d24e58'
+branch_labels = None
+depends_on = None
+
+# Names SQLite's unnamed foreign keys so batch mode can drop them
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def get_account_fk(table):
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        return None
+    for fk in inspector.get_foreign_keys(table):
+        if fk['referred_table'] == 'email_account' and fk['constrained_columns'] == ['account_id']:
+            return fk
+    return None
+
+
+def set_account_fk_ondelete(table, ondelete):
+    fk = get_account_fk(table)
+    if fk is None or (fk.get('options', {}).get('ondelete') or None) == ondelete:
+        return
+
+    name = fk['name'] or NAMING_CONVENTION['fk'] % {
+        'table_name': table, 'column_0_name': 'account_id', 'referred_table_name': 'email_account'
+    }
+    with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'email_account', ['account_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    set_account_fk_ondelete('mailbox_sync_state', 'CASCADE')
+
+
+def downgrade():
+    set_account_fk_ondelete('mailbox_sync_state', None)
@@ -0,0 +1,78 @@
+"""Add the denormalized email_list_item projection for inbox lists
+
+Creates email_list_item, one row per email with its sender, subject, date,
+read flag, thread size, category names and attachment count, indexed on
+(date_sent, id), and fills it from the normalized tables. Every step is
+skipped if already applied.
+
+Revision ID: e5a1c9f3d720
+Revises: d3e8a5b19c27
+Create Date: 2026-10-19 22:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c9f3d720'
+down_revision = 'd3e8a5b19c27'
+branch_labels = None
+depends_on = None
+
+
+def get_index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def fill_list_items():
+    """Insert a row per email, aggregating category names as a JSON list in SQL."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        category_names = "COALESCE((SELECT json_agg(c.name ORDER BY c.name)::text {}), '[]')"
+    else:
+        category_names = "(SELECT json_group_array(name) FROM (SELECT c.name {} ORDER BY c.name))"
+    category_names = category_names.format(
+        "FROM email_categories ec JOIN category c ON c.id = ec.category_id WHERE ec.email_id = e.id"
+    )
+
+    bind.execute(sa.text(
+        "INSERT INTO email_list_item (id, sender, subject, date_sent, thread_id, thread_size, "
+        "is_read, is_confidential, categories, attachment_count) "
+        "SELECT e.id, e.sender, e.subject, e.date_sent, e.thread_id, "
+        "CASE WHEN e.thread_id IS NULL THEN 1 "
+        "ELSE (SELECT COUNT(*) FROM email t WHERE t.thread_id = e.thread_id) END, "
+        f"e.is_read, e.is_confidential, {category_names}, "
+        "(SELECT COUNT(*) FROM email_attachments ea WHERE ea.email_id = e.id) "
+        "FROM email e"
+    ))
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'email_list_item' not in tables:
+        op.create_table(
+            'email_list_item',
+            sa.Column('id', sa.String(length=64), sa.ForeignKey('email.id'), primary_key=True),
+            sa.Column('sender', sa.String(length=256)),
+            sa.Column('subject', sa.Text()),
+            sa.Column('date_sent', sa.DateTime()),
+            sa.Column('thread_id', sa.String(length=64)),
+            sa.Column('thread_size', sa.Integer()),
+            sa.Column('is_read', sa.Boolean()),
+            sa.Column('is_confidential', sa.Boolean()),
+            sa.Column('categories', sa.Text()),
+            sa.Column('attachment_count', sa.Integer())
+        )
+    if 'ix_email_list_item_date' not in get_index_names('email_list_item'):
+        op.create_index('ix_email_list_item_date', 'email_list_item', ['date_sent', 'id'])
+    if op.get_bind().execute(sa.text("SELECT COUNT(*) FROM email_list_item")).scalar() == 0:
+        fill_list_items()
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'email_list_item' in tables:
+        op.drop_table('email_list_item')
@@ -0,0 +1,39 @@
+"""Track when each category was last renamed or moved
+
+Adds category.updated_at, part of the fingerprint processes use to notice
+that their cached category tree is stale. Existing rows take the current
+time. Skipped if already applied.
+
+Revision ID: e7c2f5a81b94
+Revises: d9b4e2f7a361
+Create Date: 2026-10-20 01:20:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c2f5a81b94'
+down_revision = 'd9b4e2f7a361'
+branch_labels = None
+depends_on = None
+
+
+def get_column_names(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'updated_at' not in get_column_names('category'):
+        with op.batch_alter_table('category') as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime()))
+        op.get_bind().execute(sa.text("UPDATE category SET updated_at = :now"), {"now": datetime.utcnow()})
+
+
+def downgrade():
+    if 'updated_at' in get_column_names('category'):
+        with op.batch_alter_table('category') as batch_op:
+            batch_op.drop_column('updated_at')
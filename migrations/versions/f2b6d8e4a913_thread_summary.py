@@ -0,0 +1,73 @@
+"""Add summary aggregates to threads
+
+Adds message_count, unread_count, has_attachments, latest_sender and
+participants to thread and fills them from each thread's emails. Every step
+is skipped if already applied.
+
+Revision ID: f2b6d8e4a913
+Revises: e5a1c9f3d720
+Create Date: 2026-10-19 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d8e4a913'
+down_revision = 'e5a1c9f3d720'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('message_count', sa.Integer()),
+    ('unread_count', sa.Integer()),
+    ('has_attachments', sa.Boolean()),
+    ('latest_sender', sa.String(length=256)),
+    ('participants', sa.Text()),
+)
+
+
+def fill_summaries():
+    """Aggregate each thread's emails in SQL, building the participant list as JSON."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        participants = ("COALESCE((SELECT json_agg(DISTINCT e.sender ORDER BY e.sender)::text "
+                        "FROM email e WHERE e.thread_id = thread.id AND e.sender IS NOT NULL), '[]')")
+    else:
+        participants = ("(SELECT json_group_array(sender) FROM (SELECT DISTINCT e.sender FROM email e "
+                        "WHERE e.thread_id = thread.id AND e.sender IS NOT NULL ORDER BY e.sender))")
+
+    bind.execute(sa.text(
+        "UPDATE thread SET "
+        "message_count = (SELECT COUNT(*) FROM email e WHERE e.thread_id = thread.id), "
+        "unread_count = (SELECT COUNT(*) FROM email e WHERE e.thread_id = thread.id "
+        "AND (e.is_read IS NULL OR e.is_read = :false)), "
+        "has_attachments = EXISTS (SELECT 1 FROM email e JOIN email_attachments ea ON ea.email_id = e.id "
+        "WHERE e.thread_id = thread.id), "
+        "latest_sender = (SELECT e.sender FROM email e WHERE e.thread_id = thread.id "
+        "ORDER BY e.date_sent DESC, e.id DESC LIMIT 1), "
+        f"participants = {participants}"
+    ), {"false": False})
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('thread')}
+
+    missing = [(name, type_) for name, type_ in COLUMNS if name not in columns]
+    if missing:
+        with op.batch_alter_table('thread') as batch_op:
+            for name, type_ in missing:
+                batch_op.add_column(sa.Column(name, type_))
+        fill_summaries()
+
+
+def downgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('thread')}
+
+    present = [name for name, _ in COLUMNS if name in columns]
+    if present:
+        with op.batch_alter_table('thread') as batch_op:
+            for name in present:
+                batch_op.drop_column(name)
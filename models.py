@@ -1,78 +1,82 @@
 from app import db
-from sqlalchemy import Table, Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Table, Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text, DDL, event, select, literal, inspect, true
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import json
 import uuid
 
-# Many-to-many relationships
+# Many-to-many relationships - each has a composite primary key for lookups from the
+# first column, plus an index on the second for reverse lookups
 email_attachments = Table('email_attachments', db.Model.metadata,
-    Column('email_id', String, ForeignKey('email.id')),
-    Column('attachment_id', String, ForeignKey('attachment.id'))
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True),
+    Column('attachment_id', String, ForeignKey('attachment.id'), primary_key=True, index=True)
 )
 
 email_html_objects = Table('email_html_objects', db.Model.metadata,
-    Column('email_id', String, ForeignKey('email.id')),
-    Column('html_object_id', String, ForeignKey('html_object.id'))
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True),
+    Column('html_object_id', String, ForeignKey('html_object.id'), primary_key=True, index=True)
 )
 
 email_disclaimers = Table('email_disclaimers', db.Model.metadata,
-    Column('email_id', String, ForeignKey('email.id')),
-    Column('disclaimer_id', String, ForeignKey('disclaimer.id'))
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True),
+    Column('disclaimer_id', String, ForeignKey('disclaimer.id'), primary_key=True, index=True)
 )
 
 email_categories = Table('email_categories', db.Model.metadata,
-    Column('email_id', String, ForeignKey('email.id')),
-    Column('category_id', Integer, ForeignKey('category.id'))
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id'), primary_key=True),
+    # Covers category filters, which look up email IDs by category
+    db.Index('ix_email_categories_category_email', 'category_id', 'email_id')
 )
 
 email_rules = Table('email_rules', db.Model.metadata,
-    Column('email_id', String, ForeignKey('email.id')),
-    Column('rule_id', Integer, ForeignKey('rule.id'))
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True),
+    Column('rule_id', Integer, ForeignKey('rule.id'), primary_key=True, index=True)
 )
 
 thread_emails = Table('thread_emails', db.Model.metadata,
-    Column('thread_id', String, ForeignKey('thread.id')),
-    Column('email_id', String, ForeignKey('email.id'))
+    Column('thread_id', String, ForeignKey('thread.id'), primary_key=True),
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True, index=True)
 )
 
 thread_categories = Table('thread_categories', db.Model.metadata,
-    Column('thread_id', String, ForeignKey('thread.id')),
-    Column('category_id', Integer, ForeignKey('category.id'))
+    Column('thread_id', String, ForeignKey('thread.id'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id'), primary_key=True, index=True)
 )
 
 thread_rules = Table('thread_rules', db.Model.metadata,
-    Column('thread_id', String, ForeignKey('thread.id')),
-    Column('rule_id', Integer, ForeignKey('rule.id'))
+    Column('thread_id', String, ForeignKey('thread.id'), primary_key=True),
+    Column('rule_id', Integer, ForeignKey('rule.id'), primary_key=True, index=True)
 )
 
 contact_categories = Table('contact_categories', db.Model.metadata,
-    Column('contact_id', Integer, ForeignKey('contact.id')),
-    Column('category_id', Integer, ForeignKey('category.id'))
+    Column('contact_id', Integer, ForeignKey('contact.id'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id'), primary_key=True, index=True)
 )
 
 group_contacts = Table('group_contacts', db.Model.metadata,
-    Column('group_id', Integer, ForeignKey('group.id')),
-    Column('contact_id', Integer, ForeignKey('contact.id'))
+    Column('group_id', Integer, ForeignKey('group.id'), primary_key=True),
+    Column('contact_id', Integer, ForeignKey('contact.id'), primary_key=True, index=True)
 )
 
 group_categories = Table('group_categories', db.Model.metadata,
-    Column('group_id', Integer, ForeignKey('group.id')),
-    Column('category_id', Integer, ForeignKey('category.id'))
+    Column('group_id', Integer, ForeignKey('group.id'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id'), primary_key=True, index=True)
 )
 
 group_threads = Table('group_threads', db.Model.metadata,
-    Column('group_id', Integer, ForeignKey('group.id')),
-    Column('thread_id', String, ForeignKey('thread.id'))
+    Column('group_id', Integer, ForeignKey('group.id'), primary_key=True),
+    Column('thread_id', String, ForeignKey('thread.id'), primary_key=True, index=True)
 )
 
 domain_categories = Table('domain_categories', db.Model.metadata,
-    Column('domain_id', Integer, ForeignKey('domain.id')),
-    Column('category_id', Integer, ForeignKey('category.id'))
+    Column('domain_id', Integer, ForeignKey('domain.id'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id'), primary_key=True, index=True)
 )
 
 domain_rules = Table('domain_rules', db.Model.metadata,
-    Column('domain_id', Integer, ForeignKey('domain.id')),
-    Column('rule_id', Integer, ForeignKey('rule.id'))
+    Column('domain_id', Integer, ForeignKey('domain.id'), primary_key=True),
+    Column('rule_id', Integer, ForeignKey('rule.id'), primary_key=True, index=True)
 )
 
 # Email account model
@@ -94,11 +98,17 @@ class EmailAccount(db.Model):
 # Email model
 class Email(db.Model):
     __tablename__ = 'email'
+    __table_args__ = (
+        db.Index('ix_email_account_date', 'account_id', 'date_sent'),  # Per-account listings and arrival rates
+        db.Index('ix_email_thread_date', 'thread_id', 'date_sent'),  # Thread views in date order
+        # Subject filters match values from the trigram index; PostgreSQL uses a pg_trgm index instead
+        db.Index('ix_email_subject', 'subject').ddl_if(dialect='sqlite'),
+    )
     
     id = Column(String(64), primary_key=True, default=lambda: str(uuid.uuid4()))
     account_id = Column(Integer, ForeignKey('email_account.id'))
-    message_id = Column(String(256))  # Original email Message-ID header
-    sender = Column(String(256))  # From field
+    message_id = Column(String(256), index=True)  # Original email Message-ID header
+    sender = Column(String(256), index=True)  # From field
     recipients = Column(Text)  # To field, JSON serialized list
     cc = Column(Text)  # CC field, JSON serialized list
     bcc = Column(Text)  # BCC field, JSON serialized list
@@ -106,7 +116,7 @@ class Email(db.Model):
     date_sent = Column(DateTime, index=True)
     format = Column(String(10))  # 'text' or 'html'
     body_id = Column(String(64), ForeignKey('body.id'))
-    thread_id = Column(String(64), ForeignKey('thread.id'), index=True)
+    thread_id = Column(String(64), ForeignKey('thread.id'))
     priority = Column(Integer, default=0)
     spam_score = Column(Float, default=0.0)
     is_read = Column(Boolean, default=False)
@@ -128,6 +138,48 @@ class Email(db.Model):
     def __repr__(self):
         return f'<Email {self.id}: {self.subject}>'
 
+# Denormalized inbox rows, one per email, holding everything a list row shows so
+# /emails reads a single table in index order. Kept current by email_list.py at
+# ingest and whenever categories are assigned.
+class EmailListItem(db.Model):
+    __tablename__ = 'email_list_item'
+    __table_args__ = (
+        db.Index('ix_email_list_item_date', 'date_sent', 'id'),  # Newest or oldest first, with the keyset tiebreak
+        db.Index('ix_email_list_item_updated', 'updated_at'),  # Newest change, for HTTP cache validators
+    )
+    
+    id = Column(String(64), ForeignKey('email.id'), primary_key=True)  # Same ID as the email
+    sender = Column(String(256))
+    subject = Column(Text)
+    date_sent = Column(DateTime)
+    thread_id = Column(String(64))
+    thread_size = Column(Integer, default=1)  # Emails in the thread
+    is_read = Column(Boolean, default=False)
+    is_confidential = Column(Boolean, default=False)
+    categories = Column(Text, default='[]')  # Category names, JSON serialized sorted list
+    attachment_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # When the row last changed
+    
+    @property
+    def category_names(self):
+        return json.loads(self.categories) if self.categories else []
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sender': self.sender,
+            'subject': self.subject,
+            'date_sent': self.date_sent.isoformat() if self.date_sent else None,
+            'thread_id': self.thread_id,
+            'thread_size': self.thread_size,
+            'is_read': self.is_read,
+            'categories': self.category_names,
+            'attachment_count': self.attachment_count
+        }
+    
+    def __repr__(self):
+        return f'<EmailListItem {self.id}: {self.subject}>'
+
 # Body model
 class Body(db.Model):
     __tablename__ = 'body'
@@ -143,8 +195,8 @@ class Body(db.Model):
 
 # Many-to-many relationship for body and disclaimers
 body_disclaimers = Table('body_disclaimers', db.Model.metadata,
-    Column('body_id', String, ForeignKey('body.id')),
-    Column('disclaimer_id', String, ForeignKey('disclaimer.id'))
+    Column('body_id', String, ForeignKey('body.id'), primary_key=True),
+    Column('disclaimer_id', String, ForeignKey('disclaimer.id'), primary_key=True, index=True)
 )
 
 # Attachment model
@@ -184,6 +236,9 @@ class Disclaimer(db.Model):
 # Thread model
 class Thread(db.Model):
     __tablename__ = 'thread'
+    __table_args__ = (
+        db.Index('ix_thread_subject_date', 'subject', 'last_date'),  # Matching new emails to recent threads
+    )
     
     id = Column(String(64), primary_key=True, default=lambda: str(uuid.uuid4()))
     date_started = Column(DateTime)
@@ -191,10 +246,34 @@ class Thread(db.Model):
     subject = Column(Text)
     priority = Column(Integer, default=0)
     
+    # Summary aggregates, kept current by thread_summary.py at ingest and on read-state changes
+    message_count = Column(Integer, default=0)
+    unread_count = Column(Integer, default=0)
+    has_attachments = Column(Boolean, default=False)
+    latest_sender = Column(String(256))  # Sender of the most recent email
+    participants = Column(Text, default='[]')  # Distinct senders, JSON serialized sorted list
+    
     # Relationships
     categories = relationship('Category', secondary=thread_categories, backref='threads')
     rules = relationship('Rule', secondary=thread_rules, backref='threads')
     
+    @property
+    def participant_list(self):
+        return json.loads(self.participants) if self.participants else []
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'subject': self.subject,
+            'date_started': self.date_started.isoformat() if self.date_started else None,
+            'last_date': self.last_date.isoformat() if self.last_date else None,
+            'message_count': self.message_count,
+            'unread_count': self.unread_count,
+            'has_attachments': self.has_attachments,
+            'latest_sender': self.latest_sender,
+            'participants': self.participant_list
+        }
+    
     def __repr__(self):
         return f'<Thread {self.id}>'
 
@@ -268,6 +347,133 @@ class Rule(db.Model):
     def __repr__(self):
         return f'<Rule {self.id}: {self.type}>'
 
+# Retroactive rule application progress
+class RuleBackfill(db.Model):
+    __tablename__ = 'rule_backfill'
+    
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, ForeignKey('rule.id', ondelete='CASCADE'), index=True)
+    status = Column(String(20), default='pending')  # 'pending', 'running', 'completed' or 'failed'
+    cursor = Column(String(64))  # Last email ID scanned, used to resume streaming scans
+    total = Column(Integer, default=0)  # Emails to scan
+    processed = Column(Integer, default=0)  # Emails scanned so far
+    matched = Column(Integer, default=0)  # Emails the rule applied to
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    rule = relationship('Rule', backref=db.backref('backfills', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<RuleBackfill {self.id}: rule {self.rule_id} {self.status}>'
+
+# Cached AI response
+class AICacheEntry(db.Model):
+    __tablename__ = 'ai_cache'
+    
+    key = Column(String(64), primary_key=True)  # SHA-256 of kind, model, prompt version and normalized input
+    kind = Column(String(32), nullable=False, index=True)  # 'categorize' or 'analyze'
+    value = Column(Text)  # JSON serialized response
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, index=True)
+    
+    def __repr__(self):
+        return f'<AICacheEntry {self.kind}: {self.key[:12]}>'
+
+# Last IMAP UID ingested per mailbox, for incremental fetches
+class MailboxSyncState(db.Model):
+    __tablename__ = 'mailbox_sync_state'
+    
+    account_id = Column(Integer, ForeignKey('email_account.id', ondelete='CASCADE'), primary_key=True)
+    mailbox = Column(String(128), primary_key=True, default='INBOX')
+    uidvalidity = Column(Integer)  # UIDs are only comparable while this is unchanged
+    last_uid = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    account = relationship('EmailAccount', backref=db.backref('mailbox_sync_states', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<MailboxSyncState {self.account_id}/{self.mailbox}: {self.last_uid}>'
+
+# Adaptive polling schedule for an account
+class AccountSyncSchedule(db.Model):
+    __tablename__ = 'account_sync_schedule'
+    
+    account_id = Column(Integer, ForeignKey('email_account.id', ondelete='CASCADE'), primary_key=True)
+    interval_seconds = Column(Integer)  # Current polling interval
+    arrival_rate = Column(Float, default=0.0)  # Recent messages per hour
+    next_run_at = Column(DateTime, index=True)
+    last_run_at = Column(DateTime)
+    
+    # Relationships
+    account = relationship('EmailAccount', backref=db.backref('sync_schedule', uselist=False, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<AccountSyncSchedule {self.account_id}: every {self.interval_seconds}s>'
+
+# Background job
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_claim', 'status', 'priority', 'run_after'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)  # e.g. 'sync_account', 'categorize'
+    payload = Column(Text)  # JSON serialized arguments
+    dedupe_key = Column(String(256), index=True)  # Identical pending jobs share this key
+    status = Column(String(20), default='pending')  # 'pending', 'running', 'completed' or 'failed'
+    priority = Column(Integer, default=0)  # Higher runs first
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    locked_by = Column(String(128))  # Worker currently running the job
+    locked_at = Column(DateTime)
+    progress = Column(Float, default=0.0)  # 0.0 to 1.0
+    message = Column(Text)
+    result = Column(Text)  # JSON serialized handler result
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f'<Job {self.id}: {self.kind} {self.status}>'
+
+# Work queue of emails without categories, kept in step with email_categories
+class UncategorizedEmail(db.Model):
+    __tablename__ = 'uncategorized_email'
+    
+    email_id = Column(String(64), ForeignKey('email.id'), primary_key=True)
+    date_sent = Column(DateTime, index=True)  # Copied from the email so the backlog is read newest first from the index
+    queued_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UncategorizedEmail {self.email_id}>'
+
+# Stored AI analysis of an email
+class EmailAnalysis(db.Model):
+    __tablename__ = 'email_analysis'
+    
+    email_id = Column(String(64), ForeignKey('email.id'), primary_key=True)
+    key_points = Column(Text)  # JSON serialized list
+    action_items = Column(Text)  # JSON serialized list
+    deadlines = Column(Text)  # JSON serialized list
+    contacts = Column(Text)  # JSON serialized list
+    sentiment = Column(String(20))  # 'positive', 'neutral' or 'negative'
+    importance = Column(String(20), index=True)  # 'high', 'medium' or 'low'
+    prompt_version = Column(Integer)
+    analyzed_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    email = relationship('Email', backref=db.backref('analysis', uselist=False))
+    
+    def __repr__(self):
+        return f'<EmailAnalysis {self.email_id}>'
+
 # Category model
 class Category(db.Model):
     __tablename__ = 'category'
@@ -276,6 +482,7 @@ class Category(db.Model):
     name = Column(String(128), unique=True, nullable=False)
     parent_id = Column(Integer, ForeignKey('category.id'))
     assigned_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # Last rename or move, not count changes
     
     # Self-referential relationship for parent-child categories
     subcategories = relationship('Category', backref=db.backref('parent', remote_side=[id]))
@@ -283,6 +490,64 @@ class Category(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
 
+# Every ancestor/descendant pair in the category hierarchy, including each category
+# paired with itself at depth 0, so subtree queries need no recursion
+category_closure = Table('category_closure', db.Model.metadata,
+    Column('ancestor_id', Integer, ForeignKey('category.id'), primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('category.id'), primary_key=True, index=True),
+    Column('depth', Integer, nullable=False)
+)
+
+# The closure table is kept in step with Category.parent_id by these listeners, in the same flush
+@event.listens_for(Category, 'after_insert')
+def add_category_to_closure(mapper, connection, category):
+    connection.execute(category_closure.insert().from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select(
+            category_closure.c.ancestor_id,
+            literal(category.id),
+            category_closure.c.depth + 1
+        ).where(category_closure.c.descendant_id == category.parent_id).union_all(
+            select(literal(category.id), literal(category.id), literal(0))
+        )
+    ))
+
+@event.listens_for(Category, 'before_update')
+def touch_category_on_rename_or_move(mapper, connection, category):
+    state = inspect(category)
+    if state.attrs.name.history.has_changes() or state.attrs.parent_id.history.has_changes():
+        category.updated_at = datetime.utcnow()
+
+@event.listens_for(Category, 'after_update')
+def move_category_in_closure(mapper, connection, category):
+    if not inspect(category).attrs.parent_id.history.has_changes():
+        return
+
+    subtree = select(category_closure.c.descendant_id).where(category_closure.c.ancestor_id == category.id)
+    # Unlink the subtree from its old ancestors, then link it below the new parent
+    connection.execute(category_closure.delete().where(
+        category_closure.c.descendant_id.in_(subtree),
+        category_closure.c.ancestor_id.not_in(subtree)
+    ))
+    if category.parent_id is not None:
+        above = category_closure.alias('above')
+        below = category_closure.alias('below')
+        connection.execute(category_closure.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1).select_from(
+                above.join(below, true())  # Every new ancestor with every subtree member
+            ).where(
+                above.c.descendant_id == category.parent_id,
+                below.c.ancestor_id == category.id
+            )
+        ))
+
+@event.listens_for(Category, 'before_delete')
+def remove_category_from_closure(mapper, connection, category):
+    connection.execute(category_closure.delete().where(
+        (category_closure.c.ancestor_id == category.id) | (category_closure.c.descendant_id == category.id)
+    ))
+
 # Keyword model
 class Keyword(db.Model):
     __tablename__ = 'keyword'
@@ -296,6 +561,59 @@ class Keyword(db.Model):
 
 # Many-to-many relationship for keywords and emails
 keyword_emails = Table('keyword_emails', db.Model.metadata,
-    Column('keyword_id', Integer, ForeignKey('keyword.id')),
-    Column('email_id', String, ForeignKey('email.id'))
+    Column('keyword_id', Integer, ForeignKey('keyword.id'), primary_key=True),
+    Column('email_id', String, ForeignKey('email.id'), primary_key=True, index=True)
 )
+
+# Distinct senders and subjects, the source for /emails substring filters and autocomplete
+class FilterValue(db.Model):
+    __tablename__ = 'filter_value'
+    __table_args__ = (
+        db.UniqueConstraint('field', 'value', name='uq_filter_value_field_value'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    field = Column(String(16), nullable=False)  # 'sender' or 'subject'
+    value = Column(Text, nullable=False)
+    email_count = Column(Integer, default=0)
+    
+    def __repr__(self):
+        return f'<FilterValue {self.field}: {self.value}>'
+
+# Lowercase trigrams of each filter value, for substring matching on databases without pg_trgm
+filter_trigrams = Table('filter_trigrams', db.Model.metadata,
+    Column('trigram', String(3), primary_key=True),
+    Column('value_id', Integer, ForeignKey('filter_value.id'), primary_key=True, index=True)
+)
+
+# Full-text search index - dialect specific, so created with DDL alongside the models.
+# PostgreSQL keeps a weighted tsvector per email with a GIN index; SQLite uses an FTS5 table.
+event.listen(db.Model.metadata, 'after_create', DDL("""
+    CREATE TABLE IF NOT EXISTS email_search (
+        email_id VARCHAR(64) PRIMARY KEY REFERENCES email (id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    )
+""").execute_if(dialect='postgresql'))
+event.listen(db.Model.metadata, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_email_search_document ON email_search USING GIN (document)"
+).execute_if(dialect='postgresql'))
+event.listen(db.Model.metadata, 'after_create', DDL("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS email_fts USING fts5(
+        email_id UNINDEXED, subject, sender, body,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+""").execute_if(dialect='sqlite'))
+
+# Trigram indexes for substring filters and autocomplete on PostgreSQL
+event.listen(db.Model.metadata, 'after_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+).execute_if(dialect='postgresql'))
+event.listen(db.Model.metadata, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_email_sender_trgm ON email USING GIN (sender gin_trgm_ops)"
+).execute_if(dialect='postgresql'))
+event.listen(db.Model.metadata, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_email_subject_trgm ON email USING GIN (subject gin_trgm_ops)"
+).execute_if(dialect='postgresql'))
+event.listen(db.Model.metadata, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_filter_value_value_trgm ON filter_value USING GIN (value gin_trgm_ops)"
+).execute_if(dialect='postgresql'))
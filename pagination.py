@@ -0,0 +1,163 @@
+import json
+import base64
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, or_
+
+from app import db
+from models import Email
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_PAGE = 200
+
+# Approximate counts on databases without planner estimates stop counting here
+APPROXIMATE_COUNT_LIMIT = 10000
+
+COUNT_MODES = ('exact', 'approximate', 'none')
+
+class KeysetPage:
+    """One page of emails with opaque cursors for the pages either side of it."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            "next_cursor": self.next_cursor,
+            "prev_cursor": self.prev_cursor,
+            "per_page": self.per_page,
+            "total": self.total,
+            "total_is_estimate": self.total_is_estimate
+        }
+
+def encode_cursor(email, before=False):
+    """Encode an email's position in (date_sent, id) order as an opaque string."""
+    date_sent = email.date_sent.replace(tzinfo=None).isoformat() if email.date_sent else None
+    payload = json.dumps([date_sent, email.id, before], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor.
+
+    Returns:
+        Tuple of (date_sent, email ID, before)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_sent, email_id, before = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(date_sent), str(email_id), bool(before)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def count_emails(query, mode):
+    """
+    Count the emails a query matches.
+
+    'exact' runs COUNT(*). 'approximate' uses the planner's row estimate on
+    PostgreSQL, and elsewhere counts up to APPROXIMATE_COUNT_LIMIT.
+
+    Returns:
+        Tuple of (count or None, whether the count is an estimate)
+    """
+    query = query.order_by(None)
+
+    if mode == 'exact':
+        return query.count(), False
+
+    if mode == 'approximate':
+        if db.engine.dialect.name == 'postgresql':
+            try:
+                compiled = query.statement.compile(dialect=db.engine.dialect)
+                plan = db.session.connection().exec_driver_sql(
+                    f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+                ).scalar()
+                return int(plan[0]['Plan']['Plan Rows']), True
+            except Exception as e:
+                logger.warning(f"Could not estimate email count: {str(e)}")
+                return None, True
+
+        count = db.session.query(func.count()).select_from(
+            query.limit(APPROXIMATE_COUNT_LIMIT).subquery()
+        ).scalar()
+        return count, count >= APPROXIMATE_COUNT_LIMIT
+
+    return None, False
+
+def paginate_emails(query, per_page=50, cursor=None, ascending=False, count='none', model=Email):
+    """
+    Fetch a page of emails in (date_sent, id) order using keyset pagination.
+
+    Each page seeks past the previous one's last row instead of using OFFSET,
+    so every page costs the same however deep it is.
+
+    Args:
+        query: Query with any filters applied, not ordered
+        per_page: Emails per page, capped at MAX_PER_PAGE
+        cursor: Cursor from a previous page's next_cursor or prev_cursor
+        ascending: Oldest first instead of newest first
+        count: 'exact', 'approximate' or 'none'
+        model: Model the query selects, Email or EmailListItem
+
+    Returns:
+        KeysetPage
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    total, total_is_estimate = count_emails(query, count if count in COUNT_MODES else 'none')
+
+    position = decode_cursor(cursor) if cursor else None
+    before = position is not None and position[2]
+    # Pages before the cursor are read in reverse, then flipped back
+    scan_ascending = ascending != before
+
+    if position:
+        date_sent, email_id, _ = position
+        # Spelled out rather than as a row-value comparison so the date_sent index bounds the scan
+        if scan_ascending:
+            query = query.filter(model.date_sent >= date_sent, or_(model.date_sent > date_sent, model.id > email_id))
+        else:
+            query = query.filter(model.date_sent <= date_sent, or_(model.date_sent < date_sent, model.id < email_id))
+
+    if scan_ascending:
+        query = query.order_by(model.date_sent.asc(), model.id.asc())
+    else:
+        query = query.order_by(model.date_sent.desc(), model.id.desc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if before:
+        items.reverse()
+
+    has_next = True if before else has_more
+    has_prev = has_more if before else position is not None
+
+    return KeysetPage(
+        items,
+        per_page,
+        next_cursor=encode_cursor(items[-1]) if items and has_next else None,
+        prev_cursor=encode_cursor(items[0], before=True) if items and has_prev else None,
+        total=total,
+        total_is_estimate=total_is_estimate
+    )
@@ -0,0 +1,216 @@
+import re
+import json
+import logging
+import threading
+
+from bs4 import BeautifulSoup
+from sqlalchemy import func
+
+from app import db
+from config import current_config
+from models import Disclaimer
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+# Characters per token assumed when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+# Known disclaimers shorter than this are too generic to strip safely
+MIN_DISCLAIMER_LENGTH = 40
+
+# Subjects longer than this (in tokens) are truncated in categorization prompts
+MAX_SUBJECT_TOKENS = 48
+
+BLOCK_TAGS = ['p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table']
+
+QUOTE_MARKERS = [
+    re.compile(r'^\s*On\b.{0,200}\bwrote:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-+\s*(Original Message|Forwarded message)\s*-+\s*$', re.IGNORECASE),
+    re.compile(r'^\s*Begin forwarded message:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*From:\s.+$', re.IGNORECASE),
+    re.compile(r'^_{10,}\s*$')
+]
+
+_encoding = None
+_encoding_loaded = False
+_disclaimers = (None, [])
+_disclaimers_lock = threading.Lock()
+
+def get_encoding():
+    """Return the tiktoken encoding for the configured model, or None if unavailable."""
+    global _encoding, _encoding_loaded
+
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.encoding_for_model(current_config.AI_MODEL)
+            except Exception:
+                try:
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    logger.warning(f"Could not load tokenizer, estimating token counts: {str(e)}")
+    return _encoding
+
+def count_tokens(text):
+    """Count (or estimate) the tokens in a piece of text."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens, marking the cut with an ellipsis."""
+    if not text or count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = get_encoding()
+    if encoding is not None:
+        truncated = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    else:
+        truncated = text[:max_tokens * CHARS_PER_TOKEN]
+    return truncated.rstrip() + ' …'
+
+def html_to_text(html):
+    """Convert an HTML body to plain text, dropping scripts, styles and quoted blocks."""
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'head']):
+        element.decompose()
+    for element in soup.find_all('blockquote'):
+        element.decompose()
+    for element in soup.find_all(class_=['gmail_quote', 'yahoo_quoted']):
+        element.decompose()
+    # Keep paragraph breaks without splitting inline elements onto their own lines
+    for element in soup.find_all(BLOCK_TAGS):
+        element.append('\n')
+    return soup.get_text()
+
+def strip_quoted_replies(text):
+    """Drop quoted lines and everything after the first reply or forward header."""
+    lines = []
+    for line in text.splitlines():
+        # A header at the very top is a bare forward; keep its content
+        if any(kept.strip() for kept in lines) and any(marker.match(line) for marker in QUOTE_MARKERS):
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        lines.append(line)
+    return '\n'.join(lines)
+
+def collapse_whitespace(text):
+    """Collapse runs of spaces and blank lines."""
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    text = re.sub(r' ?\n ?', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+def get_known_disclaimers():
+    """Return normalized disclaimer texts from the Disclaimer table, longest first."""
+    global _disclaimers
+
+    with _disclaimers_lock:
+        count = db.session.query(func.count(Disclaimer.id)).scalar()
+        if _disclaimers[0] != count:
+            texts = {
+                re.sub(r'\s+', ' ', text).strip()
+                for (text,) in db.session.query(Disclaimer.text).all()
+                if text
+            }
+            _disclaimers = (count, sorted(
+                (text for text in texts if len(text) >= MIN_DISCLAIMER_LENGTH),
+                key=len,
+                reverse=True
+            ))
+        return _disclaimers[1]
+
+def strip_disclaimers(text, disclaimers=None):
+    """Remove known disclaimer texts, matching them regardless of line wrapping."""
+    if disclaimers is None:
+        disclaimers = get_known_disclaimers()
+
+    normalized = re.sub(r'\s+', ' ', text)
+    for disclaimer in disclaimers:
+        if disclaimer[:MIN_DISCLAIMER_LENGTH] not in normalized:
+            continue
+        pattern = r'\s+'.join(re.escape(word) for word in disclaimer.split(' '))
+        text = re.sub(pattern, '', text)
+    return text
+
+def prepare_body(body, body_format='text', max_tokens=None):
+    """
+    Reduce an email body to the text worth sending to the model.
+
+    Args:
+        body: Raw body content as stored
+        body_format: 'text' or 'html'
+        max_tokens: Token budget for the result (defaults to AI_ANALYZE_MAX_BODY_TOKENS)
+
+    Returns:
+        Plain text body without markup, quoted replies or known disclaimers
+    """
+    if not body:
+        return ''
+    if max_tokens is None:
+        max_tokens = current_config.AI_ANALYZE_MAX_BODY_TOKENS
+
+    text = html_to_text(body) if body_format == 'html' else body
+    text = strip_quoted_replies(text)
+    text = strip_disclaimers(text)
+    text = collapse_whitespace(text)
+    return truncate_to_tokens(text, max_tokens)
+
+def compact_json(data):
+    """Serialize without indentation or padding to save prompt tokens."""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+def compact_email(email_obj):
+    """Minimal categorization input for one email: ID, sender, trimmed subject and date."""
+    return {
+        "id": email_obj.id,
+        "from": email_obj.sender,
+        "subject": truncate_to_tokens(email_obj.subject or '', MAX_SUBJECT_TOKENS),
+        "date": email_obj.date_sent.strftime('%Y-%m-%d') if email_obj.date_sent else None
+    }
+
+def pack_batches(items, fixed_tokens, max_tokens=None, max_items=None):
+    """
+    Greedily pack items into as few batches as fit the prompt budget.
+
+    Args:
+        items: List of JSON-serializable dicts, one per email
+        fixed_tokens: Tokens used by the parts of the prompt that don't vary
+        max_tokens: Total prompt budget per request (defaults to AI_CATEGORIZE_MAX_PROMPT_TOKENS)
+        max_items: Cap on emails per request (defaults to AI_CATEGORIZE_MAX_BATCH)
+
+    Returns:
+        List of batches (lists of items)
+    """
+    if max_tokens is None:
+        max_tokens = current_config.AI_CATEGORIZE_MAX_PROMPT_TOKENS
+    if max_items is None:
+        max_items = current_config.AI_CATEGORIZE_MAX_BATCH
+
+    budget = max(max_tokens - fixed_tokens, 1)
+    batches = []
+    batch = []
+    used = 0
+
+    for item in items:
+        # Each item is one line of the prompt
+        cost = count_tokens(compact_json(item)) + 1
+        if batch and (used + cost > budget or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+            used = 0
+        batch.append(item)
+        used += cost
+
+    if batch:
+        batches.append(batch)
+    return batches
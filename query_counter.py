@@ -0,0 +1,110 @@
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+class QueryCounter:
+    """Records the SQL statements run on an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+@contextmanager
+def assert_max_queries(max_queries, engine=None):
+    """
+    Fail if the enclosed block runs more than max_queries SQL statements.
+
+    Usage:
+        with assert_max_queries(5):
+            client.get('/emails')
+
+    Raises:
+        AssertionError: Listing the statements that ran, when over budget
+    """
+    if engine is None:
+        from app import db
+        engine = db.engine
+
+    with QueryCounter(engine) as counter:
+        yield counter
+
+    if counter.count > max_queries:
+        statements = '\n'.join(f"  {statement}" for statement in counter.statements)
+        raise AssertionError(f"Ran {counter.count} queries, expected at most {max_queries}:\n{statements}")
+
+# Pages whose query count must not grow with page size, with their budgets.
+# Paths with {email_id} or {thread_id} need an email in a thread.
+ROUTE_BUDGETS = [
+    ('/emails', 6),
+    ('/emails?count=exact', 6),
+    ('/emails?category=Work', 6),
+    ('/api/emails?per_page=200', 3),
+    ('/search?q=the', 6),
+    ('/categories', 4),
+    ('/accounts', 3),
+    ('/email/{email_id}', 8),
+    ('/thread/{thread_id}', 6),
+    ('/api/threads/{thread_id}/emails', 5),
+    ('/api/threads/{thread_id}', 1),
+]
+
+def get_route_budgets():
+    """
+    Return (path, max queries) for each entry in ROUTE_BUDGETS.
+
+    Paths needing an ID use the newest email and thread, and are skipped
+    when there is no threaded email.
+    """
+    from models import Email
+
+    email = Email.query.filter(Email.thread_id.isnot(None)).order_by(Email.date_sent.desc()).first()
+
+    budgets = []
+    for path, budget in ROUTE_BUDGETS:
+        if '{' in path:
+            if email is None:
+                continue
+            path = path.format(email_id=email.id, thread_id=email.thread_id)
+        budgets.append((path, budget))
+    return budgets
+
+def check_route_query_budgets(app):
+    """
+    Request each budgeted page and compare its query count with its budget.
+
+    Returns:
+        List of dicts with 'path', 'status', 'queries', 'budget' and 'ok'
+    """
+    from app import db
+
+    results = []
+    client = app.test_client()
+    for path, budget in get_route_budgets():
+        with QueryCounter(db.engine) as counter:
+            response = client.get(path)
+        results.append({
+            "path": path,
+            "status": response.status_code,
+            "queries": counter.count,
+            "budget": budget,
+            "ok": response.status_code < 400 and counter.count <= budget
+        })
+        logger.debug(f"{path}: {counter.count} queries (budget {budget})")
+    return results
@@ -0,0 +1,281 @@
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy import select, literal, exists, or_, and_, func, update
+
+from app import db
+from config import current_config
+from models import Email, Rule, Category, RuleBackfill, email_categories, email_rules
+from uncategorized_queue import dequeue_emails, dequeue_category_members
+from email_list import refresh_list_items
+from rule_engine import (
+    parse_rule_type, parse_rule_values, normalize_rule_targets,
+    compile_rules, match_rules, find_or_create_categories
+)
+
+logger = logging.getLogger(__name__)
+
+# Rule types that can be applied with a single INSERT ... SELECT
+SET_BASED_RULE_TYPES = ('sender', 'domain')
+
+def start_rule_backfill(rule_id, background=True):
+    """
+    Queue retroactive application of a rule to existing emails.
+
+    Args:
+        rule_id: ID of the rule to apply
+        background: Run in the background instead of blocking; on the job
+            queue when background jobs are enabled, otherwise in a thread
+
+    Returns:
+        RuleBackfill record tracking the job
+    """
+    backfill = RuleBackfill(rule_id=rule_id, status='pending')
+    db.session.add(backfill)
+    db.session.commit()
+
+    if background and current_config.BACKGROUND_JOBS_ENABLED:
+        from job_queue import enqueue_job
+        enqueue_job('rule_backfill', {'backfill_id': backfill.id})
+    elif background:
+        app = current_app._get_current_object()
+        thread = threading.Thread(
+            target=_run_backfill_in_app_context,
+            args=(app, backfill.id),
+            daemon=True
+        )
+        thread.start()
+    else:
+        run_rule_backfill(backfill.id)
+
+    return backfill
+
+def _run_backfill_in_app_context(app, backfill_id):
+    with app.app_context():
+        run_rule_backfill(backfill_id)
+
+def resume_rule_backfills():
+    """Resume any backfills left pending or interrupted while running."""
+    backfill_ids = [b.id for b in RuleBackfill.query.filter(
+        RuleBackfill.status.in_(['pending', 'running'])
+    ).order_by(RuleBackfill.id).all()]
+
+    for backfill_id in backfill_ids:
+        run_rule_backfill(backfill_id)
+
+    return backfill_ids
+
+def get_backfill_status(backfill):
+    """Serialize a backfill's progress for JSON responses."""
+    percent = 100.0 if backfill.status == 'completed' else 0.0
+    if backfill.status != 'completed' and backfill.total:
+        percent = round(100.0 * (backfill.processed or 0) / backfill.total, 1)
+
+    return {
+        "id": backfill.id,
+        "rule_id": backfill.rule_id,
+        "status": backfill.status,
+        "processed": backfill.processed or 0,
+        "total": backfill.total or 0,
+        "matched": backfill.matched or 0,
+        "percent": percent,
+        "error": backfill.error
+    }
+
+def run_rule_backfill(backfill_id, batch_size=500, progress=None):
+    """
+    Apply a rule to historical emails, resuming from the last saved cursor.
+
+    Sender and domain rules are applied with set-based INSERT ... SELECT
+    statements; subject and keyword rules stream through emails in ID order,
+    committing progress after each batch.
+
+    Args:
+        backfill_id: ID of the RuleBackfill record
+        batch_size: Number of emails scanned per commit for streaming rules
+        progress: Optional callback taking (fraction, message), called after each batch
+
+    Returns:
+        Dict with results
+    """
+    backfill = db.session.get(RuleBackfill, backfill_id)
+    if not backfill:
+        return {"success": False, "message": "Backfill not found"}
+
+    try:
+        rule = db.session.get(Rule, backfill.rule_id)
+        if not rule:
+            raise ValueError(f"Rule {backfill.rule_id} not found")
+
+        rule_type = parse_rule_type(rule.type)
+        targets = normalize_rule_targets(rule_type, parse_rule_values(rule.targets))
+        category_names = parse_rule_values(rule.results)
+
+        backfill.status = 'running'
+        if not backfill.total:
+            backfill.total = db.session.query(func.count(Email.id)).scalar()
+        db.session.commit()
+
+        if targets and category_names:
+            categories = find_or_create_categories(category_names)
+            db.session.flush()  # Generate IDs for new categories
+            category_ids = [c.id for c in categories.values()]
+
+            if rule_type in SET_BASED_RULE_TYPES:
+                apply_rule_set_based(backfill, rule, rule_type, targets, category_ids)
+            else:
+                apply_rule_streaming(backfill, rule, rule_type, category_ids, batch_size, progress)
+
+        backfill.status = 'completed'
+        backfill.processed = backfill.total
+        db.session.commit()
+
+        logger.info(f"Rule {rule.id} applied to {backfill.matched} existing emails")
+        return {
+            "success": True,
+            "message": f"Applied rule to {backfill.matched} emails",
+            "matched": backfill.matched
+        }
+
+    except Exception as e:
+        logger.error(f"Error applying rule backfill {backfill_id}: {str(e)}")
+        db.session.rollback()
+        backfill = db.session.get(RuleBackfill, backfill_id)
+        backfill.status = 'failed'
+        backfill.error = str(e)
+        db.session.commit()
+        return {"success": False, "message": f"Error: {str(e)}"}
+
+def escape_like(value):
+    """Escape LIKE wildcards in a literal value."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_sender_condition(rule_type, targets):
+    """Build a SQL condition matching Email.sender against sender or domain targets."""
+    sender = func.lower(Email.sender)
+    conditions = []
+
+    for target in targets:
+        escaped = escape_like(target)
+        if rule_type == 'sender':
+            # Bare address or "Display Name <address>"
+            conditions.append(sender == target)
+            conditions.append(sender.like(f'%<{escaped}>', escape='\\'))
+        else:
+            # The domain itself or any subdomain, with or without angle brackets
+            for pattern in (f'%@{escaped}', f'%@{escaped}>', f'%@%.{escaped}', f'%@%.{escaped}>'):
+                conditions.append(sender.like(pattern, escape='\\'))
+
+    return or_(*conditions)
+
+def apply_rule_set_based(backfill, rule, rule_type, targets, category_ids):
+    """Apply a sender or domain rule with one INSERT ... SELECT per link table."""
+    condition = build_sender_condition(rule_type, targets)
+
+    for category_id in category_ids:
+        already_linked = exists().where(and_(
+            email_categories.c.email_id == Email.id,
+            email_categories.c.category_id == category_id
+        ))
+        result = db.session.execute(
+            email_categories.insert().from_select(
+                ['email_id', 'category_id'],
+                select(Email.id, literal(category_id)).where(condition, ~already_linked)
+            )
+        )
+        db.session.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(assigned_count=func.coalesce(Category.assigned_count, 0) + result.rowcount)
+        )
+
+    already_linked = exists().where(and_(
+        email_rules.c.email_id == Email.id,
+        email_rules.c.rule_id == rule.id
+    ))
+    result = db.session.execute(
+        email_rules.insert().from_select(
+            ['email_id', 'rule_id'],
+            select(Email.id, literal(rule.id)).where(condition, ~already_linked)
+        )
+    )
+
+    rule.applied_count = (rule.applied_count or 0) + result.rowcount
+    backfill.matched = result.rowcount
+    dequeue_category_members(category_ids)
+    refresh_list_items(db.session.scalars(select(Email.id).where(condition)).all())
+    db.session.commit()
+
+def apply_rule_streaming(backfill, rule, rule_type, category_ids, batch_size, progress=None):
+    """Scan emails in ID order, applying a subject or keyword rule batch by batch."""
+    from keyword_index import get_email_text
+
+    compiled = compile_rules([rule])
+
+    while True:
+        query = Email.query
+        if backfill.cursor:
+            query = query.filter(Email.id > backfill.cursor)
+        batch = query.order_by(Email.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        matched_ids = []
+        for email in batch:
+            body_text = get_email_text(email) if rule_type == 'keyword' else None
+            if match_rules(email.sender, email.subject, body_text, compiled):
+                matched_ids.append(email.id)
+
+        if matched_ids:
+            link_emails(rule, matched_ids, category_ids)
+
+        backfill.cursor = batch[-1].id
+        backfill.processed = (backfill.processed or 0) + len(batch)
+        backfill.matched = (backfill.matched or 0) + len(matched_ids)
+        db.session.commit()
+
+        if progress and backfill.total:
+            progress(backfill.processed / backfill.total, f"Scanned {backfill.processed} of {backfill.total} emails")
+
+def link_emails(rule, email_ids, category_ids):
+    """Bulk link emails to a rule and its categories, skipping existing links."""
+    existing = set(db.session.execute(
+        select(email_categories.c.email_id, email_categories.c.category_id).where(
+            email_categories.c.email_id.in_(email_ids),
+            email_categories.c.category_id.in_(category_ids)
+        )
+    ).all())
+
+    category_rows = [
+        {"email_id": email_id, "category_id": category_id}
+        for email_id in email_ids
+        for category_id in category_ids
+        if (email_id, category_id) not in existing
+    ]
+    if category_rows:
+        db.session.execute(email_categories.insert(), category_rows)
+        dequeue_emails({row["email_id"] for row in category_rows})
+        refresh_list_items({row["email_id"] for row in category_rows})
+
+    counts = {}
+    for row in category_rows:
+        counts[row["category_id"]] = counts.get(row["category_id"], 0) + 1
+    for category_id, count in counts.items():
+        db.session.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(assigned_count=func.coalesce(Category.assigned_count, 0) + count)
+        )
+
+    linked = set(db.session.execute(
+        select(email_rules.c.email_id).where(
+            email_rules.c.email_id.in_(email_ids),
+            email_rules.c.rule_id == rule.id
+        )
+    ).scalars().all())
+
+    rule_rows = [{"email_id": email_id, "rule_id": rule.id} for email_id in email_ids if email_id not in linked]
+    if rule_rows:
+        db.session.execute(email_rules.insert(), rule_rows)
+        rule.applied_count = (rule.applied_count or 0) + len(rule_rows)
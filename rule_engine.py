@@ -0,0 +1,254 @@
+import json
+import logging
+import threading
+
+from sqlalchemy import func
+
+from app import db
+from models import Rule, Category
+from keyword_index import AhoCorasick
+
+logger = logging.getLogger(__name__)
+
+# Rule type prefixes: AI-assigned (a:), User-assigned (u:), Rule-based (r:)
+RULE_TYPE_PREFIXES = ('a:', 'u:', 'r:')
+
+class CompiledRules:
+    """In-memory lookup structures built from the Rule table."""
+
+    def __init__(self, signature=None):
+        self.signature = signature
+        self.sender_rules = {}   # email address -> [(rule_id, [category names])]
+        self.domain_rules = {}   # domain -> [(rule_id, [category names])]
+        self.subject_rules = {}  # lowercased text -> [(rule_id, [category names])]
+        self.keyword_rules = {}  # lowercased text -> [(rule_id, [category names])]
+        self.subject_matcher = AhoCorasick()
+        self.keyword_matcher = AhoCorasick()
+        self.rule_count = 0
+
+    def is_empty(self):
+        return self.rule_count == 0
+
+_compiled = None
+_compile_lock = threading.Lock()
+
+def parse_rule_type(rule_type):
+    """Strip the a:/u:/r: origin prefix from a rule type."""
+    if not rule_type:
+        return ''
+    for prefix in RULE_TYPE_PREFIXES:
+        if rule_type.startswith(prefix):
+            return rule_type[len(prefix):].strip().lower()
+    return rule_type.strip().lower()
+
+def parse_rule_values(raw):
+    """
+    Parse a rule's targets or results column into a list of strings.
+
+    AI-suggested rules store JSON arrays, while rules created through the
+    /rules/add form store comma-separated text, so both are accepted.
+    """
+    if not raw:
+        return []
+
+    try:
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        values = raw.split(',')
+
+    if isinstance(values, str):
+        values = values.split(',')
+    elif not isinstance(values, list):
+        values = [values]
+
+    return [str(v).strip() for v in values if v is not None and str(v).strip()]
+
+def get_rules_signature():
+    """Return a cheap fingerprint of the Rule table used to detect changes."""
+    count, max_id = db.session.query(func.count(Rule.id), func.max(Rule.id)).one()
+    return (count, max_id)
+
+def normalize_rule_targets(rule_type, targets):
+    """Normalize rule targets to the lowercase keys used for matching."""
+    from email_processor import extract_email
+
+    if rule_type == 'sender':
+        return [extract_email(t) or t.lower() for t in targets]
+    if rule_type == 'domain':
+        return [t.lower().lstrip('@') for t in targets]
+    return [t.lower() for t in targets]
+
+def compile_rules(rules=None):
+    """
+    Compile Rule rows into hash maps and Aho-Corasick matchers.
+
+    Args:
+        rules: Optional list of rules to compile (defaults to the whole Rule table)
+
+    Returns:
+        CompiledRules instance
+    """
+    if rules is None:
+        compiled = CompiledRules(signature=get_rules_signature())
+        rules = Rule.query.all()
+    else:
+        compiled = CompiledRules()
+
+    for rule in rules:
+        rule_type = parse_rule_type(rule.type)
+        targets = parse_rule_values(rule.targets)
+        results = parse_rule_values(rule.results)
+        if not targets or not results:
+            continue
+
+        entry = (rule.id, results)
+
+        if rule_type == 'sender':
+            index = compiled.sender_rules
+        elif rule_type == 'domain':
+            index = compiled.domain_rules
+        elif rule_type == 'subject':
+            index = compiled.subject_rules
+        elif rule_type == 'keyword':
+            index = compiled.keyword_rules
+        else:
+            logger.warning(f"Skipping rule {rule.id} with unsupported type: {rule.type}")
+            continue
+
+        keys = normalize_rule_targets(rule_type, targets)
+        for key in keys:
+            index.setdefault(key, []).append(entry)
+        compiled.rule_count += 1
+
+    for target in compiled.subject_rules:
+        compiled.subject_matcher.add(target)
+    for target in compiled.keyword_rules:
+        compiled.keyword_matcher.add(target)
+
+    # Compiled rules are shared between threads, so searches must never build
+    compiled.subject_matcher.build()
+    compiled.keyword_matcher.build()
+
+    logger.info(f"Compiled {compiled.rule_count} rules")
+    return compiled
+
+def get_compiled_rules():
+    """Return the compiled rules, recompiling if the Rule table has changed."""
+    global _compiled
+
+    signature = get_rules_signature()
+    if _compiled is not None and _compiled.signature == signature:
+        return _compiled
+
+    with _compile_lock:
+        if _compiled is None or _compiled.signature != signature:
+            _compiled = compile_rules()
+        return _compiled
+
+def invalidate_rules():
+    """Drop the compiled rules so the next lookup recompiles them."""
+    global _compiled
+    with _compile_lock:
+        _compiled = None
+
+def match_rules(sender, subject, body_text=None, compiled=None):
+    """
+    Find all rules matching an email.
+
+    Args:
+        sender: Raw From header
+        subject: Email subject
+        body_text: Optional plain text body used by keyword rules
+        compiled: Optional CompiledRules, defaults to the cached rules
+
+    Returns:
+        Dict mapping matched rule IDs to their category names
+    """
+    from email_processor import extract_email, extract_domain
+
+    compiled = compiled or get_compiled_rules()
+    matches = {}
+
+    if compiled.is_empty():
+        return matches
+
+    def add(entries):
+        for rule_id, results in entries:
+            matches[rule_id] = results
+
+    sender_email = extract_email(sender) if sender else None
+    if sender_email:
+        add(compiled.sender_rules.get(sender_email, []))
+
+        # Check the domain and each parent domain (mail.example.com -> example.com)
+        domain = extract_domain(sender_email)
+        while domain:
+            add(compiled.domain_rules.get(domain, []))
+            domain = domain.partition('.')[2] if '.' in domain else None
+
+    # Subject and keyword targets are each scanned in a single pass per text
+    for _, _, target in compiled.subject_matcher.search(subject):
+        add(compiled.subject_rules[target])
+
+    for text in (subject, body_text):
+        for _, _, target in compiled.keyword_matcher.search(text):
+            add(compiled.keyword_rules[target])
+
+    return matches
+
+def apply_rules(email_obj, body_text=None, compiled=None):
+    """
+    Apply matching rules to an email, assigning categories and updating counters.
+
+    Args:
+        email_obj: Email model instance (may not be committed yet)
+        body_text: Optional plain text body used by keyword rules
+        compiled: Optional CompiledRules, defaults to the cached rules
+
+    Returns:
+        List of matched rule IDs
+    """
+    try:
+        matches = match_rules(email_obj.sender, email_obj.subject, body_text, compiled)
+        if not matches:
+            return []
+
+        # The email may not be in the session yet, so avoid flushing it half-built
+        with db.session.no_autoflush:
+            category_names = []
+            for results in matches.values():
+                for name in results:
+                    if name not in category_names:
+                        category_names.append(name)
+
+            categories = find_or_create_categories(category_names)
+            for name in category_names:
+                category = categories[name]
+                if category not in email_obj.categories:
+                    email_obj.categories.append(category)
+                    category.assigned_count = (category.assigned_count or 0) + 1
+
+            for rule in Rule.query.filter(Rule.id.in_(list(matches.keys()))).all():
+                if rule not in email_obj.rules:
+                    email_obj.rules.append(rule)
+                rule.applied_count = (rule.applied_count or 0) + 1
+
+        return list(matches.keys())
+
+    except Exception as e:
+        logger.error(f"Error applying rules to email {email_obj.id}: {str(e)}")
+        return []
+
+def find_or_create_categories(names):
+    """Return a dict mapping each category name to a Category, creating missing ones."""
+    if not names:
+        return {}
+
+    categories = {c.name: c for c in Category.query.filter(Category.name.in_(names)).all()}
+    for name in names:
+        if name not in categories:
+            category = Category(name=name, assigned_count=0)
+            db.session.add(category)
+            categories[name] = category
+
+    return categories
@@ -28,8 +28,10 @@ setup(
         "email-validator>=2.1.0",
         "flask>=3.0.0",
         "flask-login>=0.6.3",
+        "flask-migrate>=4.0.5",
         "flask-sqlalchemy>=3.1.1",
         "gunicorn>=23.0.0",
+        "numpy>=1.26.0",
         "oauthlib>=3.2.2",
         "openai>=1.10.0",
         "psycopg2-binary>=2.9.9",
@@ -151,3 +151,49 @@ function showNotification(message, type = 'info') {
         document.getElementById(toastId).remove();
     });
 }
+
+/**
+ * POST to an endpoint that may queue a background job and wait for the job's result
+ * @param {string} url - The endpoint to call
+ * @param {Function} onProgress - Optional callback receiving the job while it runs
+ * @returns {Promise<Object>} The job's result, or the endpoint's response if it ran inline
+ */
+function runJob(url, onProgress) {
+    return fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => data.job_id ? waitForJob(data.job_id, onProgress) : data);
+}
+
+/**
+ * Poll a background job until it completes or fails
+ * @param {number} jobId - The ID of the job
+ * @param {Function} onProgress - Optional callback receiving the job while it runs
+ * @param {number} interval - Polling interval in milliseconds
+ * @returns {Promise<Object>} The job's result
+ */
+function waitForJob(jobId, onProgress, interval = 1000) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/jobs/${jobId}`)
+                .then(response => response.json())
+                .then(data => {
+                    const job = data.job;
+                    if (job.status === 'completed' || job.status === 'failed') {
+                        resolve(job.result || { success: false, message: job.error || 'Job failed' });
+                        return;
+                    }
+                    if (onProgress) {
+                        onProgress(job);
+                    }
+                    setTimeout(poll, interval);
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
@@ -18,6 +18,8 @@ THREAD_DIR = STORAGE_DIR / "threads"
 GROUP_DIR = STORAGE_DIR / "groups"
 RULE_DIR = STORAGE_DIR / "rules"
 CATEGORY_DIR = STORAGE_DIR / "categories"
+MODEL_DIR = STORAGE_DIR / "models"
+SEARCH_INDEX_DIR = STORAGE_DIR / "search-index"
 
 def initialize_storage():
     """Create the directory structure for email storage."""
@@ -33,7 +35,9 @@ def initialize_storage():
             THREAD_DIR,
             GROUP_DIR,
             RULE_DIR,
-            CATEGORY_DIR
+            CATEGORY_DIR,
+            MODEL_DIR,
+            SEARCH_INDEX_DIR
         ]:
             directory.mkdir(exist_ok=True, parents=True)
         
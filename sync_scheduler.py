@@ -0,0 +1,140 @@
+import time
+import random
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from config import current_config
+from models import Email, EmailAccount, AccountSyncSchedule
+
+logger = logging.getLogger(__name__)
+
+# Aim for about this many new messages per poll; busier accounts are polled more often
+TARGET_MESSAGES_PER_POLL = 1.0
+
+# Longest the daemon sleeps between checks, so new accounts are picked up promptly
+MAX_IDLE_SECONDS = 30
+
+def get_arrival_rate(account_id, window_hours=None):
+    """Return messages per hour received by an account over the recent window."""
+    window_hours = window_hours or current_config.SYNC_RATE_WINDOW_HOURS
+    since = datetime.utcnow() - timedelta(hours=window_hours)
+
+    count = db.session.query(func.count(Email.id)).filter(
+        Email.account_id == account_id,
+        Email.date_sent >= since
+    ).scalar()
+    return count / window_hours
+
+def compute_sync_interval(arrival_rate):
+    """
+    Pick a polling interval from an arrival rate.
+
+    Busy accounts approach SYNC_MIN_INTERVAL_SECONDS, idle ones back off to
+    SYNC_MAX_INTERVAL_SECONDS.
+    """
+    min_interval = current_config.SYNC_MIN_INTERVAL_SECONDS
+    max_interval = current_config.SYNC_MAX_INTERVAL_SECONDS
+
+    if arrival_rate <= 0:
+        return max_interval
+
+    interval = TARGET_MESSAGES_PER_POLL / arrival_rate * 3600
+    return int(max(min_interval, min(max_interval, interval)))
+
+def with_jitter(seconds):
+    """Spread polls by +/- SYNC_JITTER so accounts don't all fire together."""
+    jitter = current_config.SYNC_JITTER
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+def get_schedules():
+    """Return a schedule for every account, creating missing ones due immediately."""
+    schedules = {s.account_id: s for s in AccountSyncSchedule.query.all()}
+    account_ids = {account_id for (account_id,) in db.session.query(EmailAccount.id).all()}
+    now = datetime.utcnow()
+
+    # Drop schedules of deleted accounts
+    for account_id in set(schedules) - account_ids:
+        db.session.delete(schedules.pop(account_id))
+
+    for account_id in account_ids - set(schedules):
+        schedules[account_id] = AccountSyncSchedule(
+            account_id=account_id,
+            interval_seconds=current_config.SYNC_MIN_INTERVAL_SECONDS,
+            arrival_rate=0.0,
+            next_run_at=now
+        )
+        db.session.add(schedules[account_id])
+
+    db.session.commit()
+    return list(schedules.values())
+
+def sync_due_account(schedule):
+    """Sync (or queue a sync for) one account, then schedule its next run."""
+    now = datetime.utcnow()
+
+    if current_config.BACKGROUND_JOBS_ENABLED:
+        from job_queue import enqueue_job
+        job = enqueue_job('sync_account', {'account_id': schedule.account_id})
+        logger.debug(f"Queued sync job {job.id} for account {schedule.account_id}")
+    else:
+        from email_processor import process_account_emails
+        account = db.session.get(EmailAccount, schedule.account_id)
+        result = process_account_emails(account)
+        account.last_sync = datetime.utcnow()
+        logger.info(result["message"])
+
+    schedule.arrival_rate = get_arrival_rate(schedule.account_id)
+    schedule.interval_seconds = compute_sync_interval(schedule.arrival_rate)
+    schedule.last_run_at = now
+    schedule.next_run_at = datetime.utcnow() + timedelta(seconds=with_jitter(schedule.interval_seconds))
+    db.session.commit()
+
+    logger.info(
+        f"Account {schedule.account_id}: {schedule.arrival_rate:.1f} msgs/hour, "
+        f"next sync in {schedule.interval_seconds}s"
+    )
+
+def run_sync_daemon(once=False):
+    """
+    Poll each account when its schedule comes due, until interrupted.
+
+    Args:
+        once: Run every currently due account once and return
+
+    Returns:
+        Number of syncs started
+    """
+    started = 0
+
+    while True:
+        schedules = get_schedules()
+        now = datetime.utcnow()
+
+        for schedule in sorted(schedules, key=lambda s: s.next_run_at or now):
+            if schedule.next_run_at and schedule.next_run_at > now:
+                continue
+            try:
+                sync_due_account(schedule)
+                started += 1
+            except Exception as e:
+                logger.error(f"Error syncing account {schedule.account_id}: {str(e)}")
+                db.session.rollback()
+                schedule = db.session.get(AccountSyncSchedule, schedule.account_id)
+                schedule.next_run_at = datetime.utcnow() + timedelta(seconds=with_jitter(
+                    schedule.interval_seconds or current_config.SYNC_MIN_INTERVAL_SECONDS
+                ))
+                db.session.commit()
+
+        if once:
+            return started
+
+        upcoming = [s.next_run_at for s in AccountSyncSchedule.query.all() if s.next_run_at]
+        wait = MAX_IDLE_SECONDS
+        if upcoming:
+            wait = min(wait, max(1.0, (min(upcoming) - datetime.utcnow()).total_seconds()))
+
+        db.session.remove()
+        time.sleep(wait)
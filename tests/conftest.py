@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import pytest
+
+# The app reads its configuration at import, so point it at a scratch database
+# and storage directory before anything imports it
+WORK_DIR = tempfile.mkdtemp(prefix='email-manager-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}"
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+os.chdir(WORK_DIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, register_routes
+
+register_routes(flask_app)
+
+def make_message(index, subject, attachment=False):
+    """Build a raw email; messages sharing a subject land in the same thread."""
+    msg = EmailMessage()
+    msg['From'] = f"Sender {index % 5} <sender{index % 5}@example.com>"
+    msg['To'] = 'me@example.com'
+    msg['Subject'] = subject
+    msg['Message-ID'] = f"<{index}@example.com>"
+    msg['Date'] = format_datetime(datetime.utcnow() - timedelta(hours=index))
+    msg.set_content(f"Message {index} about the quarterly report.")
+    if attachment:
+        msg.add_attachment(b'%PDF-1.4 report', maintype='application', subtype='pdf', filename=f"report-{index}.pdf")
+    return msg.as_bytes()
+
+@pytest.fixture(scope='session')
+def app():
+    """The app with a mailbox of threaded, categorized emails, some with attachments."""
+    from models import EmailAccount, Email, Category
+    from storage import initialize_storage
+    from email_processor import process_email
+    from email_list import refresh_list_items
+
+    with flask_app.app_context():
+        initialize_storage()
+        account = EmailAccount(email='me@example.com', account_type='gmail')
+        db.session.add(account)
+        db.session.commit()
+
+        for index in range(60):
+            process_email(make_message(index, f"Report {index % 12}", attachment=index % 3 == 0), account)
+
+        work = Category(name='Work')
+        reports = Category(name='Reports', parent=work)
+        db.session.add_all([work, reports])
+        emails = Email.query.order_by(Email.date_sent).all()
+        for index, email in enumerate(emails):
+            email.categories.append(reports if index % 2 else work)
+        db.session.flush()
+        refresh_list_items([email.id for email in emails])
+        db.session.commit()
+        db.session.remove()
+
+    yield flask_app
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+@pytest.fixture()
+def engine(app):
+    with app.app_context():
+        return db.engine
+
+@pytest.fixture()
+def newest_email(app):
+    """(email ID, thread ID) of the newest email."""
+    from models import Email
+
+    with app.app_context():
+        email = Email.query.order_by(Email.date_sent.desc()).first()
+        result = (email.id, email.thread_id)
+        db.session.remove()
+    return result
@@ -0,0 +1,26 @@
+"""Pages must run a fixed number of queries however many emails they show."""
+import pytest
+
+from query_counter import ROUTE_BUDGETS, assert_max_queries, QueryCounter
+
+@pytest.mark.parametrize('path, budget', ROUTE_BUDGETS)
+def test_route_query_budget(client, engine, newest_email, path, budget):
+    email_id, thread_id = newest_email
+    path = path.format(email_id=email_id, thread_id=thread_id)
+    with assert_max_queries(budget, engine):
+        response = client.get(path)
+    assert response.status_code == 200
+
+def test_api_query_count_does_not_grow_with_page_size(client, engine):
+    counts = []
+    for per_page in (5, 50):
+        with QueryCounter(engine) as counter:
+            response = client.get(f'/api/emails?per_page={per_page}')
+        assert response.status_code == 200
+        counts.append(counter.count)
+    assert counts[0] == counts[1]
+
+def test_over_budget_lists_statements(client, engine):
+    with pytest.raises(AssertionError, match='expected at most 0'):
+        with assert_max_queries(0, engine):
+            client.get('/emails')
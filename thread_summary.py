@@ -0,0 +1,131 @@
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, select, update, exists, bindparam
+
+from app import db
+from models import Email, EmailListItem, Thread, email_attachments
+
+logger = logging.getLogger(__name__)
+
+def add_email_to_thread(thread, email_obj):
+    """
+    Count a newly processed email in its thread's summary.
+
+    Counters are incremented in SQL at flush, so concurrent ingests into the
+    same thread don't lose updates. Call after the thread's last_date has been
+    updated for the email.
+    """
+    thread.message_count = Thread.message_count + 1
+    if not email_obj.is_read:
+        thread.unread_count = Thread.unread_count + 1
+    if email_obj.attachments:
+        thread.has_attachments = True
+    if thread.last_date is None or email_obj.date_sent is None or email_obj.date_sent >= thread.last_date:
+        thread.latest_sender = email_obj.sender
+
+    participants = thread.participant_list
+    if email_obj.sender and email_obj.sender not in participants:
+        thread.participants = json.dumps(sorted(participants + [email_obj.sender]))
+
+def set_read_state(email_ids, is_read):
+    """
+    Mark emails read or unread, keeping their threads' unread counts and their
+    list rows in step.
+
+    Runs in the caller's transaction; the caller commits.
+
+    Args:
+        email_ids: IDs of the emails to mark
+        is_read: True to mark read, False to mark unread
+
+    Returns:
+        Number of emails whose read state changed
+    """
+    changed = db.session.query(Email.id, Email.thread_id).filter(
+        Email.id.in_(list(email_ids)),
+        func.coalesce(Email.is_read, False) != is_read
+    ).all()
+    if not changed:
+        return 0
+
+    ids = [email_id for email_id, _ in changed]
+    db.session.execute(update(Email).where(Email.id.in_(ids)).values(is_read=is_read))
+    db.session.execute(
+        update(EmailListItem)
+        .where(EmailListItem.id.in_(ids))
+        .values(is_read=is_read, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+    counts = {}
+    for _, thread_id in changed:
+        if thread_id:
+            counts[thread_id] = counts.get(thread_id, 0) + 1
+    for thread_id, count in counts.items():
+        db.session.execute(
+            update(Thread)
+            .where(Thread.id == thread_id)
+            .values(unread_count=Thread.unread_count + (-count if is_read else count))
+        )
+
+    return len(ids)
+
+def rebuild_thread_summaries(batch_size=1000):
+    """
+    Recompute every thread's summary aggregates from its emails.
+
+    Returns:
+        Dict with results
+    """
+    try:
+        in_thread = Email.thread_id == Thread.id
+        db.session.execute(
+            update(Thread).values(
+                message_count=select(func.count(Email.id)).where(in_thread).scalar_subquery(),
+                unread_count=select(func.count(Email.id)).where(
+                    in_thread, func.coalesce(Email.is_read, False).is_(False)
+                ).scalar_subquery(),
+                has_attachments=exists().where(in_thread, email_attachments.c.email_id == Email.id),
+                latest_sender=select(Email.sender).where(in_thread).order_by(
+                    Email.date_sent.desc(), Email.id.desc()
+                ).limit(1).scalar_subquery()
+            ).execution_options(synchronize_session=False)
+        )
+
+        # Participant sets need no dialect-specific aggregate when built a batch of threads at a time
+        set_participants = update(Thread.__table__).where(
+            Thread.__table__.c.id == bindparam('batch_thread_id')
+        ).values(participants=bindparam('sorted_senders'))
+
+        count = 0
+        last_id = None
+        while True:
+            query = db.session.query(Thread.id)
+            if last_id is not None:
+                query = query.filter(Thread.id > last_id)
+            batch = [thread_id for thread_id, in query.order_by(Thread.id).limit(batch_size)]
+            if not batch:
+                break
+
+            participants = {thread_id: set() for thread_id in batch}
+            for thread_id, sender in db.session.query(Email.thread_id, Email.sender).filter(
+                Email.thread_id.in_(batch), Email.sender.isnot(None)
+            ).distinct():
+                participants[thread_id].add(sender)
+
+            db.session.connection().execute(set_participants, [
+                {"batch_thread_id": thread_id, "sorted_senders": json.dumps(sorted(senders))}
+                for thread_id, senders in participants.items()
+            ])
+            count += len(batch)
+            last_id = batch[-1]
+
+        db.session.commit()
+        return {"success": True, "message": f"Rebuilt summaries for {count} threads"}
+
+    except Exception as e:
+        logger.error(f"Error rebuilding thread summaries: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
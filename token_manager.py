@@ -0,0 +1,188 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+from app import db
+from config import current_config
+from models import EmailAccount
+
+logger = logging.getLogger(__name__)
+
+class TokenManager:
+    """
+    Caches OAuth access tokens per account and refreshes them ahead of expiry.
+
+    Each account has its own lock, so concurrent callers that find a token
+    expiring trigger a single refresh and then share its result. A background
+    thread refreshes tokens that will expire soon so request paths rarely
+    have to wait for the token endpoint.
+    """
+
+    def __init__(self, refresh_fns, margin_seconds=300, check_seconds=60):
+        self.refresh_fns = refresh_fns  # account type -> fn(account) returning True on success
+        self.margin = timedelta(seconds=margin_seconds)
+        self.check_seconds = check_seconds
+
+        self._tokens = {}  # account_id -> (access_token, expiry)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._thread = None
+
+    def get_token(self, account, stale_token=None, valid_until=None):
+        """
+        Return a valid access token for an account, refreshing it if needed.
+
+        Args:
+            account: EmailAccount, updated in place when its token is refreshed
+            stale_token: A token the provider just rejected; forces a refresh
+                unless another caller has already replaced it
+            valid_until: Refresh if the token expires before this time
+                (defaults to now plus the refresh margin)
+
+        Returns:
+            Access token, or None if the token could not be refreshed
+        """
+        valid_until = valid_until or datetime.utcnow() + self.margin
+
+        token = self._fresh_token(account.id, stale_token, valid_until)
+        if token:
+            return token
+
+        with self._account_lock(account.id):
+            # Another caller may have refreshed while we waited for the lock
+            token = self._fresh_token(account.id, stale_token, valid_until)
+            if token:
+                return token
+
+            # Adopt a token refreshed elsewhere (another process or session)
+            self._remember(account)
+            token = self._fresh_token(account.id, stale_token, valid_until)
+            if token:
+                return token
+
+            refresh = self.refresh_fns.get(account.account_type)
+            if refresh is None or not refresh(account):
+                logger.error(f"Could not refresh token for {account.email}")
+                self._tokens.pop(account.id, None)
+                return None
+
+            logger.info(f"Refreshed token for {account.email}, valid until {account.token_expiry}")
+            self._remember(account)
+            return account.access_token
+
+    def get_expiry(self, account_id):
+        """Return when the cached token for an account expires, if known."""
+        cached = self._tokens.get(account_id)
+        return cached[1] if cached else None
+
+    def forget(self, account_id):
+        self._tokens.pop(account_id, None)
+
+    def refresh_expiring_tokens(self):
+        """
+        Refresh every token that would expire before the next check.
+
+        Returns:
+            Number of accounts refreshed
+        """
+        horizon = datetime.utcnow() + self.margin + timedelta(seconds=self.check_seconds)
+        accounts = EmailAccount.query.filter(
+            EmailAccount.refresh_token.isnot(None),
+            EmailAccount.token_expiry < horizon
+        ).all()
+
+        refreshed = 0
+        for account in accounts:
+            before = account.access_token
+            if self.get_token(account, valid_until=horizon) and account.access_token != before:
+                refreshed += 1
+
+        return refreshed
+
+    def start_background_refresh(self, app):
+        """Start the background refresh thread for this process, if not already running."""
+        with self._locks_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._refresh_loop, args=(app,), name="token-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def _refresh_loop(self, app):
+        with app.app_context():
+            while True:
+                try:
+                    refreshed = self.refresh_expiring_tokens()
+                    if refreshed:
+                        logger.info(f"Refreshed {refreshed} expiring tokens")
+                except Exception as e:
+                    logger.error(f"Error refreshing expiring tokens: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                time.sleep(self.check_seconds)
+
+    def _account_lock(self, account_id):
+        with self._locks_lock:
+            return self._locks.setdefault(account_id, threading.Lock())
+
+    def _fresh_token(self, account_id, stale_token, valid_until):
+        cached = self._tokens.get(account_id)
+        if cached is None or cached[0] == stale_token:
+            return None
+        access_token, expiry = cached
+        if expiry is not None and expiry < valid_until:
+            return None
+        return access_token
+
+    def _remember(self, account):
+        """Cache the account's token unless a longer-lived one is already cached."""
+        if not account.access_token:
+            return
+        cached = self._tokens.get(account.id)
+        if cached and cached[1] and account.token_expiry and cached[1] > account.token_expiry:
+            return
+        self._tokens[account.id] = (account.access_token, account.token_expiry)
+
+def request_with_token(account, method, url, **kwargs):
+    """
+    Make an HTTP request with the account's bearer token.
+
+    A 401 response refreshes the token and retries the request once.
+
+    Returns:
+        requests.Response, or None if no valid token could be obtained
+    """
+    token = token_manager.get_token(account)
+    if token is None:
+        return None
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    headers["Authorization"] = f"Bearer {token}"
+    response = requests.request(method, url, headers=headers, **kwargs)
+
+    if response.status_code == 401:
+        logger.info(f"Token rejected for {account.email}, refreshing and retrying")
+        token = token_manager.get_token(account, stale_token=token)
+        if token is None:
+            return response
+        headers["Authorization"] = f"Bearer {token}"
+        response = requests.request(method, url, headers=headers, **kwargs)
+
+    return response
+
+def create_token_manager():
+    from email_services import refresh_gmail_token, refresh_exchange_token
+
+    return TokenManager(
+        {'gmail': refresh_gmail_token, 'exchange': refresh_exchange_token},
+        margin_seconds=current_config.TOKEN_REFRESH_MARGIN_SECONDS,
+        check_seconds=current_config.TOKEN_REFRESH_CHECK_SECONDS
+    )
+
+token_manager = create_token_manager()
@@ -0,0 +1,196 @@
+import logging
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Email, FilterValue, filter_trigrams
+
+logger = logging.getLogger(__name__)
+
+# Email columns with substring filters on /emails
+FILTER_FIELDS = {
+    'sender': Email.sender,
+    'subject': Email.subject,
+}
+
+# Postings counted per trigram when picking the most selective ones for a query
+TRIGRAM_PROBE_LIMIT = 1000
+
+# Rarest trigrams of a query whose postings are intersected; LIKE checks the rest
+CANDIDATE_TRIGRAMS = 2
+
+REBUILD_BATCH_SIZE = 1000
+
+# B-tree entries on PostgreSQL are limited to about 2.7 kB, and nobody autocompletes values this long
+MAX_POSTGRES_VALUE_LENGTH = 1000
+
+def get_trigrams(value):
+    """Return the set of lowercase three-character substrings of a value."""
+    value = (value or '').lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+def like_pattern(value):
+    """Build a LIKE pattern matching the value anywhere, with wildcards in it escaped."""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def index_filter_values(email_obj):
+    """
+    Count a newly processed email's sender and subject in the filter index.
+
+    Runs in a savepoint so an indexing failure never aborts ingestion of the
+    email itself.
+    """
+    for field in FILTER_FIELDS:
+        value = getattr(email_obj, field)
+        if not value:
+            continue
+        if is_postgres() and len(value) > MAX_POSTGRES_VALUE_LENGTH:
+            continue
+
+        try:
+            with db.session.begin_nested():
+                add_filter_value(field, value)
+        except Exception as e:
+            logger.error(f"Error indexing {field} of email {email_obj.id} for filters: {str(e)}")
+
+def add_filter_value(field, value, count=1):
+    """Add to a value's email count, creating it and its trigrams on first sight."""
+    updated = db.session.execute(
+        FilterValue.__table__.update()
+        .where(FilterValue.field == field, FilterValue.value == value)
+        .values(email_count=FilterValue.email_count + count)
+    ).rowcount
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            filter_value = FilterValue(field=field, value=value, email_count=count)
+            db.session.add(filter_value)
+            db.session.flush()
+            # PostgreSQL matches substrings with pg_trgm indexes instead; values under three characters have no trigrams
+            trigrams = get_trigrams(value)
+            if trigrams and not is_postgres():
+                db.session.execute(filter_trigrams.insert(), [
+                    {"trigram": trigram, "value_id": filter_value.id}
+                    for trigram in trigrams
+                ])
+    except IntegrityError:
+        # Another process added the value first
+        db.session.execute(
+            FilterValue.__table__.update()
+            .where(FilterValue.field == field, FilterValue.value == value)
+            .values(email_count=FilterValue.email_count + count)
+        )
+
+def get_rarest_trigrams(trigrams):
+    """Return the trigrams with the fewest postings, counting at most TRIGRAM_PROBE_LIMIT of each."""
+    def frequency(trigram):
+        postings = select(filter_trigrams.c.value_id).where(
+            filter_trigrams.c.trigram == trigram
+        ).limit(TRIGRAM_PROBE_LIMIT).subquery()
+        return db.session.execute(select(func.count()).select_from(postings)).scalar()
+
+    return sorted(trigrams, key=frequency)[:CANDIDATE_TRIGRAMS]
+
+def matching_values(field, value):
+    """
+    Select the IDs of indexed values of a field containing the given text.
+
+    Values are narrowed down to those having the text's rarest trigrams, then
+    checked with LIKE. Text shorter than three characters has no trigrams,
+    so only the LIKE check applies.
+    """
+    query = select(FilterValue.id).where(
+        FilterValue.field == field,
+        FilterValue.value.ilike(like_pattern(value), escape='\\')
+    )
+
+    trigrams = get_trigrams(value)
+    if trigrams and not is_postgres():
+        for trigram in get_rarest_trigrams(trigrams):
+            query = query.where(FilterValue.id.in_(
+                select(filter_trigrams.c.value_id).where(filter_trigrams.c.trigram == trigram)
+            ))
+
+    return query
+
+def filter_contains(query, field, value):
+    """
+    Restrict an Email query to emails whose field contains the given text, ignoring case.
+
+    Uses the pg_trgm indexes on PostgreSQL and the trigram index on other databases.
+    """
+    column = FILTER_FIELDS[field]
+    if is_postgres():
+        return query.filter(column.ilike(like_pattern(value), escape='\\'))
+
+    values = select(FilterValue.value).where(FilterValue.id.in_(matching_values(field, value)))
+    return query.filter(column.in_(values))
+
+def autocomplete(field, value, limit=10):
+    """
+    Suggest indexed values of a field containing the given text.
+
+    Returns:
+        List of dicts with 'value' and 'count', most frequent first
+    """
+    if not value:
+        return []
+
+    rows = db.session.query(FilterValue.value, FilterValue.email_count).filter(
+        FilterValue.id.in_(matching_values(field, value))
+    ).order_by(FilterValue.email_count.desc(), FilterValue.value).limit(limit).all()
+
+    return [{"value": row_value, "count": count} for row_value, count in rows]
+
+def rebuild_filter_index():
+    """
+    Rebuild the filter index from every stored email.
+
+    Returns:
+        Dict with results
+    """
+    try:
+        db.session.execute(filter_trigrams.delete())
+        db.session.execute(FilterValue.__table__.delete())
+        db.session.commit()
+
+        indexed_count = 0
+        for field, column in FILTER_FIELDS.items():
+            rows = [
+                {"field": field, "value": value, "email_count": count}
+                for value, count in db.session.query(column, func.count(Email.id)).group_by(column)
+                if value and not (is_postgres() and len(value) > MAX_POSTGRES_VALUE_LENGTH)
+            ]
+
+            for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+                inserted = db.session.execute(
+                    insert(FilterValue).returning(FilterValue.id, FilterValue.value),
+                    rows[start:start + REBUILD_BATCH_SIZE]
+                ).all()
+                trigram_rows = [
+                    {"trigram": trigram, "value_id": value_id}
+                    for value_id, value in inserted
+                    for trigram in get_trigrams(value)
+                ]
+                if trigram_rows and not is_postgres():
+                    db.session.execute(filter_trigrams.insert(), trigram_rows)
+                db.session.commit()
+                indexed_count += len(inserted)
+
+        return {
+            "success": True,
+            "message": f"Indexed {indexed_count} distinct senders and subjects",
+            "indexed": indexed_count
+        }
+
+    except Exception as e:
+        logger.error(f"Error rebuilding filter index: {str(e)}")
+        db.session.rollback()
+        return {"success": False, "message": f"Error: {str(e)}"}
@@ -0,0 +1,160 @@
+import logging
+import threading
+
+from sqlalchemy import select, exists, func, update
+
+from app import db
+from models import Email, Category, UncategorizedEmail, email_categories
+from email_list import refresh_list_items
+
+logger = logging.getLogger(__name__)
+
+_checked = False
+_checked_lock = threading.Lock()
+
+def enqueue_emails(emails):
+    """Add emails to the uncategorized queue."""
+    rows = [{"email_id": email.id, "date_sent": email.date_sent} for email in emails]
+    if rows:
+        db.session.execute(UncategorizedEmail.__table__.insert(), rows)
+
+def dequeue_emails(email_ids):
+    """Remove emails that have just been categorized from the queue."""
+    email_ids = list(email_ids)
+    if email_ids:
+        db.session.execute(
+            UncategorizedEmail.__table__.delete().where(UncategorizedEmail.email_id.in_(email_ids))
+        )
+
+def dequeue_category_members(category_ids):
+    """Remove every queued email that now belongs to one of the given categories."""
+    if category_ids:
+        db.session.execute(
+            UncategorizedEmail.__table__.delete().where(UncategorizedEmail.email_id.in_(
+                select(email_categories.c.email_id).where(email_categories.c.category_id.in_(category_ids))
+            ))
+        )
+
+def requeue_if_uncategorized(email_ids):
+    """Queue any of the given emails that no longer have a category, e.g. after a category is deleted."""
+    email_ids = list(email_ids)
+    if not email_ids:
+        return
+
+    has_category = exists().where(email_categories.c.email_id == Email.id)
+    queued = exists().where(UncategorizedEmail.email_id == Email.id)
+    db.session.execute(
+        UncategorizedEmail.__table__.insert().from_select(
+            ['email_id', 'date_sent'],
+            select(Email.id, Email.date_sent).where(Email.id.in_(email_ids), ~has_category, ~queued)
+        )
+    )
+
+def rebuild_uncategorized_queue():
+    """
+    Rebuild the queue from scratch with a single anti-join.
+
+    Returns:
+        Number of queued emails
+    """
+    db.session.execute(UncategorizedEmail.__table__.delete())
+    has_category = exists().where(email_categories.c.email_id == Email.id)
+    result = db.session.execute(
+        UncategorizedEmail.__table__.insert().from_select(
+            ['email_id', 'date_sent'],
+            select(Email.id, Email.date_sent).where(~has_category)
+        )
+    )
+    db.session.commit()
+
+    logger.info(f"Rebuilt uncategorized queue with {result.rowcount} emails")
+    return result.rowcount
+
+def ensure_uncategorized_queue():
+    """Populate the queue once per process if it is empty but uncategorized emails exist."""
+    global _checked
+
+    with _checked_lock:
+        if _checked:
+            return
+        _checked = True
+
+        if db.session.query(UncategorizedEmail.email_id).first() is not None:
+            return
+        if db.session.query(Email.id).filter(~exists().where(email_categories.c.email_id == Email.id)).first():
+            rebuild_uncategorized_queue()
+
+def get_uncategorized_emails(limit=100):
+    """Return the newest queued emails, read through the queue's date index."""
+    ensure_uncategorized_queue()
+
+    return Email.query.join(
+        UncategorizedEmail, UncategorizedEmail.email_id == Email.id
+    ).order_by(UncategorizedEmail.date_sent.desc()).limit(limit).all()
+
+def count_uncategorized():
+    """Return the number of emails waiting to be categorized."""
+    ensure_uncategorized_queue()
+    return db.session.query(func.count(UncategorizedEmail.email_id)).scalar()
+
+def assign_categories(assignments, categories_by_name):
+    """
+    Link emails to categories with bulk inserts and take them off the queue.
+
+    Categories missing from categories_by_name are created and added to it.
+
+    Args:
+        assignments: Dict mapping email IDs to lists of category names
+        categories_by_name: Dict mapping category names to Category objects
+
+    Returns:
+        Number of emails categorized
+    """
+    assignments = {email_id: names for email_id, names in assignments.items() if names}
+    if not assignments:
+        return 0
+
+    new_categories = []
+    for names in assignments.values():
+        for name in names:
+            if name not in categories_by_name:
+                category = Category(name=name, assigned_count=0)
+                categories_by_name[name] = category
+                new_categories.append(category)
+    if new_categories:
+        db.session.add_all(new_categories)
+        db.session.flush()  # Generate IDs for new categories
+
+    rows = {
+        (email_id, categories_by_name[name].id)
+        for email_id, names in assignments.items()
+        for name in names
+    }
+
+    # Skip links that already exist so re-running a batch is harmless
+    existing = set(db.session.execute(
+        select(email_categories.c.email_id, email_categories.c.category_id).where(
+            email_categories.c.email_id.in_(list(assignments.keys()))
+        )
+    ).all())
+    rows -= existing
+
+    if rows:
+        db.session.execute(email_categories.insert(), [
+            {"email_id": email_id, "category_id": category_id} for email_id, category_id in rows
+        ])
+
+    counts = {}
+    for _, category_id in rows:
+        counts[category_id] = counts.get(category_id, 0) + 1
+    for category_id, count in counts.items():
+        db.session.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(assigned_count=func.coalesce(Category.assigned_count, 0) + count)
+            .execution_options(synchronize_session=False)
+        )
+
+    dequeue_emails(assignments.keys())
+    refresh_list_items(assignments.keys())
+    return len(assignments)